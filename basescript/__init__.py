@@ -1,4 +1,4 @@
 from __future__ import absolute_import
 
-from .basescript import BaseScript, main
+from .basescript import BaseScript, AsyncBaseScript, main
 from .log import init_logger, get_logger
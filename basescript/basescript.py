@@ -1,30 +1,169 @@
 from __future__ import absolute_import
 
+import os
 import sys
+import time
+import signal
+import inspect
 import argparse
 import socket
+import collections
 
-from .log import init_logger, pretty_print, ReadEnv
+from .log import init_logger, flush_logger, ReadEnv, LogConfigFile
+from .log import add_metric_exporters
+from .log import Stats, NullStats
+from .log import LOG_FILE_FORMATS, LOG_INDEX_EVERY, LOG_INDEX_INTERVAL
+from .log import LOG_SHIP_COMPRESSION, LOG_SHIP_BATCH_SIZE
+from .log import LOG_SHIP_BATCH_INTERVAL, LOG_SHIP_SPOOL_SIZE
+from .log import PROFILERS, PROFILE_INTERVAL, parse_address
+from .log import ASYNC_LOG_BUFFER_SIZE, ASYNC_LOG_OVERFLOW_POLICIES
+from .log import parse_metric_aggregates, METRIC_MAX_KEYS, JSON_SERIALIZERS
+from .log import EVENT_ID_GENERATORS, LOG_ROTATE_COMPRESSION, parse_size
+from .log import parse_log_sampling, parse_log_rate_limit
 from deeputil import Dummy
 
 
+def _key_value(value):
+    key, sep, v = value.partition("=")
+    if not sep or not key:
+        raise argparse.ArgumentTypeError("expected KEY=VALUE got %r" % value)
+    return key, v
+
+
+def _field_aggregates(value):
+    field, sep, aggregates = value.partition("=")
+    if not sep or not field:
+        raise argparse.ArgumentTypeError("expected FIELD=AGGREGATES got %r" % value)
+
+    try:
+        return field, parse_metric_aggregates(aggregates)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+class _LazyParser(object):
+    """
+    Stands in for the parser of a sub-command registered with
+    `add_lazy_parser` until it is needed, see `build`
+    """
+
+    def __init__(self, action, name, define, kwargs):
+        self._action = action
+        self._name = name
+        self._define = define
+        self._kwargs = kwargs
+        self._parser = None
+
+    def build(self):
+        """
+        Creates the actual parser, lets the sub-command define its
+        arguments on it and replaces this stand-in with it
+        """
+        if self._parser is not None:
+            return self._parser
+
+        kwargs = dict(self._kwargs)
+        aliases = kwargs.pop("aliases", ())
+        if kwargs.get("prog") is None:
+            kwargs["prog"] = "%s %s" % (self._action._prog_prefix, self._name)
+
+        parser = self._action._parser_class(**kwargs)
+        self._define(parser)
+
+        for name in (self._name,) + tuple(aliases):
+            self._action._name_parser_map[name] = parser
+
+        self._parser = parser
+        return parser
+
+    def parse_known_args(self, args=None, namespace=None):
+        return self.build().parse_known_args(args, namespace)
+
+    def __getattr__(self, attr):
+        return getattr(self.build(), attr)
+
+
+class LazySubParsersAction(argparse._SubParsersAction):
+    """
+    Sub-commands of a BaseScript. Besides `add_parser`, sub-commands can be
+    registered with `add_lazy_parser`, whose arguments are only defined
+    when that sub-command is selected, so scripts with many sub-commands
+    only pay for building the parser of the one being run.
+    """
+
+    def add_lazy_parser(self, name, define, **kwargs):
+        """
+        Registers the sub-command @name. @define(parser) is called with its
+        parser to add arguments and defaults (eg: func) once it is selected
+        or its help is shown. @kwargs are the same as for `add_parser`.
+        """
+        aliases = tuple(kwargs.get("aliases", ()))
+        for n in (name,) + aliases:
+            if n in self._name_parser_map:
+                raise argparse.ArgumentError(self, "conflicting subparser: %s" % n)
+
+        if "help" in kwargs:
+            help = kwargs.pop("help")
+            self._choices_actions.append(self._ChoicesPseudoAction(name, aliases, help))
+
+        parser = _LazyParser(self, name, define, kwargs)
+        for n in (name,) + aliases:
+            self._name_parser_map[n] = parser
+
+        return parser
+
+
+def _event_spec(parse):
+    """
+    argparse type for EVENT=SPEC values, with SPEC validated by @parse
+    """
+
+    def event_spec(value):
+        event, sep, spec = value.rpartition("=")
+        if not sep or not event:
+            raise argparse.ArgumentTypeError("expected EVENT=SPEC got %r" % value)
+
+        try:
+            parse(spec)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+
+        return event, spec
+
+    return event_spec
+
+
+def _timed_call(fn, item):
+    # module level so that it can be pickled for process pools
+    t = time.time()
+    result = fn(item)
+    return time.time() - t, result
+
+
 class BaseScript(object):
     DESC = "Base script abstraction"
     METRIC_GROUPING_INTERVAL = 1
+    LOG_FLUSH_TIMEOUT = 5
+    USE_UVLOOP = True
+    EXECUTORS = ("thread", "process")
+    PROFILE_TOP = 20
 
     def __init__(self, args=None):
         # argparse parser obj
         self.parser = argparse.ArgumentParser(description=self.DESC)
         self.define_baseargs(self.parser)
 
-        self.subcommands = self.parser.add_subparsers(title="commands")
+        self.subcommands = self.parser.add_subparsers(
+            title="commands", action=LazySubParsersAction
+        )
         self.subcommands.dest = "commands"
         self.subcommands.required = True
         self.define_subcommands(self.subcommands)
-        self.subcommand_run = self.subcommands.add_parser("run")
-        self.subcommand_run.set_defaults(func=self.run)
 
-        self.define_args(self.subcommand_run)
+        # built only when `run` is the selected sub-command
+        self.subcommand_run = self.subcommands.add_lazy_parser(
+            "run", self._define_run_args
+        )
 
         self.args = self.parser.parse_args(args=args)
 
@@ -54,6 +193,29 @@ class BaseScript(object):
             processors=self.define_log_processors(),
             metric_grouping_interval=self.args.metric_grouping_interval,
             minimal=self.args.minimal,
+            async_sink=self.args.log_async,
+            async_buffer_size=self.args.log_async_buffer_size,
+            async_overflow=self.args.log_async_overflow,
+            metric_aggregates=self.args.metric_aggregates,
+            metric_field_aggregates=dict(self.args.metric_field_aggregates),
+            metric_max_keys=self.args.metric_max_keys,
+            json_serializer=self.args.log_json_serializer,
+            event_id=self.args.log_event_id,
+            timestamp_cache=self.args.log_timestamp_cache,
+            compiled=self.args.log_compiled,
+            file_rotation=dict(
+                rotate_size=self.args.log_rotate_size,
+                rotate_interval=self.args.log_rotate_interval,
+                compress=self.args.log_rotate_compress,
+                keep=self.args.log_rotate_keep,
+                max_age=self.args.log_rotate_max_age,
+            ),
+            multiprocess=self.args.log_multiprocess,
+            log_sampling=dict(self.args.log_sample),
+            log_rate_limits=dict(self.args.log_rate_limit),
+            log_ship=self.define_log_ship(),
+            file_format=self.args.log_file_format,
+            file_index=self.define_log_index(),
         )
 
         self._flush_metrics_q = log._force_flush_q
@@ -62,7 +224,16 @@ class BaseScript(object):
         if self.args.env_file:
             ReadEnv(self.args.env_file)
 
-        self.stats = Dummy()
+        if self.args.log_config and not isinstance(log, Dummy):
+            LogConfigFile(self.args.log_config)
+
+        # stats are recorded into the grouped metrics, so are a no-op
+        # when metrics are not grouped
+        if self.args.metric_grouping_interval and not isinstance(log, Dummy):
+            self.stats = Stats(name=self.args.name)
+            add_metric_exporters(self.define_metric_exporters())
+        else:
+            self.stats = NullStats()
 
         args = {n: getattr(self.args, n) for n in vars(self.args)}
         args["func"] = self.args.func.__name__
@@ -72,9 +243,14 @@ class BaseScript(object):
         """
         Starts execution of the script
         """
+        profiler = self.start_profiler()
+
         # invoke the appropriate sub-command as requested from command-line
         try:
-            self.args.func()
+            if inspect.iscoroutinefunction(self.args.func):
+                self.run_coroutine(self.args.func)
+            else:
+                self.args.func()
         except SystemExit as e:
             if e.code != 0:
                 raise
@@ -84,11 +260,157 @@ class BaseScript(object):
             self.log.error("exited start function")
             raise
         finally:
-            self._flush_metrics_q.put(None, block=True)
-            self._flush_metrics_q.put(None, block=True, timeout=1)
+            if profiler is not None:
+                self.stop_profiler(profiler)
+
+            flush_logger(timeout=self.LOG_FLUSH_TIMEOUT)
 
         self.log.debug("exited_successfully")
 
+    def start_profiler(self):
+        """
+        Starts the profiler chosen with --profile, if any
+        """
+        if not self.args.profile:
+            return None
+
+        from .profiling import make_profiler
+
+        profiler = make_profiler(self.args.profile, self.args.profile_interval)
+        profiler.start()
+        return profiler
+
+    def stop_profiler(self, profiler):
+        """
+        Writes the profile to --profile-out and logs the PROFILE_TOP
+        hottest functions (or allocation sites) as "profile_top" metrics
+        """
+        profiler.stop()
+
+        path = self.args.profile_out
+        if not path:
+            from .profiling import default_profile_path
+
+            script = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+            path = default_profile_path(
+                script or "basescript", profiler.kind, profiler.ext
+            )
+
+        profiler.write(path)
+        self.log.info("profile written", profiler=profiler.kind, path=path)
+
+        for rank, fields in enumerate(profiler.top(self.PROFILE_TOP), 1):
+            self.log.info(
+                "profile_top",
+                type="metric",
+                profiler=profiler.kind,
+                # text, so that it groups rather than being aggregated
+                rank=str(rank),
+                **fields
+            )
+
+    def map(self, fn, items, workers=None, executor=None, max_inflight=None):
+        """
+        Yields fn(item) for each of @items, in order, computing them on a
+        pool of @workers threads or processes (@executor). At most
+        @max_inflight items (default 2 * workers) are submitted ahead of
+        the one being yielded, so @items may be an unbounded iterator.
+        The time taken per item is recorded as the "pool_item" metric.
+
+        Defaults come from --workers and --executor. On an exception,
+        including KeyboardInterrupt, items not yet started are cancelled.
+        """
+        workers = workers or self.args.workers or os.cpu_count() or 1
+        executor = executor or self.args.executor
+        max_inflight = max_inflight or 2 * workers
+        assert executor in self.EXECUTORS, "unknown executor %r" % executor
+
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+        pool_class = ThreadPoolExecutor if executor == "thread" else ProcessPoolExecutor
+        pool = pool_class(max_workers=workers)
+        name = getattr(fn, "__name__", repr(fn))
+
+        inflight = collections.deque()
+        items = iter(items)
+
+        try:
+            while True:
+                for item in items:
+                    inflight.append(pool.submit(_timed_call, fn, item))
+                    if len(inflight) >= max_inflight:
+                        break
+
+                if not inflight:
+                    break
+
+                duration, result = inflight.popleft().result()
+                self.log.info(
+                    "pool_item",
+                    type="metric",
+                    fn=name,
+                    executor=executor,
+                    duration=duration,
+                )
+                yield result
+        finally:
+            for f in inflight:
+                f.cancel()
+            pool.shutdown(wait=True)
+
+    def new_event_loop(self):
+        """
+        Event loop for `async def` sub-commands, uvloop when installed
+        """
+        import asyncio
+
+        if self.USE_UVLOOP:
+            try:
+                import uvloop
+
+                return uvloop.new_event_loop()
+            except ImportError:
+                pass
+
+        return asyncio.new_event_loop()
+
+    def run_coroutine(self, func):
+        """
+        Runs the coroutine function @func on a new event loop. SIGINT and
+        SIGTERM cancel it; tasks still pending afterwards are cancelled
+        before the loop is closed.
+        """
+        # asyncio is slow to import, only scripts using it pay for it
+        import asyncio
+
+        loop = self.new_event_loop()
+        asyncio.set_event_loop(loop)
+        task = loop.create_task(func())
+
+        signals = (signal.SIGINT, signal.SIGTERM)
+        for sig in signals:
+            loop.add_signal_handler(sig, task.cancel)
+
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            self.log.warning("exited via signal")
+        finally:
+            for sig in signals:
+                loop.remove_signal_handler(sig)
+
+            # python < 3.7 has no asyncio.all_tasks
+            all_tasks = getattr(asyncio, "all_tasks", None) or asyncio.Task.all_tasks
+            pending = [t for t in all_tasks(loop) if not t.done()]
+            for t in pending:
+                t.cancel()
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            if hasattr(loop, "shutdown_asyncgens"):
+                loop.run_until_complete(loop.shutdown_asyncgens())
+
+            asyncio.set_event_loop(None)
+            loop.close()
+
     @property
     def name(self):
         return ".".join([x for x in (sys.argv[0].split(".")[0], self.args.name) if x])
@@ -101,6 +423,67 @@ class BaseScript(object):
         """
         return []
 
+    def define_log_index(self):
+        """
+        Options of the index of the log file, None for no index.
+        By default from the --log-index args.
+        """
+        if not self.args.log_index:
+            return None
+
+        return dict(
+            every=self.args.log_index_every, interval=self.args.log_index_interval
+        )
+
+    def define_log_ship(self):
+        """
+        Options of the `LogShipper` sending logs to a collector,
+        None for no shipping. By default from the --log-ship args.
+        """
+        if not self.args.log_ship:
+            return None
+
+        return dict(
+            url=self.args.log_ship,
+            batch_size=self.args.log_ship_batch_size,
+            batch_interval=self.args.log_ship_batch_interval,
+            compress=self.args.log_ship_compress,
+            spool=self.args.log_ship_spool,
+            spool_size=self.args.log_ship_spool_size,
+        )
+
+    def define_metric_exporters(self):
+        """
+        Exporters sent the grouped metrics of every interval besides
+        the log, see `basescript.exporters`. By default those chosen
+        with --metric-statsd and --metric-prometheus.
+        """
+        exporters = []
+        if not self.args.metric_grouping_interval:
+            return exporters
+
+        if self.args.metric_statsd or self.args.metric_prometheus:
+            from .exporters import StatsdExporter, PrometheusExporter
+
+        if self.args.metric_statsd:
+            host, port = self.args.metric_statsd
+            exporters.append(
+                StatsdExporter(
+                    host,
+                    port,
+                    prefix=self.args.metric_prefix,
+                    dogstatsd=self.args.metric_dogstatsd,
+                )
+            )
+
+        if self.args.metric_prometheus:
+            host, port = self.args.metric_prometheus
+            exporters.append(
+                PrometheusExporter(port, host=host, prefix=self.args.metric_prefix)
+            )
+
+        return exporters
+
     def define_subcommands(self, subcommands):
         """
         Define subcommands (as defined at https://docs.python.org/2/library/argparse.html#sub-commands)
@@ -109,8 +492,44 @@ class BaseScript(object):
 
         blah_command = subcommands.add_parser('blah')
         blah_command.set_defaults(func=fn_blah)
+
+        Sub-commands with many arguments, or scripts with many sub-commands,
+        can register them lazily so that their arguments are only defined
+        when the sub-command is run
+
+        def define_blah_args(parser):
+            parser.add_argument('--count', type=int)
+            parser.set_defaults(func=fn_blah)
+
+        subcommands.add_lazy_parser('blah', define_blah_args, help='Does blah')
+        """
+        subcommands.add_lazy_parser("pretty", self.define_pretty_args)
+        subcommands.add_lazy_parser(
+            "metrics",
+            self.define_metrics_args,
+            help="Aggregate grouped metrics from log files",
+        )
+        subcommands.add_lazy_parser(
+            "convert",
+            self.define_convert_args,
+            help="Convert log files between the json and binary formats",
+        )
+
+    def _define_run_args(self, parser):
+        parser.set_defaults(func=self.run)
+        self.define_args(parser)
+
+    def define_pretty_args(self, pretty_cmd):
+        """
+        Arguments of the `pretty` sub-command
         """
-        pretty_cmd = subcommands.add_parser("pretty")
+        from .pretty import READ_CHUNK_SIZE, LEVELS
+
+        pretty_cmd.add_argument(
+            "files",
+            nargs="*",
+            help="JSON or binary log files, *.gz included, default: stdin",
+        )
         pretty_cmd.add_argument(
             "-c",
             "--no-colors",
@@ -118,11 +537,200 @@ class BaseScript(object):
             default=False,
             help="Do not emit colored output",
         )
+        pretty_cmd.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=None,
+            help="Processes used to render logs, default: number of cpus",
+        )
+        pretty_cmd.add_argument(
+            "--chunk-size",
+            type=parse_size,
+            default=READ_CHUNK_SIZE,
+            help="Bytes of log lines rendered per job ex:4M, default: %(default)s",
+        )
+
+        pretty_cmd.add_argument(
+            "--level",
+            dest="filter_level",
+            default=None,
+            choices=sorted(LEVELS),
+            help="Only events at this level or above",
+        )
+        pretty_cmd.add_argument(
+            "--event",
+            dest="events",
+            default=[],
+            action="append",
+            help="Only events with this name, can be repeated",
+        )
+        pretty_cmd.add_argument(
+            "--where",
+            default=[],
+            action="append",
+            type=_key_value,
+            metavar="KEY=VALUE",
+            help="Only events where KEY has VALUE ex:type=metric, can be repeated",
+        )
+        pretty_cmd.add_argument(
+            "--since",
+            default=None,
+            help="Only events at or after this iso timestamp ex:2018-03-01T10:00",
+        )
+        pretty_cmd.add_argument(
+            "--until",
+            default=None,
+            help="Only events before this iso timestamp",
+        )
+        pretty_cmd.add_argument(
+            "-f",
+            "--follow",
+            default=False,
+            action="store_true",
+            help="Keep rendering lines appended to the file (default: --log-file)",
+        )
+
+        pretty_cmd.set_defaults(func=self.pretty)
+
+    def define_metrics_args(self, metrics_cmd):
+        """
+        Arguments of the `metrics` sub-command
+        """
+        from .rollup import ROLLUP_FORMATS
+
+        metrics_cmd.add_argument(
+            "files",
+            nargs="*",
+            help="JSON or binary log files, *.gz included, default: stdin",
+        )
+        metrics_cmd.add_argument(
+            "--by",
+            default="event",
+            type=lambda v: [k for k in v.split(",") if k],
+            help="Comma separated keys to group by ex:event,host, default: event",
+        )
+        metrics_cmd.add_argument(
+            "--interval",
+            default=None,
+            type=int,
+            help="Also group into time buckets of this many seconds ex:3600",
+        )
+        metrics_cmd.add_argument(
+            "--format",
+            dest="rollup_format",
+            default="json",
+            choices=ROLLUP_FORMATS,
+            help="Output format, default: %(default)s",
+        )
+        metrics_cmd.add_argument(
+            "--event",
+            dest="events",
+            default=[],
+            action="append",
+            help="Only metrics with this event name, can be repeated",
+        )
+        metrics_cmd.add_argument(
+            "--since",
+            default=None,
+            help="Only metrics at or after this iso timestamp ex:2018-03-01T10:00",
+        )
+        metrics_cmd.add_argument(
+            "--until",
+            default=None,
+            help="Only metrics before this iso timestamp",
+        )
+        metrics_cmd.set_defaults(func=self.metrics)
+
+    def define_convert_args(self, convert_cmd):
+        """
+        Arguments of the `convert` sub-command
+        """
+        convert_cmd.add_argument(
+            "files",
+            nargs="*",
+            help="JSON or binary log files, *.gz included, default: stdin",
+        )
+        convert_cmd.add_argument(
+            "--to",
+            default="json",
+            choices=LOG_FILE_FORMATS,
+            help="Format written, default: %(default)s",
+        )
+        convert_cmd.add_argument(
+            "-o",
+            "--out",
+            default=None,
+            help="File written to, default: stdout",
+        )
+        convert_cmd.set_defaults(func=self.convert)
+
+    def pretty(self):
+        """
+        Logic of the `pretty` sub-command
+        """
+        from .pretty import pretty_print, LogFilter
+
+        args = self.args
+        log_filter = LogFilter(
+            level=args.filter_level,
+            events=args.events,
+            where=args.where,
+            since=args.since,
+            until=args.until,
+        )
 
-        pretty_cmd.set_defaults(
-            func=lambda: pretty_print(colors=not self.args.no_colors)
+        follow_path = None
+        if args.follow:
+            follow_path = (args.files or [args.log_file])[-1]
+            if not follow_path or follow_path == "-":
+                self.parser.error("--follow needs a log file")
+
+        pretty_print(
+            colors=not args.no_colors,
+            paths=args.files,
+            workers=args.jobs,
+            chunk_size=args.chunk_size,
+            log_filter=log_filter,
+            follow_path=follow_path,
+        )
+
+    def metrics(self):
+        """
+        Logic of the `metrics` sub-command
+        """
+        from .pretty import LogFilter
+        from .rollup import rollup_metrics
+
+        args = self.args
+        log_filter = LogFilter(
+            events=args.events,
+            where={"type": "metric"},
+            since=args.since,
+            until=args.until,
         )
 
+        rollup_metrics(
+            args.files,
+            by=args.by,
+            interval=args.interval,
+            fmt=args.rollup_format,
+            log_filter=log_filter,
+        )
+
+    def convert(self):
+        """
+        Logic of the `convert` sub-command
+        """
+        from .binlog import convert_logs
+
+        args = self.args
+        if not args.out:
+            return convert_logs(args.files, to=args.to)
+
+        with open(args.out, "wb") as out:
+            convert_logs(args.files, to=args.to, out=out)
+
     def define_baseargs(self, parser):
         """
         Define basic command-line arguments required by the script.
@@ -153,6 +761,110 @@ class BaseScript(object):
             default=None,
             help="Writes logs to log file if specified, default: %(default)s",
         )
+        parser.add_argument(
+            "--log-file-format",
+            default="json",
+            choices=LOG_FILE_FORMATS,
+            help=(
+                "Format of --log-file, binary is smaller and faster to write, "
+                "read it with the pretty or convert sub-commands, "
+                "default: %(default)s"
+            ),
+        )
+        parser.add_argument(
+            "--log-index",
+            default=False,
+            action="store_true",
+            help=(
+                "Keep a sparse index of --log-file in <log-file>.idx, used by "
+                "the pretty and metrics sub-commands to find events by time "
+                "and name without reading the whole file"
+            ),
+        )
+        parser.add_argument(
+            "--log-index-every",
+            default=LOG_INDEX_EVERY,
+            type=int,
+            help="Log records per index entry at most, default: %(default)s",
+        )
+        parser.add_argument(
+            "--log-index-interval",
+            default=LOG_INDEX_INTERVAL,
+            type=int,
+            help="Seconds of logs per index entry at most, default: %(default)s",
+        )
+        parser.add_argument(
+            "--log-rotate-size",
+            default=None,
+            type=parse_size,
+            help="Rotate the log file once it reaches this size ex:100M, 1G",
+        )
+        parser.add_argument(
+            "--log-rotate-interval",
+            default=None,
+            type=int,
+            help="Rotate the log file every interval ex:3600 i.e;(hourly)",
+        )
+        parser.add_argument(
+            "--log-rotate-compress",
+            default=None,
+            choices=LOG_ROTATE_COMPRESSION,
+            help="Compress rotated log files in the background",
+        )
+        parser.add_argument(
+            "--log-rotate-keep",
+            default=None,
+            type=int,
+            help="Number of rotated log files to keep, default: all",
+        )
+        parser.add_argument(
+            "--log-rotate-max-age",
+            default=None,
+            type=int,
+            help="Delete rotated log files older than this many seconds",
+        )
+        parser.add_argument(
+            "--log-json-serializer",
+            default="json",
+            choices=JSON_SERIALIZERS,
+            help=(
+                "Library used to write json logs, auto picks the fastest "
+                "installed, default: %(default)s"
+            ),
+        )
+        parser.add_argument(
+            "--log-event-id",
+            default="uuid",
+            choices=EVENT_ID_GENERATORS,
+            help=(
+                "How log event ids are generated, counter is a per process "
+                "prefix and counter, default: %(default)s"
+            ),
+        )
+        parser.add_argument(
+            "--log-timestamp-cache",
+            default=False,
+            action="store_true",
+            help="Reuse the formatted timestamp of the current second",
+        )
+        parser.add_argument(
+            "--log-compiled",
+            default=False,
+            action="store_true",
+            help=(
+                "Fuse the default log processors into one and make logging "
+                "at disabled levels a no-op"
+            ),
+        )
+        parser.add_argument(
+            "--log-multiprocess",
+            default=False,
+            action="store_true",
+            help=(
+                "Forked child processes send their logs and metrics to "
+                "this process instead of writing them directly"
+            ),
+        )
         parser.add_argument(
             "--quiet",
             default=False,
@@ -165,6 +877,73 @@ class BaseScript(object):
             type=int,
             help="To group metrics based on time interval ex:10 i.e;(10 sec)",
         )
+        parser.add_argument(
+            "--metric-aggregates",
+            default="avg",
+            type=parse_metric_aggregates,
+            help=(
+                "Aggregates reported for numeric fields of grouped metrics "
+                "out of avg,sum,min,max,count,p<percent> ex:avg,max,p99, "
+                "default: %(default)s"
+            ),
+        )
+        parser.add_argument(
+            "--metric-field-aggregates",
+            default=[],
+            action="append",
+            type=_field_aggregates,
+            metavar="FIELD=AGGREGATES",
+            help="Overrides --metric-aggregates for one field ex:latency=p50,p99",
+        )
+        parser.add_argument(
+            "--metric-max-keys",
+            default=METRIC_MAX_KEYS,
+            type=int,
+            help=(
+                "Max distinct groups per metric event in an interval, the rest "
+                "are grouped as __other__. 0 for no limit, default: %(default)s"
+            ),
+        )
+        parser.add_argument(
+            "--metric-statsd",
+            default=None,
+            type=parse_address,
+            metavar="HOST:PORT",
+            help="Also send grouped metrics to StatsD over UDP ex:localhost:8125",
+        )
+        parser.add_argument(
+            "--metric-dogstatsd",
+            default=False,
+            action="store_true",
+            help="Send --metric-statsd metrics with DogStatsD tags",
+        )
+        parser.add_argument(
+            "--metric-prometheus",
+            default=None,
+            type=parse_address,
+            metavar="[HOST:]PORT",
+            help=(
+                "Serve grouped metrics for Prometheus at "
+                "http://HOST:PORT/metrics, default host: 127.0.0.1"
+            ),
+        )
+        parser.add_argument(
+            "--metric-prefix",
+            default="",
+            help="Prefix of metric names sent to StatsD and Prometheus ex:myapp.",
+        )
+        parser.add_argument(
+            "--workers",
+            default=None,
+            type=int,
+            help="Number of workers used by `map`, default: number of cpus",
+        )
+        parser.add_argument(
+            "--executor",
+            default="thread",
+            choices=self.EXECUTORS,
+            help="Run `map` workers as threads or processes, default: %(default)s",
+        )
         parser.add_argument(
             "--debug",
             default=False,
@@ -177,6 +956,116 @@ class BaseScript(object):
             action="store_true",
             help="Hide log keys such as id, host",
         )
+        parser.add_argument(
+            "--log-async",
+            default=False,
+            action="store_true",
+            help="Write logs from a background thread in batches",
+        )
+        parser.add_argument(
+            "--log-async-buffer-size",
+            default=ASYNC_LOG_BUFFER_SIZE,
+            type=int,
+            help="Max log lines held in memory with --log-async, default: %(default)s",
+        )
+        parser.add_argument(
+            "--log-async-overflow",
+            default="block",
+            choices=ASYNC_LOG_OVERFLOW_POLICIES,
+            help="What to do when the --log-async buffer is full, default: %(default)s",
+        )
+        parser.add_argument(
+            "--log-ship",
+            default=None,
+            metavar="URL",
+            help=(
+                "Also send json logs to a collector, "
+                "ex:tcp://host:5170, udp://host:5170, http://host:8080/logs"
+            ),
+        )
+        parser.add_argument(
+            "--log-ship-spool",
+            default=None,
+            metavar="PATH",
+            help="File holding logs while the --log-ship collector is unreachable",
+        )
+        parser.add_argument(
+            "--log-ship-spool-size",
+            default=LOG_SHIP_SPOOL_SIZE,
+            type=parse_size,
+            help="Max size of the --log-ship-spool ex:512M, default: %(default)s",
+        )
+        parser.add_argument(
+            "--log-ship-batch-size",
+            default=LOG_SHIP_BATCH_SIZE,
+            type=int,
+            help="Max log lines shipped together, default: %(default)s",
+        )
+        parser.add_argument(
+            "--log-ship-batch-interval",
+            default=LOG_SHIP_BATCH_INTERVAL,
+            type=float,
+            help="Max seconds before shipping buffered logs, default: %(default)s",
+        )
+        parser.add_argument(
+            "--log-ship-compress",
+            default="gzip",
+            choices=LOG_SHIP_COMPRESSION,
+            help="Compression of shipped batches, default: %(default)s",
+        )
+        parser.add_argument(
+            "--log-sample",
+            default=[],
+            action="append",
+            type=_event_spec(parse_log_sampling),
+            metavar="EVENT=1/N|PROBABILITY",
+            help=(
+                "Keep one in N, or a fraction, of the log events with this name "
+                "ex:'cache hit=1/100', '*' for all other debug/info events"
+            ),
+        )
+        parser.add_argument(
+            "--log-rate-limit",
+            default=[],
+            action="append",
+            type=_event_spec(parse_log_rate_limit),
+            metavar="EVENT=N/s|N/m|N/h",
+            help=(
+                "Keep at most N log events with this name per second/minute/hour "
+                "ex:'request failed=10/s', '*' for all other debug/info events"
+            ),
+        )
+        parser.add_argument(
+            "--log-config",
+            default=None,
+            help=(
+                "YAML file of level, log_sampling, log_rate_limits and "
+                "metric_grouping_interval, re-read on SIGUSR1"
+            ),
+        )
+        parser.add_argument(
+            "--profile",
+            default=None,
+            choices=PROFILERS,
+            help=(
+                "Profile the sub-command: cpu samples stacks periodically, "
+                "cprofile traces every call, alloc traces memory allocations"
+            ),
+        )
+        parser.add_argument(
+            "--profile-out",
+            default=None,
+            help=(
+                "File the profile is written to, collapsed stacks for cpu and "
+                "alloc, pstats for cprofile, default: <script>-<profile>-<pid>.*"
+            ),
+        )
+        parser.add_argument(
+            "--profile-interval",
+            default=PROFILE_INTERVAL,
+            type=float,
+            help="Seconds between stack samples of --profile cpu, default: %(default)s",
+        )
         parser.add_argument(
             "--env-file",
             default=None,
@@ -203,5 +1092,24 @@ class BaseScript(object):
         pass
 
 
+class AsyncBaseScript(BaseScript):
+    """
+    BaseScript for asyncio programs. Define `run` (and sub-commands) as
+    `async def`; they run on a managed event loop, see `run_coroutine`.
+    Logs are written from a background thread by default and lines are
+    dropped rather than blocking the loop when the buffer is full.
+    """
+
+    def define_baseargs(self, parser):
+        super(AsyncBaseScript, self).define_baseargs(parser)
+        parser.set_defaults(log_async=True, log_async_overflow="drop-oldest")
+
+    async def run(self):
+        """
+        Override this coroutine to define logic for `run` sub-command
+        """
+        pass
+
+
 def main():
     BaseScript().start()
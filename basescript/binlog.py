@@ -0,0 +1,493 @@
+"""
+Compact binary log format, see `FileWrapper(fmt="binary")`.
+
+A file is `BINLOG_MAGIC` followed by records, each a varint length and
+that many bytes starting with the kind of record:
+    "K" defines the next key id (0, 1, 2 ...) as the utf-8 name following
+    "E" is an event: a msgpack map of key id to value
+Keys are defined just before the first event using them, so repeated keys
+such as timestamp, level, host and id cost a byte or two per event. The
+magic is written again whenever a writer (re)opens the file, eg: after a
+restart or logrotate, and resets the key ids; so files can be appended to
+and concatenated. Nested dicts keep their keys as msgpack strings.
+
+The msgpack package is used when it is installed, otherwise a pure python
+implementation of the subset of msgpack written here.
+"""
+
+import struct
+import importlib
+
+# starts with a zero byte, which no record length does
+BINLOG_MAGIC = b"\x00BSLOG1\n"
+
+_KEY = b"K"
+_EVENT = b"E"
+
+# distinct key orders of events remembered by an encoder
+BINLOG_SHAPE_CACHE_SIZE = 1024
+
+# bytes after a magic in which the records following a reset of the keys
+# are looked for, see `last_magic_offset`
+BINLOG_RESET_PEEK = 1 << 16
+
+_FLOAT = struct.Struct(">d")
+_PACKED = {
+    0xCA: struct.Struct(">f"),
+    0xCB: _FLOAT,
+    0xCC: struct.Struct(">B"),
+    0xCD: struct.Struct(">H"),
+    0xCE: struct.Struct(">I"),
+    0xCF: struct.Struct(">Q"),
+    0xD0: struct.Struct(">b"),
+    0xD1: struct.Struct(">h"),
+    0xD2: struct.Struct(">i"),
+    0xD3: struct.Struct(">q"),
+}
+
+# type byte -> (length, kind) of strings, binaries, arrays and maps
+_SIZED = {
+    0xD9: (_PACKED[0xCC], "str"),
+    0xDA: (_PACKED[0xCD], "str"),
+    0xDB: (_PACKED[0xCE], "str"),
+    0xC4: (_PACKED[0xCC], "bin"),
+    0xC5: (_PACKED[0xCD], "bin"),
+    0xC6: (_PACKED[0xCE], "bin"),
+    0xDC: (_PACKED[0xCD], "array"),
+    0xDD: (_PACKED[0xCE], "array"),
+    0xDE: (_PACKED[0xCD], "map"),
+    0xDF: (_PACKED[0xCE], "map"),
+}
+
+
+def _import_msgpack():
+    try:
+        return importlib.import_module("msgpack")
+    except ImportError:
+        return None
+
+
+def is_binary_log(head):
+    """
+    Whether @head, the first bytes of a file, are those of a binary log
+    """
+    return head[: len(BINLOG_MAGIC)] == BINLOG_MAGIC
+
+
+def _varint(n):
+    out = bytearray()
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+_SMALL_VARINTS = [bytes((n,)) for n in range(0x80)]
+
+
+def _read_varint(data, pos):
+    """
+    Returns (value, position after it), or (None, @pos) if incomplete
+    """
+    n = shift = 0
+    start = pos
+    while pos < len(data):
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+    return None, start
+
+
+def _pack(value, out, default):
+    """
+    Appends @value as msgpack to the bytearray @out. Values of other types
+    are replaced by default(value), and its repr if that does not help.
+    """
+    t = type(value)
+    if t is str:
+        data = value.encode("utf-8", "surrogatepass")
+        n = len(data)
+        if n < 32:
+            out.append(0xA0 | n)
+        elif n < 0x100:
+            out += b"\xd9" + _PACKED[0xCC].pack(n)
+        elif n < 0x10000:
+            out += b"\xda" + _PACKED[0xCD].pack(n)
+        else:
+            out += b"\xdb" + _PACKED[0xCE].pack(n)
+        out += data
+    elif t is int:
+        if 0 <= value < 0x80:
+            out.append(value)
+        elif -32 <= value < 0:
+            out.append(value & 0xFF)
+        elif 0 <= value < 1 << 64:
+            for code, limit in ((0xCC, 8), (0xCD, 16), (0xCE, 32), (0xCF, 64)):
+                if value < 1 << limit:
+                    out.append(code)
+                    out += _PACKED[code].pack(value)
+                    break
+        elif -(1 << 63) <= value < 0:
+            for code, limit in ((0xD0, 7), (0xD1, 15), (0xD2, 31), (0xD3, 63)):
+                if value >= -(1 << limit):
+                    out.append(code)
+                    out += _PACKED[code].pack(value)
+                    break
+        else:
+            _pack(str(value), out, default)
+    elif t is float:
+        out.append(0xCB)
+        out += _FLOAT.pack(value)
+    elif value is None:
+        out.append(0xC0)
+    elif t is bool:
+        out.append(0xC3 if value else 0xC2)
+    elif t is dict:
+        n = len(value)
+        if n < 16:
+            out.append(0x80 | n)
+        elif n < 0x10000:
+            out += b"\xde" + _PACKED[0xCD].pack(n)
+        else:
+            out += b"\xdf" + _PACKED[0xCE].pack(n)
+        for k, v in value.items():
+            _pack(k, out, default)
+            _pack(v, out, default)
+    elif t in (list, tuple):
+        n = len(value)
+        if n < 16:
+            out.append(0x90 | n)
+        elif n < 0x10000:
+            out += b"\xdc" + _PACKED[0xCD].pack(n)
+        else:
+            out += b"\xdd" + _PACKED[0xCE].pack(n)
+        for v in value:
+            _pack(v, out, default)
+    elif t in (bytes, bytearray):
+        n = len(value)
+        if n < 0x100:
+            out += b"\xc4" + _PACKED[0xCC].pack(n)
+        elif n < 0x10000:
+            out += b"\xc5" + _PACKED[0xCD].pack(n)
+        else:
+            out += b"\xc6" + _PACKED[0xCE].pack(n)
+        out += value
+    else:
+        # subclasses of the types above, and everything else
+        for base in (bool, int, float, str, dict, list, tuple, bytes):
+            if isinstance(value, base):
+                return _pack(base(value), out, default)
+
+        replaced = default(value) if default is not None else None
+        if replaced is None or type(replaced) is t:
+            replaced = repr(value)
+        _pack(replaced, out, None)
+
+
+def _unpack(data, pos):
+    """
+    Returns the msgpack value at @pos of @data and the position after it
+    """
+    b = data[pos]
+    pos += 1
+
+    if b < 0x80:
+        return b, pos
+    if b >= 0xE0:
+        return b - 0x100, pos
+    if 0xA0 <= b < 0xC0:
+        n = b & 0x1F
+        return data[pos : pos + n].decode("utf-8", "surrogatepass"), pos + n
+    if 0x80 <= b < 0x90:
+        return _unpack_map(data, pos, b & 0x0F)
+    if 0x90 <= b < 0xA0:
+        return _unpack_array(data, pos, b & 0x0F)
+
+    if b == 0xC0:
+        return None, pos
+    if b == 0xC2:
+        return False, pos
+    if b == 0xC3:
+        return True, pos
+
+    packed = _PACKED.get(b)
+    if packed is not None:
+        return packed.unpack_from(data, pos)[0], pos + packed.size
+
+    sized = _SIZED.get(b)
+    if sized is None:
+        raise ValueError("unsupported msgpack type 0x%02x" % b)
+
+    size, kind = sized
+    n = size.unpack_from(data, pos)[0]
+    pos += size.size
+
+    if kind == "array":
+        return _unpack_array(data, pos, n)
+    if kind == "map":
+        return _unpack_map(data, pos, n)
+
+    value = data[pos : pos + n]
+    if kind == "str":
+        value = value.decode("utf-8", "surrogatepass")
+    return value, pos + n
+
+
+def _unpack_map(data, pos, n):
+    m = {}
+    for _ in range(n):
+        k, pos = _unpack(data, pos)
+        v, pos = _unpack(data, pos)
+        m[k] = v
+    return m, pos
+
+
+def _unpack_array(data, pos, n):
+    a = []
+    for _ in range(n):
+        v, pos = _unpack(data, pos)
+        a.append(v)
+    return a, pos
+
+
+def _pure_packb(default):
+    def packb(value):
+        out = bytearray()
+        _pack(value, out, default)
+        return bytes(out)
+
+    return packb
+
+
+def _pure_unpackb(data):
+    return _unpack(data, 0)[0]
+
+
+def _is_reset(data):
+    """
+    Whether @data, which follows the bytes of a magic, is what a writer
+    writes after resetting its keys: the definitions of keys 0, 1 ...
+    followed by the event which uses all of them. Else the magic may be
+    bytes of an event.
+    """
+    pos = defined = 0
+    while True:
+        n, start = _read_varint(data, pos)
+        if not n or start + n > len(data):
+            return False
+
+        kind = data[start : start + 1]
+        if kind == _KEY:
+            defined += 1
+        elif kind != _EVENT or not defined:
+            return False
+        else:
+            try:
+                ids = _pure_unpackb(data[start + 1 : start + n])
+            except (ValueError, IndexError, KeyError, struct.error):
+                return False
+            return isinstance(ids, dict) and set(ids) == set(range(defined))
+
+        pos = start + n
+
+
+def last_magic_offset(f, size, chunk_size=1 << 20):
+    """
+    Offset of the last `BINLOG_MAGIC` in the first @size bytes of binary
+    log @f which certainly resets the keys, from where the keys used by
+    the records after it can be learned. Reads @f backwards in chunks of
+    @chunk_size bytes.
+    """
+    magic = len(BINLOG_MAGIC)
+    pos = size
+    while pos > 0:
+        start = max(0, pos - chunk_size)
+        f.seek(start)
+        data = f.read(pos - start + magic + BINLOG_RESET_PEEK)
+
+        # magics starting in this chunk
+        i = data.rfind(BINLOG_MAGIC, 0, pos - start - 1 + magic)
+        while i >= 0:
+            if start + i == 0 or _is_reset(data[i + magic :]):
+                return start + i
+            i = data.rfind(BINLOG_MAGIC, 0, i - 1 + magic)
+
+        pos = start
+
+    return 0
+
+
+class BinaryLogEncoder(object):
+    """
+    Encodes event dicts into records of one binary log file. Not thread
+    safe; `FileWrapper` encodes under its lock. @default converts values
+    of types msgpack does not support, as for json.
+    """
+
+    def __init__(self, default=None):
+        self.keys = {}
+
+        # key ids of the events seen with the same keys in the same order
+        self.shapes = {}
+
+        self._pure_packb = _pure_packb(default)
+        self._packb = self._pure_packb
+
+        msgpack = _import_msgpack()
+        if msgpack is not None:
+            self._packb = msgpack.Packer(
+                default=default, use_bin_type=True, autoreset=True
+            ).pack
+
+    def reset(self):
+        """
+        Forgets the key ids, returns the magic that starts a file or
+        tells readers to do the same
+        """
+        self.keys = {}
+        self.shapes = {}
+        return BINLOG_MAGIC
+
+    def _define(self, shape):
+        """
+        Returns the records defining keys of @shape not defined
+        yet, and the key ids of @shape
+        """
+        keys = self.keys
+        defs = []
+        for k in shape:
+            if k not in keys:
+                keys[k] = len(keys)
+                name = str(k).encode("utf-8", "surrogatepass")
+                defs.append(_varint(len(name) + 1) + _KEY + name)
+
+        if len(self.shapes) >= BINLOG_SHAPE_CACHE_SIZE:
+            self.shapes.clear()
+        ids = self.shapes[shape] = tuple(keys[k] for k in shape)
+        return b"".join(defs), ids
+
+    def encode(self, event):
+        shape = tuple(event)
+        ids = self.shapes.get(shape)
+        defs = b""
+        if ids is None:
+            defs, ids = self._define(shape)
+
+        m = dict(zip(ids, event.values()))
+        try:
+            body = self._packb(m)
+        except (TypeError, ValueError, OverflowError):
+            # eg: ints beyond 64 bits, which are written as strings
+            body = self._pure_packb(m)
+
+        n = len(body) + 1
+        head = _SMALL_VARINTS[n] if n < 0x80 else _varint(n)
+        return b"".join((defs, head, _EVENT, body))
+
+
+class BinaryLogDecoder(object):
+    """
+    Decodes a binary log fed to it in chunks of any size, keeping
+    incomplete records until the rest is fed.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.buf = b""
+
+        msgpack = _import_msgpack()
+        self._unpackb = _pure_unpackb
+        if msgpack is not None:
+            # keys are ints, which older msgpack versions allowed by default
+            try:
+                msgpack.unpackb(b"\x80", strict_map_key=False)
+                kw = dict(raw=False, strict_map_key=False)
+            except TypeError:
+                kw = dict(raw=False)
+            self._unpackb = lambda data: msgpack.unpackb(data, **kw)
+
+    def feed(self, data, skip_events=False):
+        """
+        Returns the events completed by @data, with @skip_events only
+        learning keys eg: to catch up with a file being followed
+        """
+        buf = self.buf + data if self.buf else data
+        events = []
+        keys = self.keys
+        pos = 0
+        end = len(buf)
+        magic = len(BINLOG_MAGIC)
+
+        while pos < end:
+            if buf[pos] == 0:
+                if end - pos < magic:
+                    break
+                if buf[pos : pos + magic] != BINLOG_MAGIC:
+                    raise ValueError("not a binary log at byte %d" % pos)
+                keys = self.keys = []
+                pos += magic
+                continue
+
+            n, start = _read_varint(buf, pos)
+            if n is None or start + n > end:
+                break
+
+            kind = buf[start : start + 1]
+            if kind == _EVENT:
+                if not skip_events:
+                    m = self._unpackb(buf[start + 1 : start + n])
+                    events.append({keys[i]: v for i, v in m.items()})
+            elif kind == _KEY:
+                keys.append(buf[start + 1 : start + n].decode("utf-8", "surrogatepass"))
+            # records of other kinds, from later versions, are skipped
+
+            pos = start + n
+
+        self.buf = buf[pos:]
+        return events
+
+
+def convert_logs(paths=None, to="json", out=None, chunk_size=None):
+    """
+    Writes the events of log files @paths (default stdin), json or binary,
+    to the binary file object @out (default stdout) in format @to
+    """
+    import json
+    import sys
+
+    from .log import LOG_FILE_FORMATS
+    from .pretty import read_chunks, READ_CHUNK_SIZE
+
+    assert to in LOG_FILE_FORMATS, "unknown log format %r" % to
+
+    out = out or getattr(sys.stdout, "buffer", sys.stdout)
+    encoder = None
+    if to == "binary":
+        encoder = BinaryLogEncoder(default=repr)
+        out.write(encoder.reset())
+
+    for lines in read_chunks(paths, chunk_size or READ_CHUNK_SIZE):
+        data = []
+        for line in lines:
+            if isinstance(line, dict):
+                event = line
+            else:
+                try:
+                    event = json.loads(line.decode("utf-8", "replace"))
+                except ValueError:
+                    continue
+                if not isinstance(event, dict):
+                    continue
+
+            if encoder is not None:
+                data.append(encoder.encode(event))
+            else:
+                data.append((json.dumps(event, default=repr) + "\n").encode("utf-8"))
+
+        out.write(b"".join(data))
+
+    out.flush()
@@ -0,0 +1,260 @@
+"""
+Exporters sending the grouped metrics of every interval to monitoring
+systems, see `init_logger(metric_exporters=...)`. An exporter has an
+`export(metrics)` method called from the metrics thread with a list of
+`GroupedMetric`s, and an optional `close()`.
+"""
+
+import re
+import math
+import socket
+import collections
+from threading import Thread, Lock
+
+from .log import parse_address
+
+# one group of a metric event in an interval: its non numeric @keys,
+# number of events @num and aggregated @fields eg: {"duration_p99": 0.2}
+GroupedMetric = collections.namedtuple(
+    "GroupedMetric", ["event", "level", "keys", "num", "fields"]
+)
+
+# fits an ethernet frame, as recommended by datadog
+STATSD_MAX_PACKET = 1432
+
+# intervals after which the events_total counter of a group which is no
+# longer seen is dropped, so that transient keys do not pile up
+PROMETHEUS_SERIES_TTL = 60
+
+_STATSD_NAME_INVALID = re.compile(r"[^A-Za-z0-9_.\-]")
+_STATSD_TAG_INVALID = re.compile(r"[,|#\s]")
+_PROMETHEUS_NAME_INVALID = re.compile(r"[^A-Za-z0-9_]")
+
+
+def _numeric(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _prometheus_value(value):
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+class StatsdExporter(object):
+    """
+    Sends metrics over UDP to StatsD, or with @dogstatsd to DogStatsD,
+    packing as many as fit in @max_packet bytes into each datagram.
+
+    Every field of a group is sent as a gauge named
+    <prefix><event>.<field>, with "_sum" and "_count" fields and the
+    number of events (<event>.num) as counters. DogStatsD gets the keys
+    of the group as tags, for StatsD their values are put in the name:
+    <prefix><event>.<key>_<value>.<field>.
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=8125,
+        prefix="",
+        dogstatsd=False,
+        max_packet=STATSD_MAX_PACKET,
+    ):
+        self.prefix = prefix
+        self.dogstatsd = dogstatsd
+        self.max_packet = max_packet
+
+        family, kind, proto, _, self.addr = socket.getaddrinfo(
+            host, port, 0, socket.SOCK_DGRAM
+        )[0]
+        self.sock = socket.socket(family, kind, proto)
+        self.sock.setblocking(False)
+
+        # datagrams which could not be sent
+        self.dropped = 0
+
+    def _name(self, metric):
+        parts = [metric.event]
+        if not self.dogstatsd:
+            parts.extend(
+                "%s_%s" % (k, v)
+                for k, v in sorted(metric.keys.items())
+                if v is not None
+            )
+
+        return _STATSD_NAME_INVALID.sub("_", self.prefix + ".".join(map(str, parts)))
+
+    def _tags(self, metric):
+        if not self.dogstatsd or not metric.keys:
+            return ""
+
+        tags = ",".join(
+            _STATSD_TAG_INVALID.sub("_", "%s:%s" % (k, v))
+            for k, v in sorted(metric.keys.items())
+            if v is not None
+        )
+        return "|#" + tags if tags else ""
+
+    def lines(self, metrics):
+        for m in metrics:
+            name = self._name(m)
+            tags = self._tags(m)
+
+            yield "%s.num:%d|c%s" % (name, m.num, tags)
+
+            for field, value in sorted(m.fields.items()):
+                if not _numeric(value):
+                    continue
+
+                kind = "c" if field.endswith(("_sum", "_count")) else "g"
+                field = _STATSD_NAME_INVALID.sub("_", field)
+                yield "%s.%s:%r|%s%s" % (name, field, value, kind, tags)
+
+    def packets(self, metrics):
+        packet, size = [], 0
+        for line in self.lines(metrics):
+            line = line.encode("utf-8")
+            if packet and size + 1 + len(line) > self.max_packet:
+                yield b"\n".join(packet)
+                packet, size = [], 0
+
+            packet.append(line)
+            size += len(line) + (1 if size else 0)
+
+        if packet:
+            yield b"\n".join(packet)
+
+    def export(self, metrics):
+        for packet in self.packets(metrics):
+            try:
+                self.sock.sendto(packet, self.addr)
+            except OSError:
+                self.dropped += 1
+
+    def close(self):
+        self.sock.close()
+
+
+class PrometheusExporter(object):
+    """
+    Serves the metrics at http://<host>:<port>/metrics in the Prometheus
+    text format from a background thread. Each field of the last interval
+    is a gauge named <prefix><event>_<field> labelled with the keys of the
+    group, and <prefix><event>_events_total counts events since start.
+    The counter of a group not seen for @series_ttl intervals is dropped,
+    and starts again from zero if the group comes back.
+    """
+
+    def __init__(
+        self, port, host="127.0.0.1", prefix="", series_ttl=PROMETHEUS_SERIES_TTL
+    ):
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+        from socketserver import ThreadingMixIn
+
+        self.prefix = prefix
+        self.series_ttl = series_ttl
+        self.lock = Lock()
+        self.body = b""
+
+        # [events seen since start, interval last seen] per (event, labels)
+        self.totals = collections.OrderedDict()
+        self.intervals = 0
+
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = exporter.body
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        if ":" in host:
+            Server.address_family = socket.AF_INET6
+
+        self.server = Server((host, port), Handler)
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def address(self):
+        return self.server.server_address[:2]
+
+    def _name(self, *parts):
+        name = _PROMETHEUS_NAME_INVALID.sub("_", self.prefix + "_".join(parts))
+        return "_" + name if name[:1].isdigit() else name
+
+    @staticmethod
+    def _labels(keys):
+        labels = []
+        for k, v in sorted(keys.items()):
+            if v is None:
+                continue
+
+            v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            labels.append('%s="%s"' % (_PROMETHEUS_NAME_INVALID.sub("_", k), v))
+
+        return "{%s}" % ",".join(labels) if labels else ""
+
+    def render(self, metrics):
+        gauges = collections.OrderedDict()
+
+        with self.lock:
+            self.intervals += 1
+
+            for m in metrics:
+                labels = self._labels(m.keys)
+
+                total = self.totals.setdefault(
+                    (self._name(m.event, "events_total"), labels), [0, 0]
+                )
+                total[0] += m.num
+                total[1] = self.intervals
+
+                for field, value in sorted(m.fields.items()):
+                    if _numeric(value):
+                        gauges.setdefault(self._name(m.event, field), []).append(
+                            (labels, value)
+                        )
+
+            expired = self.intervals - self.series_ttl
+            for key in [k for k, v in self.totals.items() if v[1] <= expired]:
+                del self.totals[key]
+
+            counters = collections.OrderedDict()
+            for (name, labels), (n, _) in self.totals.items():
+                counters.setdefault(name, []).append((labels, n))
+
+        out = []
+        for kind, series in (("counter", counters), ("gauge", gauges)):
+            for name, samples in series.items():
+                out.append("# TYPE %s %s" % (name, kind))
+                out.extend(
+                    "%s%s %s" % (name, labels, _prometheus_value(v))
+                    for labels, v in samples
+                )
+
+        return "\n".join(out) + "\n" if out else ""
+
+    def export(self, metrics):
+        self.body = self.render(metrics).encode("utf-8")
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
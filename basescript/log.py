@@ -1,16 +1,25 @@
+import os
 import sys
 import json
 import time
-import uuid
 import atexit
 import socket
 import logging
 import numbers
 import signal
-import yaml
+import math
+import random
+import operator
+import itertools
+import collections
+import re
+import struct
+import binascii
+import weakref
+import importlib
 from six.moves import queue
-from threading import Thread, Lock
-from datetime import datetime
+from threading import Thread, Lock, RLock, Condition, Event, local, current_thread
+from datetime import datetime, date, time as dtime
 from functools import wraps
 
 from deeputil import Dummy, keeprunning
@@ -21,10 +30,88 @@ _GLOBAL_LOG_CONFIGURED = False
 
 FORCE_FLUSH_Q_SIZE = 1
 HOSTNAME = socket.gethostname()
-METRICS_STATE = {}
-METRICS_STATE_LOCK = Lock()
+
+# Every thread aggregates metrics into its own shard so that recording a
+# metric never contends with other threads. `dump_metrics` merges them.
+METRICS_SHARDS = []
+METRICS_SHARDS_LOCK = Lock()
+_METRICS_LOCAL = local()
+
+# Bounded number of metric event shapes whose grouping layout is cached per thread
+METRIC_KEY_CACHE_SIZE = 1024
+METRIC_IGNORE_KEYS = ("timestamp", "type", "id")
+
+# What `dump_metrics` emits for each numeric field of a grouped metric.
+# "avg" is emitted under the field's own name, the rest as <field>_<aggregate>.
+# Percentiles are written as p<percent> eg: p50, p99, p99.9
+METRIC_AGGREGATES = ("avg",)
+METRIC_FIELD_AGGREGATES = {}
+METRIC_BASIC_AGGREGATES = ("avg", "sum", "min", "max", "count")
+
+# Max distinct grouping keys per metric event name in an interval. Further
+# keys are folded into one whose varying values are `METRIC_OTHER_VALUE`.
+METRIC_MAX_KEYS = 1000
+METRIC_OTHER_VALUE = "__other__"
+METRIC_KEYS = {}
+METRIC_KEYS_LOCK = Lock()
+
+# fed the grouped metrics of every interval, see `basescript.exporters`
+METRIC_EXPORTERS = []
+
+# the thread running `dump_metrics`, which sets METRICS_FLUSHED once it
+# has logged and exported the metrics a flush was requested for
+METRICS_THREAD = None
+METRICS_FLUSHED = Event()
+
+EVENT_ID_GENERATORS = ("uuid", "counter")
+
+LOG_ROTATE_COMPRESSION = ("gzip", "zstd")
+LOG_ROTATE_SUFFIX_FORMAT = "%Y%m%dT%H%M%S"
+
+# see `basescript.binlog`
+LOG_FILE_FORMATS = ("json", "binary")
+
+# records and seconds covered by an index block at most, see `basescript.logindex`
+LOG_INDEX_EVERY = 1000
+LOG_INDEX_INTERVAL = 60
+
+# see `basescript.shipping`
+LOG_SHIP_COMPRESSION = ("gzip", "none")
+LOG_SHIP_BATCH_SIZE = 1000
+LOG_SHIP_BATCH_INTERVAL = 1.0
+LOG_SHIP_SPOOL_SIZE = 1 << 30
+
+# see `basescript.profiling`
+PROFILERS = ("cpu", "cprofile", "alloc")
+PROFILE_INTERVAL = 0.005
+
+# "auto" picks the fastest of these that is installed
+JSON_SERIALIZERS = ("json", "ujson", "orjson", "auto")
+
+# log event name -> `EventSampler`s deciding which of its events are kept,
+# "*" applies to debug and info events of names without their own
+LOG_SAMPLING = {}
+LOG_SAMPLING_DEFAULT = "*"
+RETIRED_SAMPLERS = []
+
+# settings that can be changed while running, see `update_log_config`
+LOG_CONFIG = {}
+LOGGER_FACTORY = None
+METRIC_GROUPING_INTERVAL = None
+# bound loggers are not hashable, keyed by id instead
+COMPILED_LOGGERS = weakref.WeakValueDictionary()
+
+# actions run on SIGUSR1, see `on_reload`
+RELOAD_ACTIONS = []
+RELOAD_LOCK = RLock()
+_RELOAD_PIPE = None
+
+ASYNC_LOG_BUFFER_SIZE = 10000
+ASYNC_LOG_OVERFLOW_POLICIES = ("block", "drop-oldest", "drop-newest")
 
 LOG = None
+ASYNC_STREAM = None
+LOG_SHIPPER = None
 
 
 class Stream(object):
@@ -35,6 +122,10 @@ class Stream(object):
         for s in self.streams:
             s.write(data)
 
+    def writelines(self, lines):
+        for s in self.streams:
+            s.writelines(lines)
+
     def flush(self):
         for s in self.streams:
             s.flush()
@@ -44,30 +135,770 @@ class Stream(object):
             s.close()
 
 
+def to_bytes(data):
+    return data if isinstance(data, bytes) else data.encode("utf-8")
+
+
+def to_text(data):
+    return data.decode("utf-8") if isinstance(data, bytes) else data
+
+
+class BinaryStream(object):
+    """
+    Writes both str and bytes lines to a binary file object
+    eg: sys.stderr.buffer
+    """
+
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, data):
+        return self.f.write(to_bytes(data))
+
+    def writelines(self, lines):
+        return self.f.writelines(to_bytes(l) for l in lines)
+
+    def flush(self):
+        return self.f.flush()
+
+    def close(self):
+        return self.f.close()
+
+
+class TextStream(BinaryStream):
+    """
+    Writes both str and bytes lines to a text only file object
+    eg: sys.stderr replaced by io.StringIO or in Jupyter
+    """
+
+    def write(self, data):
+        return self.f.write(to_text(data))
+
+    def writelines(self, lines):
+        return self.f.writelines(to_text(l) for l in lines)
+
+
+def parse_size(value):
+    """
+    Parses a byte size such as 1048576, 512K, 100M or 2G
+    """
+    value = str(value).strip().upper()
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def parse_address(value, default_host="127.0.0.1"):
+    """
+    (host, port) of "host:port" or "port"
+    """
+    host, sep, port = str(value).rpartition(":")
+    return (host.strip("[]") or default_host), int(port)
+
+
+class LogCompressor(object):
+    """
+    Compresses rotated log segments and enforces retention
+    from a background thread, off the logging thread.
+    """
+
+    def __init__(self, fpath, compress=None, keep=None, max_age=None):
+        assert compress in (None,) + LOG_ROTATE_COMPRESSION, (
+            "unknown compression %r" % compress
+        )
+
+        self.fpath = fpath
+        self.compress = compress
+        self.keep = keep
+        self.max_age = max_age
+
+        if compress == "zstd":
+            # optional dependency, only needed for zstd
+            self.zstd = importlib.import_module("zstandard")
+
+        self.q = queue.Queue()
+        self.thread = Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+        # segments left uncompressed by a previous run
+        for path in self.segments():
+            if self.compress and not path.endswith((".gz", ".zst")):
+                self.q.put(path)
+        self.q.put(None)
+
+    def segments(self):
+        """
+        Rotated segments of the log file, oldest first
+        """
+        d = os.path.dirname(os.path.abspath(self.fpath))
+        name = os.path.basename(self.fpath)
+        pattern = re.compile(re.escape(name) + r"\.\d{8}T\d{6}(_\d+)?(\.gz|\.zst)?$")
+
+        paths = [os.path.join(d, n) for n in os.listdir(d) if pattern.match(n)]
+        return sorted(paths, key=lambda p: (os.path.getmtime(p), p))
+
+    def submit(self, path):
+        """
+        Queues a just rotated segment. Retention is applied afterwards.
+        """
+        self.q.put(path)
+
+    def _compress(self, path):
+        import shutil
+
+        if self.compress == "gzip":
+            import gzip
+
+            cpath = path + ".gz"
+            with open(path, "rb") as src, gzip.open(cpath, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+        else:
+            cpath = path + ".zst"
+            cctx = self.zstd.ZstdCompressor()
+            with open(path, "rb") as src, open(cpath, "wb") as dst:
+                cctx.copy_stream(src, dst)
+
+        shutil.copystat(path, cpath)
+        os.remove(path)
+
+        from .logindex import index_path
+
+        # offsets of the index are of the uncompressed file, which
+        # `pretty` can still seek in when gzipped
+        if os.path.exists(index_path(path)):
+            if self.compress == "gzip":
+                os.rename(index_path(path), index_path(cpath))
+            else:
+                os.remove(index_path(path))
+
+    def _expire(self):
+        segments = self.segments()
+        expired = []
+
+        if self.keep is not None and len(segments) > self.keep:
+            expired = segments[: len(segments) - self.keep]
+
+        if self.max_age is not None:
+            cutoff = time.time() - self.max_age
+            expired.extend(
+                p for p in segments if p not in expired and os.path.getmtime(p) < cutoff
+            )
+
+        from .logindex import index_path
+
+        for path in expired:
+            os.remove(path)
+            if os.path.exists(index_path(path)):
+                os.remove(index_path(path))
+
+    @keeprunning()
+    def _run(self):
+        while True:
+            path = self.q.get()
+            if path is not None and self.compress:
+                self._compress(path)
+            self._expire()
+
+
+def on_reload(action):
+    """
+    Registers @action() to be run when the process gets SIGUSR1, eg: to
+    reopen a log file moved by logrotate or re-read a config file.
+    All actions are run, in the order they were registered, on a
+    background thread rather than in the signal handler itself.
+    """
+    _install_reload_handler()
+    RELOAD_ACTIONS.append(action)
+    return action
+
+
+def run_reload_actions():
+    """
+    Runs every action registered with `on_reload`, one after another
+    """
+    with RELOAD_LOCK:
+        for action in list(RELOAD_ACTIONS):
+            try:
+                action()
+            except Exception:
+                logging.getLogger(__name__).exception("reload action failed")
+
+
+def _install_reload_handler():
+    global _RELOAD_PIPE
+    if _RELOAD_PIPE is not None:
+        return
+
+    # the handler only wakes up the reload thread; taking locks in a
+    # signal handler deadlocks if the interrupted code holds them
+    r, w = os.pipe()
+    os.set_blocking(w, False)
+    try:
+        signal.signal(signal.SIGUSR1, lambda signum, frame: _request_reload(w))
+    except ValueError:
+        # signal handlers can only be set from the main thread
+        os.close(r)
+        os.close(w)
+        return
+
+    _RELOAD_PIPE = (r, w)
+
+    t = Thread(target=_reload_forever, args=(r,))
+    t.daemon = True
+    t.start()
+
+
+def _request_reload(fd):
+    try:
+        os.write(fd, b"r")
+    except OSError:
+        # a reload is already pending
+        pass
+
+
+def _reload_forever(fd):
+    while True:
+        # signals received during a reload are handled by a single one
+        if not os.read(fd, 64):
+            return
+        run_reload_actions()
+
+
+def _reset_reload_handler():
+    # the pipe is shared with the parent and the reload thread is gone
+    global _RELOAD_PIPE
+    if _RELOAD_PIPE is None:
+        return
+
+    for fd in _RELOAD_PIPE:
+        os.close(fd)
+    _RELOAD_PIPE = None
+
+    if RELOAD_ACTIONS:
+        _install_reload_handler()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_reload_handler)
+
+
 class FileWrapper:
-    def __init__(self, fpath):
+    """
+    Log file sink. Optionally rotates the file once it reaches @rotate_size
+    bytes and/or every @rotate_interval seconds (aligned to multiples of it).
+    Rotated segments are named <fpath>.<YYYYmmddTHHMMSS>, compressed with
+    @compress (gzip, zstd) and at most @keep segments no older than @max_age
+    seconds are retained; see `LogCompressor`.
+
+    With @fmt="binary" events are written in the binary log format, see
+    `basescript.binlog`, from the event dicts carried by `LogEvent` lines
+    or else by decoding the json lines written.
+
+    @index is a dict of options of a `LogIndexWriter` maintaining a sparse
+    index of the file in <fpath>.idx eg: {"every": 1000}, which the
+    `pretty` and `metrics` sub-commands use to seek to matching events.
+    """
+
+    def __init__(
+        self,
+        fpath,
+        binary=False,
+        rotate_size=None,
+        rotate_interval=None,
+        compress=None,
+        keep=None,
+        max_age=None,
+        fmt="json",
+        index=None,
+    ):
+        assert fmt in LOG_FILE_FORMATS, "unknown log file format %r" % fmt
+
         self.fpath = fpath
+        self.mode = "ab" if binary or fmt == "binary" or index else "a"
+        self.encoder = None
+        if fmt == "binary":
+            from .binlog import BinaryLogEncoder
+
+            self.encoder = BinaryLogEncoder(default=_json_default)
+
+        self.index = None
+        if index:
+            from .logindex import LogIndexWriter
+
+            self.index = LogIndexWriter(fpath, **index)
+
         self.lock = Lock()
-        self.f = open(self.fpath, "a")
+        self.f = self._open()
 
-        signal.signal(signal.SIGUSR1, self.__sighandler__)
+        self.rotate_size = rotate_size
+        self.rotate_interval = rotate_interval
+        self.size = os.path.getsize(self.fpath)
+        self.next_rotation = self._next_rotation()
+
+        self.compressor = None
+        if rotate_size or rotate_interval:
+            self.compressor = LogCompressor(
+                fpath, compress=compress, keep=keep, max_age=max_age
+            )
+
+        on_reload(self.reopen)
 
     def close(self):
         with self.lock:
+            self._close_index_block()
+            if self.index is not None:
+                self.index.close()
             return self.f.close()
 
-    def write(self, *args, **kwargs):
+    def _open(self):
+        f = open(self.fpath, self.mode)
+        if self.encoder is not None:
+            # starts the file, or has readers forget the keys defined
+            # before when appending to it
+            f.write(self.encoder.reset())
+
+        if self.index is not None:
+            self.index.open()
+
+        if self.encoder is not None or self.index is not None:
+            # where records written next start
+            self.offset = f.tell()
+            return f
+
+        self.offset = None
+
+        return BinaryStream(f) if "b" in self.mode else f
+
+    def _close_index_block(self):
+        # called with lock held
+        if self.index is not None:
+            self.f.flush()
+            self.index.close_block(self.offset)
+
+    def _next_rotation(self):
+        if not self.rotate_interval:
+            return None
+        return (time.time() // self.rotate_interval + 1) * self.rotate_interval
+
+    def _maybe_rotate(self, nbytes):
+        # called with lock held
+        if self.compressor is None:
+            return
+
+        due = self.rotate_size and self.size and self.size + nbytes > self.rotate_size
+        if not due and self.next_rotation is not None:
+            due = time.time() >= self.next_rotation
+
+        if due:
+            self._rotate()
+
+        self.size += nbytes
+
+    def _rotate(self):
+        self._close_index_block()
+        if self.index is not None:
+            self.index.close()
+        self.f.close()
+
+        suffix = datetime.now().strftime(LOG_ROTATE_SUFFIX_FORMAT)
+        path = "%s.%s" % (self.fpath, suffix)
+        n = 0
+        while os.path.exists(path) or any(
+            os.path.exists(path + ext) for ext in (".gz", ".zst")
+        ):
+            n += 1
+            path = "%s.%s_%d" % (self.fpath, suffix, n)
+
+        os.rename(self.fpath, path)
+        if self.index is not None and os.path.exists(self.index.path):
+            from .logindex import index_path
+
+            os.rename(self.index.path, index_path(path))
+        self.f = self._open()
+        self.size = 0
+        self.next_rotation = self._next_rotation()
+
+        self.compressor.submit(path)
+
+    def _write_records(self, lines):
+        # called with lock held. Rotates before encoding, as the keys
+        # defined while encoding must be in the file written to.
+        self._maybe_rotate(0)
+
+        encoder, index = self.encoder, self.index
+        out = []
+        offset = start = self.offset
+
+        for line in lines:
+            event = _log_event(line)
+            if event is None and encoder is not None:
+                continue
+
+            if index is not None and index.due(event):
+                self.f.write(b"".join(out))
+                out = []
+                self.offset = offset
+                self._close_index_block()
+
+                if encoder is not None:
+                    # so that every block can be decoded on its own
+                    magic = encoder.reset()
+                    out.append(magic)
+                    offset += len(magic)
+
+            data = encoder.encode(event) if encoder is not None else to_bytes(line)
+            if index is not None:
+                index.add(offset, event)
+
+            out.append(data)
+            offset += len(data)
+
+        self.size += offset - start
+        self.offset = offset
+        return self.f.write(b"".join(out))
+
+    def write(self, data):
+        with self.lock:
+            if self.offset is not None:
+                return self._write_records([data])
+
+            self._maybe_rotate(len(data))
+            return self.f.write(data)
+
+    def writelines(self, lines):
         with self.lock:
-            return self.f.write(*args, **kwargs)
+            if self.offset is not None:
+                return self._write_records(lines)
+
+            if self.compressor is not None:
+                lines = list(lines)
+                self._maybe_rotate(sum(len(l) for l in lines))
+            return self.f.writelines(lines)
 
     def flush(self):
         with self.lock:
             return self.f.flush()
 
-    def __sighandler__(self, signum, frame):
+    def reopen(self):
+        """
+        Reopens the log file, eg: after it was moved by logrotate
+        """
         with self.lock:
+            self._close_index_block()
             self.f.close()
-            self.f = open(self.fpath, "a")
+            self.f = self._open()
+            self.size = os.path.getsize(self.fpath)
+
+
+class AsyncStream(object):
+    """
+    Wraps a stream so that the caller's thread only appends rendered lines
+    to a bounded in-memory ring. A background thread drains the ring and
+    hands each batch to the underlying stream with a single `writelines`.
+
+    @overflow decides what happens when the ring is full,
+        block: wait for the writer thread to make room
+        drop-oldest: discard the oldest queued line
+        drop-newest: discard the line being written
+    Discarded lines are counted in `dropped`.
+    """
+
+    def __init__(self, stream, maxsize=ASYNC_LOG_BUFFER_SIZE, overflow="block"):
+        assert overflow in ASYNC_LOG_OVERFLOW_POLICIES, (
+            "unknown overflow policy %r" % overflow
+        )
+        assert maxsize > 0, "expected positive maxsize but got %r" % maxsize
+
+        self.stream = stream
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0
+
+        self._buf = collections.deque()
+        self._cond = Condition(Lock())
+        self._writing = False
+        self._closed = False
+
+        self._thread = Thread(target=self._drain_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, data):
+        with self._cond:
+            if self._closed:
+                return
+
+            if len(self._buf) >= self.maxsize:
+                if self.overflow == "drop-newest":
+                    self.dropped += 1
+                    return
+
+                if self.overflow == "drop-oldest":
+                    self._buf.popleft()
+                    self.dropped += 1
+                else:
+                    while len(self._buf) >= self.maxsize and not self._closed:
+                        self._cond.wait()
+
+            self._buf.append(data)
+            self._cond.notify_all()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        # `structlog.PrintLogger` flushes after every line. The writer
+        # thread flushes after each batch instead; use `drain` to wait.
+        pass
+
+    def drain(self, timeout=None):
+        """
+        Blocks until everything queued so far has been written
+        and flushed. Returns False if @timeout expired first.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+
+        with self._cond:
+            while self._buf or self._writing:
+                if not self._thread.is_alive():
+                    return False
+
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+
+                self._cond.wait(remaining)
+
+        return True
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+
+        self._thread.join()
+        self.stream.close()
+
+    def _drain_forever(self):
+        while True:
+            with self._cond:
+                while not self._buf and not self._closed:
+                    self._cond.wait()
+
+                if not self._buf:
+                    return
+
+                batch = self._buf
+                self._buf = collections.deque()
+                self._writing = True
+                self._cond.notify_all()
+
+            try:
+                self.stream.writelines(batch)
+                self.stream.flush()
+            except Exception:
+                # the logger cannot log its own failures; keep draining
+                pass
+            finally:
+                with self._cond:
+                    self._writing = False
+                    self._cond.notify_all()
+
+
+class LogCollector(object):
+    """
+    Owns the log sinks of the parent process. Forked children send it
+    their rendered lines and metric partials over a unix socket; lines are
+    written to @stream and metrics merged into a shard of this process.
+    """
+
+    MSG_LINE = b"L"
+    MSG_METRICS = b"M"
+    HEADER = struct.Struct("!cI")
+
+    def __init__(self, stream, lock, binary=False):
+        self.stream = stream
+        self.lock = lock
+        self.binary = binary
+
+        self.shard = MetricShard()
+        with METRICS_SHARDS_LOCK:
+            METRICS_SHARDS.append(self.shard)
+
+        import tempfile
+
+        self.dir = tempfile.mkdtemp(prefix="basescript-")
+        self.path = os.path.join(self.dir, "collector.sock")
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        self.sock.listen(128)
+
+        self.thread = Thread(target=self._accept)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except (OSError, socket.error):
+                # closed
+                return
+
+            t = Thread(target=self._read, args=(conn,))
+            t.daemon = True
+            t.start()
+
+    def _read(self, conn):
+        f = conn.makefile("rb")
+        try:
+            while True:
+                header = f.read(self.HEADER.size)
+                if len(header) < self.HEADER.size:
+                    return
+
+                kind, n = self.HEADER.unpack(header)
+                payload = f.read(n)
+
+                if kind == self.MSG_LINE:
+                    line = payload if self.binary else payload.decode("utf-8")
+                    with self.lock:
+                        self.stream.write(line)
+                        self.stream.flush()
+                elif kind == self.MSG_METRICS:
+                    import pickle
+
+                    state = pickle.loads(payload)
+                    with self.shard.lock:
+                        _merge_metrics(self.shard.state, state)
+        finally:
+            f.close()
+            conn.close()
+
+    def close(self):
+        import shutil
+
+        self.sock.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class CollectorStream(object):
+    """
+    Stream of the multiprocess mode. In the process that configured logging
+    it writes to @stream; in forked children it sends everything to the
+    parent's `LogCollector` instead, so only one process owns the sinks.
+    """
+
+    threadsafe = True
+
+    def __init__(self, stream, binary=False):
+        self.stream = stream
+        self.pid = os.getpid()
+        self.lock = Lock()
+        self.collector = LogCollector(stream, self.lock, binary=binary)
+        self.conn = None
+
+    def after_fork(self):
+        # locks may have been held by other threads at the time of the fork
+        self.lock = Lock()
+        self.conn = None
+
+    def _send(self, kind, payload):
+        with self.lock:
+            if self.conn is None:
+                self.conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.conn.connect(self.collector.path)
+            header = LogCollector.HEADER.pack(kind, len(payload))
+            self.conn.sendall(header + payload)
+
+    def send_metrics(self, state):
+        if state:
+            import pickle
+
+            self._send(LogCollector.MSG_METRICS, pickle.dumps(state, protocol=2))
+
+    def write(self, data):
+        if os.getpid() != self.pid:
+            return self._send(LogCollector.MSG_LINE, to_bytes(data))
+
+        with self.lock:
+            return self.stream.write(data)
+
+    def writelines(self, lines):
+        if os.getpid() != self.pid:
+            for line in lines:
+                self.write(line)
+            return
+
+        with self.lock:
+            return self.stream.writelines(lines)
+
+    def flush(self):
+        if os.getpid() != self.pid:
+            return
+
+        with self.lock:
+            return self.stream.flush()
+
+    def close(self):
+        if os.getpid() != self.pid:
+            with self.lock:
+                if self.conn is not None:
+                    self.conn.close()
+                    self.conn = None
+            return
+
+        self.collector.close()
+        self.stream.close()
+
+
+def _ship_metrics(stream, interval):
+    while True:
+        time.sleep(interval)
+        stream.send_metrics(collect_metrics())
+
+
+def _after_fork_in_collector_child(stream, metric_grouping_interval):
+    """
+    Makes a forked child send its logs and metrics to the parent's collector
+    """
+    global METRICS_SHARDS, METRICS_SHARDS_LOCK, _METRICS_LOCAL
+    global METRIC_KEYS, METRIC_KEYS_LOCK
+
+    # the parent's metrics are reported by the parent
+    METRICS_SHARDS = []
+    METRICS_SHARDS_LOCK = Lock()
+    METRIC_KEYS = {}
+    METRIC_KEYS_LOCK = Lock()
+    _METRICS_LOCAL = local()
+
+    stream.after_fork()
+
+    if not metric_grouping_interval:
+        return
+
+    t = Thread(target=_ship_metrics, args=(stream, metric_grouping_interval))
+    t.daemon = True
+    t.start()
+
+    atexit.register(_flush_child_metrics, stream)
+
+
+def _flush_child_metrics(stream):
+    stream.send_metrics(collect_metrics())
+
+
+def _register_child_metrics_finalizer(stream):
+    # multiprocessing children exit with os._exit, skipping atexit, and
+    # clear finalizers registered before their after fork callbacks run
+    from multiprocessing.util import Finalize
+
+    Finalize(None, _flush_child_metrics, args=(stream,), exitpriority=100)
 
 
 class ReadEnv:
@@ -75,17 +906,56 @@ class ReadEnv:
         self.envfile = envfile
         self.env = self.read()
         setattr(structlog.BoundLoggerBase, "env_context", self.env)
-        signal.signal(signal.SIGUSR1, self.__sighandler__)
+        on_reload(self.reload)
 
     def read(self):
+        # only scripts using --env-file need yaml
+        import yaml
+
         with open(self.envfile) as f:
             return yaml.full_load(f.read())
 
-    def __sighandler__(self, signum, frame):
+    def reload(self):
         self.env = self.read()
         setattr(structlog.BoundLoggerBase, "env_context", self.env)
 
 
+class LogConfigFile:
+    """
+    YAML file of settings changed while running, read at start and on
+    SIGUSR1. Keys are those of `update_log_config` eg:
+
+    level: debug
+    log_sampling: {"cache hit": "1/100"}
+    log_rate_limits: {"request failed": "10/s"}
+    metric_grouping_interval: 10
+
+    Settings missing from the file revert to those given at start.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.initial = dict(LOG_CONFIG)
+        self.reload()
+        on_reload(self.reload)
+
+    def read(self):
+        import yaml
+
+        with open(self.path) as f:
+            config = yaml.full_load(f.read()) or {}
+
+        if not isinstance(config, dict):
+            raise ValueError("expected a mapping in %s" % self.path)
+
+        return config
+
+    def reload(self):
+        config = dict(self.initial)
+        config.update(self.read())
+        update_log_config(**config)
+
+
 class StderrConsoleRenderer(object):
     BACKUP_KEYS = ("timestamp", "level", "event", "logger", "stack", "exception")
 
@@ -146,211 +1016,1185 @@ class LevelLogger(structlog.PrintLogger):
         """
         super(LevelLogger, self).__init__(file=fp)
 
-        self.level = level or logging.WARNING
-        assert isinstance(self.level, int), "expected int but got %r" % level
+        self.level = level or logging.WARNING
+        assert isinstance(self.level, int), "expected int but got %r" % level
+
+    def setLevel(self, level):
+        assert isinstance(level, int), "expected int but got %r" % level
+        self.level = level
+
+    def isEnabledFor(self, level):
+        return level >= self.level
+
+    def msg(self, message):
+        """
+        Writes @message, which is either a str or an already
+        newline terminated bytes line from `JSONRenderer`
+        """
+        line = message if isinstance(message, bytes) else message + "\n"
+        if getattr(self._file, "threadsafe", False):
+            self._write(line)
+            self._flush()
+            return
+
+        with self._lock:
+            self._write(line)
+            self._flush()
+
+    log = debug = info = warn = warning = msg
+    failure = err = error = critical = exception = msg
+
+
+class LevelLoggerFactory(object):
+    def __init__(self, fp, level=None):
+        self.fp = fp
+        self.level = level
+
+        # handed out loggers, whose level `update_log_config` changes
+        self.loggers = weakref.WeakSet()
+
+    def __call__(self, *args):
+        logger = LevelLogger(self.fp, level=self.level)
+        self.loggers.add(logger)
+        return logger
+
+
+class EventSampler(object):
+    """
+    Keeps one in every @every events of a name, or each one with
+    @probability, and counts the ones it suppresses. @spec is how it
+    was configured, see `parse_log_sampling`.
+    """
+
+    def __init__(self, spec, every=None, probability=None):
+        self.spec = spec
+        self.every = every
+        self.probability = probability
+
+        self.lock = Lock()
+        self.seen = 0
+        self.suppressed = 0
+
+    def keep(self):
+        with self.lock:
+            if self.every:
+                keep = self.seen % self.every == 0
+                self.seen += 1
+            else:
+                keep = random.random() < self.probability
+
+            if not keep:
+                self.suppressed += 1
+
+        return keep
+
+    def take_suppressed(self):
+        with self.lock:
+            suppressed, self.suppressed = self.suppressed, 0
+        return suppressed
+
+
+class EventRateLimit(EventSampler):
+    """
+    Token bucket keeping at most @rate events of a name per second
+    on average, in bursts of up to @burst events
+    """
+
+    def __init__(self, spec, rate, burst):
+        super(EventRateLimit, self).__init__(spec)
+        self.rate = rate
+        self.burst = burst
+
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+
+    def keep(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+
+            self.suppressed += 1
+            return False
+
+
+def parse_log_sampling(spec):
+    """
+    Sampler for a spec of either "1/N", keeping one in every N events,
+    or a probability between 0 and 1 eg: "0.01"
+    """
+    text = str(spec).strip()
+    try:
+        if "/" in text:
+            one, every = text.split("/", 1)
+            if int(one) != 1 or int(every) < 1:
+                raise ValueError
+            return EventSampler(text, every=int(every))
+
+        probability = float(text)
+        if not 0 <= probability <= 1:
+            raise ValueError
+        return EventSampler(text, probability=probability)
+    except ValueError:
+        raise ValueError("expected 1/N or a probability, got %r" % spec)
+
+
+def parse_log_rate_limit(spec):
+    """
+    Rate limit for a spec of "N/s", "N/m" or "N/h", allowing bursts of N
+    """
+    units = {"s": 1, "m": 60, "h": 3600}
+
+    text = str(spec).strip()
+    try:
+        n, unit = text.split("/", 1)
+        n = float(n)
+        if n <= 0 or unit not in units:
+            raise ValueError
+    except ValueError:
+        raise ValueError("expected N/s, N/m or N/h, got %r" % spec)
+
+    return EventRateLimit(text, rate=n / units[unit], burst=max(n, 1))
+
+
+def _suppress_event(event, kw, level):
+    """
+    Whether the log event @event should be dropped by its samplers.
+    Metrics are never sampled, their events are already aggregated.
+    """
+    if not isinstance(event, str) or kw.get("type") == "metric":
+        return False
+
+    samplers = LOG_SAMPLING.get(event)
+    if samplers is None:
+        if level >= logging.WARNING:
+            return False
+
+        samplers = LOG_SAMPLING.get(LOG_SAMPLING_DEFAULT)
+        if samplers is None:
+            return False
+
+    for sampler in samplers:
+        if not sampler.keep():
+            return True
+
+    return False
+
+
+def _log_samplers(log_sampling, log_rate_limits, current=None):
+    """
+    event name -> samplers for the given specs. Samplers in @current with
+    the same spec are reused, keeping their state.
+    """
+    reuse = {}
+    for event, samplers in (current or {}).items():
+        for sampler in samplers:
+            reuse[(event, type(sampler), sampler.spec)] = sampler
+
+    # sampling is applied before rate limiting, so that sampled out
+    # events do not use up the rate limit
+    samplers = {}
+    for specs, parse in (
+        (log_sampling, parse_log_sampling),
+        (log_rate_limits, parse_log_rate_limit),
+    ):
+        for event, spec in specs.items():
+            sampler = parse(spec)
+            sampler = reuse.get((event, type(sampler), sampler.spec), sampler)
+            samplers.setdefault(event, []).append(sampler)
+
+    return {event: tuple(s) for event, s in samplers.items()}
+
+
+def collect_suppressed_events():
+    """
+    Returns and resets [(event name, sampler spec, suppressed events)]
+    """
+    samplers = [(e, s) for e, ss in LOG_SAMPLING.items() for s in ss]
+    while RETIRED_SAMPLERS:
+        samplers.append(RETIRED_SAMPLERS.pop())
+
+    suppressed = []
+    for event, sampler in samplers:
+        n = sampler.take_suppressed()
+        if n:
+            suppressed.append((event, sampler.spec, n))
+
+    return suppressed
+
+
+class BoundLevelLogger(structlog.BoundLoggerBase):
+    """
+    Python Standard Library "like" version.
+    Assumes that the factory is LevelLogger i.e. _logger is a LevelLogger.
+    """
+
+    def _add_base_info(self, event_dict):
+        """
+        Instead of using a processor, adding basic information like caller, filename etc
+        here.
+        """
+        env_context = getattr(self, "env_context", None)
+        if env_context:
+            event_dict.update(env_context)
+        return event_dict
+
+    def debug(self, event=None, *args, **kw):
+        """
+        Process event and call :meth:`logging.Logger.debug` with the result.
+        """
+        if not self._logger.isEnabledFor(logging.DEBUG):
+            return
+
+        if LOG_SAMPLING and _suppress_event(event, kw, logging.DEBUG):
+            return
+
+        kw = self._add_base_info(kw)
+        kw["level"] = "debug"
+        return self._proxy_to_logger("debug", event, *args, **kw)
+
+    def info(self, event=None, *args, **kw):
+        """
+        Process event and call :meth:`logging.Logger.info` with the result.
+        """
+        if not self._logger.isEnabledFor(logging.INFO):
+            return
+
+        if LOG_SAMPLING and _suppress_event(event, kw, logging.INFO):
+            return
+
+        kw = self._add_base_info(kw)
+        kw["level"] = "info"
+        return self._proxy_to_logger("info", event, *args, **kw)
+
+    def warning(self, event=None, *args, **kw):
+        """
+        Process event and call :meth:`logging.Logger.warning` with the result.
+        """
+        if not self._logger.isEnabledFor(logging.WARNING):
+            return
+
+        if LOG_SAMPLING and _suppress_event(event, kw, logging.WARNING):
+            return
+
+        kw = self._add_base_info(kw)
+        kw["level"] = "warning"
+        return self._proxy_to_logger("warning", event, *args, **kw)
+
+    warn = warning
+
+    def error(self, event=None, *args, **kw):
+        """
+        Process event and call :meth:`logging.Logger.error` with the result.
+        """
+        if not self._logger.isEnabledFor(logging.ERROR):
+            return
+
+        if LOG_SAMPLING and _suppress_event(event, kw, logging.ERROR):
+            return
+
+        kw = self._add_base_info(kw)
+        kw["level"] = "error"
+        return self._proxy_to_logger("error", event, *args, **kw)
+
+    def critical(self, event=None, *args, **kw):
+        """
+        Process event and call :meth:`logging.Logger.critical` with the result.
+        """
+        if not self._logger.isEnabledFor(logging.CRITICAL):
+            return
+
+        if LOG_SAMPLING and _suppress_event(event, kw, logging.CRITICAL):
+            return
+
+        kw = self._add_base_info(kw)
+        kw["level"] = "critical"
+        return self._proxy_to_logger("critical", event, *args, **kw)
+
+    def exception(self, event=None, *args, **kw):
+        """
+        Process event and call :meth:`logging.Logger.error` with the result,
+        after setting ``exc_info`` to `True`.
+        """
+        if not self._logger.isEnabledFor(logging.ERROR):
+            return
+
+        kw = self._add_base_info(kw)
+        kw["level"] = "exception"
+        kw.setdefault("exc_info", True)
+        return self.error(event, *args, **kw)
+
+    def _dump_stats(self, metric):
+        """
+        Dumps metrics irrespective of log level
+        """
+        # TODO have a feature to silence metrics as well
+        # TODO if dumping to console, we shouldn't club metrics. It should be sent one by one on each line.
+        return self._proxy_to_logger("msg", metric, type="metric", level="info")
+
+    fatal = critical
+
+    def _proxy_to_logger(self, method_name, event, *event_args, **event_kw):
+        """
+        Propagate a method call to the wrapped logger.
+
+        This is the same as the superclass implementation, except that
+        it also preserves positional arguments in the `event_dict` so
+        that the stdblib's support for format strings can be used.
+        """
+
+        if isinstance(event, bytes):
+            event = event.decode("utf-8")
+
+        if event_args:
+            event_kw["positional_args"] = event_args
+
+        return super(BoundLevelLogger, self)._proxy_to_logger(
+            method_name, event=event, **event_kw
+        )
+
+    # Pass-through methods to mimick the stdlib's logger interface.
+
+    def setLevel(self, level):
+        """
+        Calls :meth:`logging.Logger.setLevel` with unmodified arguments.
+        """
+        self._logger.setLevel(level)
+
+
+def _json_default(obj):
+    if isinstance(obj, (datetime, date, dtime)):
+        return obj.isoformat()
+
+    # no need to import uuid if it is not already in use
+    uuid = sys.modules.get("uuid")
+    if uuid is not None and isinstance(obj, uuid.UUID):
+        return str(obj)
+
+    # numpy scalars and arrays
+    tolist = getattr(obj, "tolist", None)
+    if callable(tolist):
+        return tolist()
+
+    return repr(obj)
+
+
+def _import_json_serializer(name):
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+class JSONRenderer(object):
+    """
+    Renders the event as a line of JSON using @serializer, one of
+    `JSON_SERIALIZERS`. orjson output is returned as bytes and written
+    without decoding; events it cannot serialize fall back to stdlib json.
+    """
+
+    def __init__(self, serializer="json"):
+        assert serializer in JSON_SERIALIZERS, "unknown serializer %r" % serializer
+
+        if serializer == "auto":
+            for name in ("orjson", "ujson"):
+                if _import_json_serializer(name) is not None:
+                    serializer = name
+                    break
+            else:
+                serializer = "json"
+
+        self.serializer = serializer
+        self.module = _import_json_serializer(serializer)
+        if self.module is None:
+            raise ImportError("json serializer %r is not installed" % serializer)
+
+        self.binary = serializer == "orjson"
+        if self.binary:
+            self._options = (
+                self.module.OPT_APPEND_NEWLINE
+                | self.module.OPT_SERIALIZE_NUMPY
+                | self.module.OPT_NON_STR_KEYS
+            )
+
+    def _stdlib_dumps(self, event_dict):
+        return json.dumps(event_dict, default=_json_default)
+
+    def __call__(self, logger, method_name, event_dict):
+        try:
+            if self.binary:
+                data = self.module.dumps(
+                    event_dict, default=_json_default, option=self._options
+                )
+            elif self.serializer == "ujson":
+                data = self.module.dumps(event_dict, ensure_ascii=False)
+            else:
+                data = self._stdlib_dumps(event_dict)
+        except (TypeError, ValueError, OverflowError):
+            data = self._stdlib_dumps(event_dict)
+
+        # structlog passes a returned tuple of (args, kwargs) on as is
+        return (data,), {}
+
+
+class LogEvent(bytes):
+    """
+    A rendered json line, empty when nothing needs json, which carries the
+    @event dict it was rendered from for sinks which encode it themselves
+    """
+
+    def __new__(cls, data, event):
+        line = super(LogEvent, cls).__new__(cls, data)
+        line.event = event
+        return line
+
+
+def _log_event(line):
+    """
+    The event dict of a line written to a sink, None for lines
+    which are not json objects
+    """
+    event = getattr(line, "event", None)
+    if event is not None:
+        return event
+
+    try:
+        event = json.loads(to_bytes(line).decode("utf-8", "replace"))
+    except ValueError:
+        return None
+
+    return event if isinstance(event, dict) else None
+
+
+class LogEventRenderer(object):
+    """
+    Renders the event as a `LogEvent` line, with the json line of
+    @renderer (a `JSONRenderer`) if another sink needs json
+    """
+
+    binary = True
+
+    def __init__(self, renderer=None):
+        self.renderer = renderer
+
+    def __call__(self, logger, method_name, event_dict):
+        data = b""
+        if self.renderer is not None:
+            (data,), _ = self.renderer(logger, method_name, event_dict)
+            if not self.renderer.binary:
+                data = (data + "\n").encode("utf-8")
+
+        return (LogEvent(data, event_dict),), {}
+
+
+class TimestampCache(object):
+    """
+    Formats the current time reusing the formatted date and
+    time of the current second for every event within it
+    """
+
+    def __init__(self):
+        # (second, iso prefix, event id prefix) swapped as a whole
+        self._cached = (None, None, None)
+
+    def _now(self):
+        t = time.time()
+        second = int(t)
+        cached = self._cached
+        if cached[0] != second:
+            d = datetime.utcfromtimestamp(second)
+            cached = (
+                second,
+                d.strftime("%Y-%m-%dT%H:%M:%S"),
+                d.strftime("%Y%m%dT%H%M%S"),
+            )
+            self._cached = cached
+        return t, cached
+
+    def iso(self):
+        t, (second, prefix, _) = self._now()
+        return "%s.%06dZ" % (prefix, int((t - second) * 1e6))
+
+    def id_prefix(self):
+        return self._now()[1][2]
+
+
+TIMESTAMPS = TimestampCache()
+
+
+def _cached_timestamper(logger_class, log_method, event):
+    event["timestamp"] = TIMESTAMPS.iso()
+    return event
+
+
+def _uuid_event_id_generator():
+    """
+    Returns a function generating time prefixed uuid1 event ids, with
+    uuid imported (it is slow to import) once rather than per event
+    """
+    from uuid import uuid1
+
+    def _uuid_event_id():
+        return "%s_%s" % (datetime.utcnow().strftime("%Y%m%dT%H%M%S"), uuid1().hex)
+
+    return _uuid_event_id
+
+
+def _default_event_id():
+    # until a logger is configured, resolves the default generator on use
+    global EVENT_ID
+    EVENT_ID = _uuid_event_id_generator()
+    return EVENT_ID()
+
+
+_EVENT_ID_COUNTER = itertools.count()
+_EVENT_ID_PROCESS = binascii.hexlify(os.urandom(6)).decode()
+
+
+def _reset_event_id_counter():
+    # a forked child must not repeat its parent's ids
+    global _EVENT_ID_COUNTER, _EVENT_ID_PROCESS
+    _EVENT_ID_COUNTER = itertools.count()
+    _EVENT_ID_PROCESS = binascii.hexlify(os.urandom(6)).decode()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_event_id_counter)
+
+
+def _counter_event_id():
+    return "%s_%s%012x" % (
+        TIMESTAMPS.id_prefix(),
+        _EVENT_ID_PROCESS,
+        next(_EVENT_ID_COUNTER),
+    )
+
+
+EVENT_ID = _default_event_id
+
+
+def _noop(*args, **kw):
+    return None
+
+
+class CompiledBoundLevelLogger(BoundLevelLogger):
+    """
+    `BoundLevelLogger` whose methods for levels disabled when it is
+    bound are replaced by a no-op, so a disabled call costs one call.
+    """
+
+    LEVEL_METHODS = (
+        ("debug", logging.DEBUG),
+        ("info", logging.INFO),
+        ("warning", logging.WARNING),
+        ("warn", logging.WARNING),
+        ("error", logging.ERROR),
+        ("exception", logging.ERROR),
+        ("critical", logging.CRITICAL),
+        ("fatal", logging.CRITICAL),
+    )
+
+    def __init__(self, *args, **kwargs):
+        super(CompiledBoundLevelLogger, self).__init__(*args, **kwargs)
+        self._disable_levels()
+        COMPILED_LOGGERS[id(self)] = self
+
+    def _disable_levels(self):
+        for name, level in self.LEVEL_METHODS:
+            if self._logger.isEnabledFor(level):
+                self.__dict__.pop(name, None)
+            else:
+                setattr(self, name, _noop)
+
+    def setLevel(self, level):
+        """
+        Only re-enables methods of this bound logger, not of others
+        already bound to the same logger.
+        """
+        super(CompiledBoundLevelLogger, self).setLevel(level)
+        self._disable_levels()
+
+    def _proxy_to_logger(self, method_name, event, *event_args, **event_kw):
+        """
+        Calls the processor of `compile_log_processors` directly, instead
+        of through structlog's generic processor chain
+        """
+        if isinstance(event, bytes):
+            event = event.decode("utf-8")
+
+        if event_args:
+            event_kw["positional_args"] = event_args
+
+        if self._context:
+            event_dict = self._context.copy()
+            event_dict.update(event_kw)
+        else:
+            event_dict = event_kw
+
+        if event is not None:
+            event_dict["event"] = event
+
+        try:
+            for proc in self._processors:
+                event_dict = proc(self._logger, method_name, event_dict)
+        except structlog.DropEvent:
+            return
+
+        args, kw = event_dict
+        return getattr(self._logger, method_name)(*args, **kw)
+
+
+def _structlog_default_keys_processor(logger_class, log_method, event):
+    """Add unique id, type and hostname"""
+    global HOSTNAME
+
+    if "id" not in event:
+        event["id"] = EVENT_ID()
+
+    if "type" not in event:
+        event["type"] = "log"
+
+    event["host"] = HOSTNAME
+
+    return event
+
+
+def _structlog_minimal_processor(logger_class, log_method, event):
+    for key in ("host", "id", "type"):
+        if key in event:
+            event.pop(key)
+
+    return event
+
+
+class MetricShard(object):
+    """
+    Metric aggregation table owned by a single thread. The lock is only
+    ever contended when `dump_metrics` swaps out the table.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.state = {}
+        self.thread = current_thread()
+
+        # event shape -> MetricKeyLayout, least recently used first
+        self.layouts = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        # metric event name -> events folded into its `METRIC_OTHER_VALUE` key
+        self.overflows = {}
+
+    def take(self):
+        with self.lock:
+            state, self.state = self.state, {}
+        return state
+
+    def take_cache_stats(self):
+        with self.lock:
+            stats = (self.hits, self.misses)
+            self.hits = self.misses = 0
+        return stats
+
+    def take_overflows(self):
+        with self.lock:
+            overflows, self.overflows = self.overflows, {}
+        return overflows
+
+    def admit(self, key):
+        """
+        Returns @key, or its overflow key if the event already has
+        `METRIC_MAX_KEYS` keys this interval. Called with `lock` held.
+        """
+        max_keys = METRIC_MAX_KEYS
+        if not max_keys:
+            return key
+
+        event = None
+        for k, v in key[0]:
+            if k == "event":
+                event = v
+                break
+
+        seen = METRIC_KEYS.get(event)
+        if seen is not None and key in seen[1]:
+            return key
+
+        if seen is None or len(seen[1]) < max_keys:
+            with METRIC_KEYS_LOCK:
+                seen = METRIC_KEYS.get(event)
+                if seen is None:
+                    # values of the first key are kept in the overflow key,
+                    # so context shared by every call site is not lost
+                    seen = METRIC_KEYS[event] = (frozenset(key[0]), set())
+                if len(seen[1]) < max_keys:
+                    seen[1].add(key)
+                    return key
+
+        self.overflows[event] = self.overflows.get(event, 0) + 1
+        common = seen[0]
+        other = tuple(
+            (
+                k,
+                (
+                    v
+                    if k in ("event", "level") or (k, v) in common
+                    else METRIC_OTHER_VALUE
+                ),
+            )
+            for k, v in key[0]
+        )
+        return other, key[1]
+
+    def layout(self, shape, names, values):
+        """
+        Returns the cached layout for @shape. Must be called with `lock` held.
+        """
+        layouts = self.layouts
+        layout = layouts.pop(shape, None)
+        if layout is None:
+            self.misses += 1
+            layout = MetricKeyLayout(names, values)
+            if len(layouts) >= METRIC_KEY_CACHE_SIZE:
+                layouts.popitem(last=False)
+        else:
+            self.hits += 1
+
+        layouts[shape] = layout
+        return layout
+
+
+def parse_metric_aggregates(aggregates):
+    """
+    Validates an aggregate spec given either as a sequence or as
+    a comma separated string eg: "avg,max,p99"
+    """
+    if isinstance(aggregates, str):
+        aggregates = [a.strip() for a in aggregates.split(",") if a.strip()]
+
+    for a in aggregates:
+        if a in METRIC_BASIC_AGGREGATES:
+            continue
+
+        try:
+            q = float(a[1:])
+        except ValueError:
+            q = None
+
+        if not a.startswith("p") or q is None or not 0 <= q <= 100:
+            raise ValueError("unknown metric aggregate %r" % a)
+
+    return tuple(aggregates)
+
+
+def _metric_field_aggregates(field):
+    return METRIC_FIELD_AGGREGATES.get(field, METRIC_AGGREGATES)
+
+
+def _aggregate_kinds(name, aggregates):
+    """
+    Yields (key, aggregate) of the fields of @name written by `summary`
+    which are not averages eg: ("duration_max", "max")
+    """
+    for a in aggregates:
+        if a != "avg" and a in METRIC_BASIC_AGGREGATES:
+            yield name + "_" + a, a
+
+
+class LogHistogram(object):
+    """
+    Mergeable fixed memory histogram for estimating quantiles. Values are
+    counted in logarithmically sized buckets, so any quantile is within
+    `RELATIVE_ACCURACY` of the true value. When there are more than
+    `MAX_BUCKETS` buckets the ones nearest to zero are collapsed together.
+    """
+
+    RELATIVE_ACCURACY = 0.01
+    MAX_BUCKETS = 1024
+    MIN_VALUE = 1e-9
+
+    GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    LOG_GAMMA = math.log(GAMMA)
+
+    __slots__ = ("positive", "negative", "zero", "count")
+
+    def __init__(self):
+        # bucket index -> count, for values above zero and the
+        # magnitudes of values below zero
+        self.positive = {}
+        self.negative = {}
+        self.zero = 0
+        self.count = 0
+
+    def _index(self, v):
+        return int(math.ceil(math.log(v) / self.LOG_GAMMA))
+
+    def _value(self, i):
+        return 2 * self.GAMMA**i / (self.GAMMA + 1)
+
+    def add(self, v):
+        if v - v != 0:
+            # inf or nan
+            return
+
+        self.count += 1
+        if v > self.MIN_VALUE:
+            buckets, v = self.positive, v
+        elif v < -self.MIN_VALUE:
+            buckets, v = self.negative, -v
+        else:
+            self.zero += 1
+            return
 
-    def setLevel(self, level):
-        assert isinstance(level, int), "expected int but got %r" % level
-        self.level = level
+        i = self._index(v)
+        buckets[i] = buckets.get(i, 0) + 1
+        if len(buckets) > self.MAX_BUCKETS:
+            self._collapse(buckets)
 
-    def isEnabledFor(self, level):
-        return level >= self.level
+    def _collapse(self, buckets):
+        indices = sorted(buckets)
+        excess = len(indices) - self.MAX_BUCKETS
+        into = indices[excess]
+        for i in indices[:excess]:
+            buckets[into] += buckets.pop(i)
 
+    def merge(self, other):
+        for buckets, obuckets in (
+            (self.positive, other.positive),
+            (self.negative, other.negative),
+        ):
+            for i, c in obuckets.items():
+                buckets[i] = buckets.get(i, 0) + c
+            if len(buckets) > self.MAX_BUCKETS:
+                self._collapse(buckets)
 
-class LevelLoggerFactory(object):
-    def __init__(self, fp, level=None):
-        self.fp = fp
-        self.level = level
+        self.zero += other.zero
+        self.count += other.count
 
-    def __call__(self, *args):
-        return LevelLogger(self.fp, level=self.level)
+    def quantile(self, q):
+        if not self.count:
+            return None
 
+        rank = q * (self.count - 1)
+        seen = 0
 
-class BoundLevelLogger(structlog.BoundLoggerBase):
+        for i in sorted(self.negative, reverse=True):
+            seen += self.negative[i]
+            if seen > rank:
+                return -self._value(i)
+
+        seen += self.zero
+        if seen > rank:
+            return 0.0
+
+        for i in sorted(self.positive):
+            seen += self.positive[i]
+            if seen > rank:
+                return self._value(i)
+
+        return self._value(max(self.positive))
+
+
+class MetricField(object):
     """
-    Python Standard Library "like" version.
-    Assumes that the factory is LevelLogger i.e. _logger is a LevelLogger.
+    Aggregate of one numeric field of a grouped metric
     """
 
-    def _add_base_info(self, event_dict):
+    __slots__ = ("sum", "min", "max", "hist")
+
+    def __init__(self, aggregates):
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+        needs_hist = any(a not in METRIC_BASIC_AGGREGATES for a in aggregates)
+        self.hist = LogHistogram() if needs_hist else None
+
+    def add(self, v):
+        self.sum += v
+        if v < self.min:
+            self.min = v
+        if v > self.max:
+            self.max = v
+        if self.hist is not None:
+            self.hist.add(v)
+
+    def merge(self, other):
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if self.hist is not None and other.hist is not None:
+            self.hist.merge(other.hist)
+
+    def summary(self, name, num, aggregates):
         """
-        Instead of using a processor, adding basic information like caller, filename etc
-        here.
+        Yields (key, value) pairs of the @aggregates of field @name
         """
-        f = sys._getframe()
-        level_method_frame = f.f_back
-        caller_frame = level_method_frame.f_back
-        if hasattr(self, "env_context"):
-            event_dict.update(self.env_context)
-        return event_dict
+        for a in aggregates:
+            if a == "avg":
+                yield name, self.sum / num
+            elif a == "sum":
+                yield name + "_sum", self.sum
+            elif a == "count":
+                yield name + "_count", num
+            elif a == "min":
+                yield name + "_min", self.min
+            elif a == "max":
+                yield name + "_max", self.max
+            elif self.hist is not None:
+                yield name + "_" + a, self.hist.quantile(float(a[1:]) / 100)
 
-    def debug(self, event=None, *args, **kw):
-        """
-        Process event and call :meth:`logging.Logger.debug` with the result.
-        """
-        if not self._logger.isEnabledFor(logging.DEBUG):
-            return
 
-        kw = self._add_base_info(kw)
-        kw["level"] = "debug"
-        return self._proxy_to_logger("debug", event, *args, **kw)
+def _tuple_getter(indices):
+    if not indices:
+        return lambda values: ()
 
-    def info(self, event=None, *args, **kw):
-        """
-        Process event and call :meth:`logging.Logger.info` with the result.
-        """
-        if not self._logger.isEnabledFor(logging.INFO):
-            return
+    if len(indices) == 1:
+        i = indices[0]
+        return lambda values: (values[i],)
 
-        kw = self._add_base_info(kw)
-        kw["level"] = "info"
-        return self._proxy_to_logger("info", event, *args, **kw)
+    return operator.itemgetter(*indices)
 
-    def warning(self, event=None, *args, **kw):
-        """
-        Process event and call :meth:`logging.Logger.warning` with the result.
-        """
-        if not self._logger.isEnabledFor(logging.WARNING):
-            return
 
-        kw = self._add_base_info(kw)
-        kw["level"] = "warning"
-        return self._proxy_to_logger("warning", event, *args, **kw)
+class MetricKeyLayout(object):
+    """
+    Precomputed split of a metric event shape (its keys and value types)
+    into the sorted non numeric keys which group the metric and the sorted
+    numeric fields which get aggregated.
+    """
 
-    warn = warning
+    __slots__ = ("key_names", "field_names", "key_values", "field_values")
 
-    def error(self, event=None, *args, **kw):
-        """
-        Process event and call :meth:`logging.Logger.error` with the result.
-        """
-        if not self._logger.isEnabledFor(logging.ERROR):
-            return
+    def __init__(self, names, values):
+        key, fields = [], []
+        for k, i in sorted((k, i) for i, k in enumerate(names)):
+            # keys starting with `_` are not used for grouping
+            if k in METRIC_IGNORE_KEYS or k.startswith("_"):
+                continue
+            v = values[i]
+            (fields if isinstance(v, (numbers.Number, bool)) else key).append((k, i))
 
-        kw = self._add_base_info(kw)
-        kw["level"] = "error"
-        return self._proxy_to_logger("error", event, *args, **kw)
+        self.key_names = tuple(k for k, _ in key)
+        self.field_names = tuple(k for k, _ in fields)
+        self.key_values = _tuple_getter([i for _, i in key])
+        self.field_values = _tuple_getter([i for _, i in fields])
 
-    def critical(self, event=None, *args, **kw):
+    def group(self, values):
         """
-        Process event and call :meth:`logging.Logger.critical` with the result.
+        Returns the `METRICS_SHARDS` state key and the numeric field values
         """
-        if not self._logger.isEnabledFor(logging.CRITICAL):
-            return
-
-        kw = self._add_base_info(kw)
-        kw["level"] = "critical"
-        return self._proxy_to_logger("critical", event, *args, **kw)
+        key = tuple(zip(self.key_names, self.key_values(values)))
+        return (key, self.field_names), self.field_values(values)
 
-    def exception(self, event=None, *args, **kw):
-        """
-        Process event and call :meth:`logging.Logger.error` with the result,
-        after setting ``exc_info`` to `True`.
-        """
-        if not self._logger.isEnabledFor(logging.ERROR):
-            return
 
-        kw = self._add_base_info(kw)
-        kw["level"] = "exception"
-        kw.setdefault("exc_info", True)
-        return self.error(event, *args, **kw)
+def _metrics_shard():
+    try:
+        return _METRICS_LOCAL.shard
+    except AttributeError:
+        shard = MetricShard()
+        with METRICS_SHARDS_LOCK:
+            METRICS_SHARDS.append(shard)
+        _METRICS_LOCAL.shard = shard
+        return shard
 
-    def _dump_stats(self, metric):
-        """
-        Dumps metrics irrespective of log level
-        """
-        # TODO have a feature to silence metrics as well
-        # TODO if dumping to console, we shouldn't club metrics. It should be sent one by one on each line.
-        return self._proxy_to_logger("msg", metric, type="metric", level="info")
 
-    fatal = critical
+def collect_metrics():
+    """
+    Empties every thread's shard and returns the merged aggregation table
+    """
+    global METRIC_KEYS
 
-    def _proxy_to_logger(self, method_name, event, *event_args, **event_kw):
-        """
-        Propagate a method call to the wrapped logger.
+    with METRICS_SHARDS_LOCK:
+        shards = list(METRICS_SHARDS)
 
-        This is the same as the superclass implementation, except that
-        it also preserves positional arguments in the `event_dict` so
-        that the stdblib's support for format strings can be used.
-        """
+    with METRIC_KEYS_LOCK:
+        METRIC_KEYS = {}
 
-        if isinstance(event, bytes):
-            event = event.decode("utf-8")
+    merged = {}
+    for shard in shards:
+        # a finished thread cannot record anything more once emptied
+        alive = shard.thread.is_alive()
+        state = shard.take()
+        if not alive:
+            with METRICS_SHARDS_LOCK:
+                METRICS_SHARDS.remove(shard)
 
-        if event_args:
-            event_kw["positional_args"] = event_args
+        _merge_metrics(merged, state)
 
-        return super(BoundLevelLogger, self)._proxy_to_logger(
-            method_name, event=event, **event_kw
-        )
+    return merged
 
-    # Pass-through methods to mimick the stdlib's logger interface.
 
-    def setLevel(self, level):
-        """
-        Calls :meth:`logging.Logger.setLevel` with unmodified arguments.
-        """
-        self._logger.setLevel(level)
+def _merge_metrics(merged, state):
+    for key, s in state.items():
+        m = merged.get(key)
+        if m is None:
+            merged[key] = s
+            continue
 
+        m["num"] += s["num"]
+        mfields = m["fields"]
+        for fk, fv in s["fields"].items():
+            mfields[fk].merge(fv)
 
-def _structlog_default_keys_processor(logger_class, log_method, event):
-    """Add unique id, type and hostname"""
-    global HOSTNAME
 
-    if "id" not in event:
-        event["id"] = "%s_%s" % (
-            datetime.utcnow().strftime("%Y%m%dT%H%M%S"),
-            uuid.uuid1().hex,
-        )
+def collect_metric_key_cache_stats():
+    """
+    Returns and resets (hits, misses) of the metric layout caches
+    """
+    with METRICS_SHARDS_LOCK:
+        shards = list(METRICS_SHARDS)
 
-    if "type" not in event:
-        event["type"] = "log"
+    hits = misses = 0
+    for shard in shards:
+        h, m = shard.take_cache_stats()
+        hits += h
+        misses += m
 
-    event["host"] = HOSTNAME
+    return hits, misses
 
-    return event
 
+def collect_metric_key_overflows():
+    """
+    Returns and resets the number of events per metric event
+    name that were folded into an overflow key
+    """
+    with METRICS_SHARDS_LOCK:
+        shards = list(METRICS_SHARDS)
 
-def _structlog_minimal_processor(logger_class, log_method, event):
-    for key in ("host", "id", "type"):
-        if key in event:
-            event.pop(key)
+    overflows = {}
+    for shard in shards:
+        for event, n in shard.take_overflows().items():
+            overflows[event] = overflows.get(event, 0) + n
 
-    return event
+    return overflows
 
 
 @keeprunning()
 def dump_metrics(log, interval):
-    global METRICS_STATE
-
     terminate = False
 
     while True:
         try:
-            log._force_flush_q.get(block=True, timeout=interval)
+            log._force_flush_q.get(
+                block=True, timeout=METRIC_GROUPING_INTERVAL or interval
+            )
             terminate = True
         except queue.Empty:
             pass
 
-        METRICS_STATE_LOCK.acquire()
-        m = METRICS_STATE
-        METRICS_STATE = {}
-        METRICS_STATE_LOCK.release()
+        m = collect_metrics()
+        grouped = []
+        if METRIC_EXPORTERS:
+            from .exporters import GroupedMetric
 
         for (k, _), v in m.items():
             n = v["num"]
-            d = dict(k)
-            d.update(v["fields"])
-
-            level = d.pop("level")
-            event = d.pop("event")
+            keys = dict(k)
+            fields = {}
+            kinds = {}
+            for fk, fv in v["fields"].items():
+                aggregates = v.get("aggregates", {}).get(fk)
+                aggregates = aggregates or _metric_field_aggregates(fk)
+                fields.update(fv.summary(fk, n, aggregates))
+                kinds.update(_aggregate_kinds(fk, aggregates))
+
+            level = keys.pop("level")
+            event = keys.pop("event")
+            if METRIC_EXPORTERS:
+                grouped.append(GroupedMetric(event, level, keys, n, fields))
+
+            d = dict(keys)
+            d.update(fields)
+            if kinds:
+                # how `metrics` combines the fields across lines
+                d["_aggregates"] = kinds
 
             fn = getattr(log, level)
             fn(event, type="metric", __grouped__=True, num=n, **d)
 
+        for exporter in METRIC_EXPORTERS:
+            try:
+                exporter.export(grouped)
+            except Exception:
+                log.exception("metric_export_failed", exporter=type(exporter).__name__)
+
+        for event, n in collect_metric_key_overflows().items():
+            log.warning(
+                "metric_keys_overflow",
+                type="metric",
+                __grouped__=True,
+                num=n,
+                metric=event,
+                max_keys=METRIC_MAX_KEYS,
+            )
+
+        # internal, only of interest when debugging
+        hits, misses = collect_metric_key_cache_stats()
+        if hits or misses:
+            log.debug(
+                "metric_key_cache",
+                type="metric",
+                __grouped__=True,
+                num=hits + misses,
+                hits_sum=hits,
+                misses_sum=misses,
+                _aggregates=dict(hits_sum="sum", misses_sum="sum"),
+            )
+
+        for event, spec, n in collect_suppressed_events():
+            log.info(
+                "suppressed_log_events",
+                type="metric",
+                __grouped__=True,
+                num=n,
+                log_event=event,
+                sampling=spec,
+            )
+
+        dropped = _pop_dropped_log_lines()
+        if dropped:
+            log.warning(
+                "dropped_log_lines", type="metric", __grouped__=True, num=dropped
+            )
+
+        shipped = LOG_SHIPPER.take_counts() if LOG_SHIPPER is not None else None
+        if shipped:
+            fn = log.warning if shipped["dropped"] else log.info
+            fn(
+                "log_shipping",
+                type="metric",
+                __grouped__=True,
+                num=shipped["sent"] + shipped["spooled"] + shipped["dropped"],
+                sent_sum=shipped["sent"],
+                spooled_sum=shipped["spooled"],
+                replayed_sum=shipped["replayed"],
+                dropped_sum=shipped["dropped"],
+                _aggregates=dict(
+                    sent_sum="sum",
+                    spooled_sum="sum",
+                    replayed_sum="sum",
+                    dropped_sum="sum",
+                ),
+            )
+
         if terminate:
+            METRICS_FLUSHED.set()
             break
 
 
+def _pop_dropped_log_lines():
+    stream = ASYNC_STREAM
+    if stream is None:
+        return 0
+
+    dropped, stream.dropped = stream.dropped, 0
+    return dropped
+
+
 def metrics_grouping_processor(logger_class, log_method, event):
     if event.get("type") == "logged_metric":
         event["type"] = "metric"
@@ -363,49 +2207,195 @@ def metrics_grouping_processor(logger_class, log_method, event):
         event.pop("__grouped__")
         return event
 
-    for k in ("timestamp", "type", "id"):
-        if k not in event:
-            continue
-        event.pop(k)
-
-    # Delete a key startswith `_` for grouping.
-    event = {k: v for k, v in event.items() if not k.startswith("_")}
+    names = tuple(event)
+    values = tuple(event.values())
+    shape = (names, tuple(map(type, values)))
 
-    key = []
-    fields = []
+    shard = _metrics_shard()
+    with shard.lock:
+        key, fields = shard.layout(shape, names, values).group(values)
 
-    for k, v in sorted(event.items()):
-        (fields if isinstance(v, (numbers.Number, bool)) else key).append((k, v))
+        state = shard.state.get(key)
+        if state is None:
+            key = shard.admit(key)
+            state = shard.state.get(key)
 
-    key = (tuple(key), tuple(sorted(k for k, _ in fields)))
-    METRICS_STATE_LOCK.acquire()
-    try:
-        state = METRICS_STATE.get(key, {"num": 0, "fields": {}})
+        if state is None:
+            sfields = {fk: MetricField(_metric_field_aggregates(fk)) for fk in key[1]}
+            state = shard.state[key] = {"num": 0, "fields": sfields}
         sfields = state["fields"]
-        num = state["num"]
 
-        for fk, fv in fields:
-            favg = sfields.get(fk, 0.0)
-            favg = (favg * num + fv) / (num + 1)  # moving average
-            sfields[fk] = favg
+        for fk, fv in zip(key[1], fields):
+            sfields[fk].add(fv)
 
         state["num"] += 1
 
-        METRICS_STATE[key] = state
-    finally:
-        METRICS_STATE_LOCK.release()
-
     raise structlog.DropEvent
 
 
-def define_log_processors():
+class Stats(object):
+    """
+    Records metrics straight into the metric aggregation tables, without
+    building and processing a log event per sample. They are reported
+    with the grouped metrics logged as `type="metric"` every interval:
+
+    - `timer(event)`: "duration" in seconds, of a block or function
+    - `counter(event, n=1)`: "count_sum", the sum of the counts
+    - `gauge(event, value)`: "value"
+
+    Keyword arguments are grouping keys, as non numeric keys of metric
+    log events are, and the aggregates of duration and value can be
+    changed with `metric_field_aggregates`.
+    """
+
+    LEVEL = "info"
+
+    def __init__(self, **keys):
+        self.keys = tuple(keys.items())
+
+        # (event, field) -> state key, for calls without keyword arguments
+        self._state_keys = {}
+
+    def bind(self, **keys):
+        """
+        Returns Stats which add @keys to every metric
+        """
+        return Stats(**dict(self.keys, **keys))
+
+    def _state_key(self, event, field, keys):
+        if not keys:
+            key = self._state_keys.get((event, field))
+            if key is not None:
+                return key
+
+        pairs = dict(self.keys, **keys)
+        pairs["event"] = event
+        pairs["level"] = self.LEVEL
+        key = (tuple(sorted(pairs.items())), (field,))
+
+        if not keys:
+            self._state_keys[(event, field)] = key
+
+        return key
+
+    def _record(self, event, field, value, keys, aggregates=None):
+        key = self._state_key(event, field, keys)
+
+        shard = _metrics_shard()
+        with shard.lock:
+            state = shard.state.get(key)
+            if state is None:
+                key = shard.admit(key)
+                state = shard.state.get(key)
+
+            if state is None:
+                aggregates = aggregates or _metric_field_aggregates(field)
+                state = shard.state[key] = {
+                    "num": 0,
+                    "fields": {field: MetricField(aggregates)},
+                    "aggregates": {field: aggregates},
+                }
+
+            state["fields"][field].add(value)
+            state["num"] += 1
+
+    def counter(self, event, n=1, **keys):
+        self._record(event, "count", n, keys, aggregates=("sum",))
+
+    def gauge(self, event, value, **keys):
+        self._record(event, "value", value, keys)
+
+    def timer(self, event, **keys):
+        """
+        Times a `with` block, or every call when used as a decorator
+        """
+        return StatsTimer(self, event, keys)
+
+
+class StatsTimer(object):
+    __slots__ = ("stats", "event", "keys", "start")
+
+    def __init__(self, stats, event, keys):
+        self.stats = stats
+        self.event = event
+        self.keys = keys
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.start
+        self.stats._record(self.event, "duration", duration, self.keys)
+
+    def __call__(self, fn):
+        stats, event, keys = self.stats, self.event, self.keys
+
+        import inspect
+
+        if inspect.iscoroutinefunction(fn):
+
+            @wraps(fn)
+            async def timed(*args, **kwargs):
+                with StatsTimer(stats, event, keys):
+                    return await fn(*args, **kwargs)
+
+        else:
+
+            @wraps(fn)
+            def timed(*args, **kwargs):
+                with StatsTimer(stats, event, keys):
+                    return fn(*args, **kwargs)
+
+        return timed
+
+
+class NullStats(object):
+    """
+    `Stats` used when metrics are not grouped, every method is a no-op
+    """
+
+    def bind(self, **keys):
+        return self
+
+    def counter(self, event, n=1, **keys):
+        pass
+
+    def gauge(self, event, value, **keys):
+        pass
+
+    def timer(self, event, **keys):
+        return _NULL_TIMER
+
+
+class NullStatsTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def __call__(self, fn):
+        return fn
+
+
+_NULL_TIMER = NullStatsTimer()
+
+
+def define_log_processors(timestamp_cache=False):
     """
     log processors that structlog executes before final rendering
     """
     # these processors should accept logger, method_name and event_dict
     # and return a new dictionary which will be passed as event_dict to the next one.
+    if timestamp_cache:
+        timestamper = _cached_timestamper
+    else:
+        timestamper = structlog.processors.TimeStamper(fmt="iso")
+
     return [
-        structlog.processors.TimeStamper(fmt="iso"),
+        timestamper,
         _structlog_default_keys_processor,
         structlog.stdlib.PositionalArgumentsFormatter(),
         structlog.processors.StackInfoRenderer(),
@@ -413,8 +2403,122 @@ def define_log_processors():
     ]
 
 
+def compile_log_processors(
+    processors,
+    timestamp_cache=False,
+    minimal=False,
+    metric_grouping=False,
+    console=None,
+    renderer=None,
+):
+    """
+    Fuses the processors of `define_log_processors`, @processors and the
+    ones `_configure_logger` adds for its options into a single processor
+    specialized for them:
+
+    - minimal=True does not generate the id, type and host keys which
+      `_structlog_minimal_processor` would remove
+    - metric_grouping=True passes only metric events to
+      `metrics_grouping_processor`, and without @processors groups them
+      before the timestamp and id it ignores are generated
+    - @console (a `StderrConsoleRenderer`) and @renderer are called last
+
+    Default processors that only act on optional keys (positional args,
+    stack info, exc info) are called only when the key is present.
+    """
+    if timestamp_cache:
+        timestamp = TIMESTAMPS.iso
+    else:
+        timestamp = None
+        timestamper = structlog.processors.TimeStamper(fmt="iso")
+
+    positional_args = structlog.stdlib.PositionalArgumentsFormatter()
+    stack_info = structlog.processors.StackInfoRenderer()
+    exc_info = structlog.processors.format_exc_info
+    processors = tuple(processors)
+    group_first = metric_grouping and not processors
+
+    def compiled_processor(logger, method_name, event):
+        if group_first and event.get("type") == "metric" and "__grouped__" not in event:
+            event["host"] = HOSTNAME
+            if "positional_args" in event:
+                event = positional_args(logger, method_name, event)
+            if "stack_info" in event:
+                event = stack_info(logger, method_name, event)
+            if "exc_info" in event:
+                event = exc_info(logger, method_name, event)
+            # raises DropEvent
+            return metrics_grouping_processor(logger, method_name, event)
+
+        if timestamp is not None:
+            event["timestamp"] = timestamp()
+        else:
+            event = timestamper(logger, method_name, event)
+
+        if not minimal:
+            if "id" not in event:
+                event["id"] = EVENT_ID()
+            if "type" not in event:
+                event["type"] = "log"
+            event["host"] = HOSTNAME
+
+        if "positional_args" in event:
+            event = positional_args(logger, method_name, event)
+        if "stack_info" in event:
+            event = stack_info(logger, method_name, event)
+        if "exc_info" in event:
+            event = exc_info(logger, method_name, event)
+
+        if processors:
+            for p in processors:
+                event = p(logger, method_name, event)
+
+        if metric_grouping and event.get("type") in ("metric", "logged_metric"):
+            event = metrics_grouping_processor(logger, method_name, event)
+
+        if minimal:
+            # as passed by the caller
+            event.pop("host", None)
+            event.pop("id", None)
+            event.pop("type", None)
+
+        if console is not None:
+            event = console(logger, method_name, event)
+
+        if renderer is not None:
+            return renderer(logger, method_name, event)
+
+        return event
+
+    return compiled_processor
+
+
 def _configure_logger(
-    fmt, quiet, level, fpath, processors, metric_grouping_interval, minimal
+    fmt,
+    quiet,
+    level,
+    fpath,
+    processors,
+    metric_grouping_interval,
+    minimal,
+    async_sink=False,
+    async_buffer_size=ASYNC_LOG_BUFFER_SIZE,
+    async_overflow="block",
+    metric_aggregates=None,
+    metric_field_aggregates=None,
+    metric_max_keys=None,
+    json_serializer="json",
+    event_id="uuid",
+    timestamp_cache=False,
+    compiled=False,
+    file_rotation=None,
+    multiprocess=False,
+    log_sampling=None,
+    log_rate_limits=None,
+    metric_exporters=None,
+    log_ship=None,
+    file_format="json",
+    file_index=None,
 ):
     """
     configures a logger when required write to stderr or a file
@@ -422,45 +2526,142 @@ def _configure_logger(
 
     # NOTE not thread safe. Multiple BaseScripts cannot be instantiated concurrently.
 
-    global _GLOBAL_LOG_CONFIGURED
+    global _GLOBAL_LOG_CONFIGURED, ASYNC_STREAM, METRIC_AGGREGATES, METRIC_MAX_KEYS
+    global LOG_SHIPPER
+    global EVENT_ID, LOGGER_FACTORY, METRIC_GROUPING_INTERVAL
     if _GLOBAL_LOG_CONFIGURED:
         return
 
+    assert event_id in EVENT_ID_GENERATORS, "unknown event id %r" % event_id
+    if event_id == "counter":
+        EVENT_ID = _counter_event_id
+    else:
+        EVENT_ID = _uuid_event_id_generator()
+
+    if metric_max_keys is not None:
+        METRIC_MAX_KEYS = metric_max_keys
+
+    if metric_aggregates:
+        METRIC_AGGREGATES = parse_metric_aggregates(metric_aggregates)
+
+    for field, aggregates in (metric_field_aggregates or {}).items():
+        METRIC_FIELD_AGGREGATES[field] = parse_metric_aggregates(aggregates)
+
+    LOG_SAMPLING.update(_log_samplers(log_sampling or {}, log_rate_limits or {}))
+
+    add_metric_exporters(metric_exporters or [])
+
+    METRIC_GROUPING_INTERVAL = metric_grouping_interval
+    LOG_CONFIG.update(
+        level=level,
+        log_sampling=dict(log_sampling or {}),
+        log_rate_limits=dict(log_rate_limits or {}),
+        metric_grouping_interval=metric_grouping_interval,
+    )
+
     assert fmt in ["json", "pretty"]
 
-    _processors = define_log_processors()
-    _processors += processors or []
-    if metric_grouping_interval:
-        _processors.append(metrics_grouping_processor)
+    assert file_format in LOG_FILE_FORMATS, "unknown log file format %r" % file_format
 
-    if minimal:
-        _processors.append(_structlog_minimal_processor)
+    renderer = JSONRenderer(json_serializer)
+    if fpath and (file_format == "binary" or file_index):
+        # the file sink gets event dicts; json is only rendered when needed
+        needs_json = (
+            file_format == "json"
+            or (fmt == "json" and not quiet)
+            or log_ship
+            or multiprocess
+        )
+        renderer = LogEventRenderer(renderer if needs_json else None)
 
     streams = []
 
     if fpath:
-        f = FileWrapper(fpath)
+        f = FileWrapper(
+            fpath,
+            binary=renderer.binary,
+            fmt=file_format,
+            index=file_index,
+            **(file_rotation or {})
+        )
         streams.append(f)
 
-    if fmt == "json" and not quiet:
-        streams.append(sys.stderr)
+    if log_ship:
+        from .shipping import LogShipper
 
-    if fmt == "pretty" and not quiet:
-        _processors.append(StderrConsoleRenderer())
+        LOG_SHIPPER = LogShipper(**log_ship)
+        streams.append(LOG_SHIPPER)
 
-    _processors.append(structlog.processors.JSONRenderer())
+    if fmt == "json" and not quiet:
+        stderr = sys.stderr
+        if renderer.binary and hasattr(stderr, "buffer"):
+            stderr = BinaryStream(stderr.buffer)
+        elif renderer.binary:
+            stderr = TextStream(stderr)
+        streams.append(stderr)
+
+    console = None
+    if fmt == "pretty" and not quiet:
+        console = StderrConsoleRenderer()
+
+    if compiled:
+        _processors = [
+            compile_log_processors(
+                processors or [],
+                timestamp_cache,
+                minimal=minimal,
+                metric_grouping=bool(metric_grouping_interval),
+                console=console,
+                renderer=renderer,
+            )
+        ]
+        wrapper_class = CompiledBoundLevelLogger
+    else:
+        _processors = define_log_processors(timestamp_cache)
+        _processors.extend(processors or [])
+        if metric_grouping_interval:
+            _processors.append(metrics_grouping_processor)
+        if minimal:
+            _processors.append(_structlog_minimal_processor)
+        if console is not None:
+            _processors.append(console)
+        _processors.append(renderer)
+        wrapper_class = BoundLevelLogger
 
     # a global level struct log config unless otherwise specified.
     level = getattr(logging, level.upper())
 
     stream = streams[0] if len(streams) == 1 else Stream(*streams)
+    if async_sink:
+        stream = AsyncStream(stream, maxsize=async_buffer_size, overflow=async_overflow)
+        ASYNC_STREAM = stream
+    if multiprocess:
+        stream = CollectorStream(stream, binary=renderer.binary)
+        from multiprocessing.util import register_after_fork
+
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(
+                after_in_child=lambda: _after_fork_in_collector_child(
+                    stream, metric_grouping_interval
+                )
+            )
+        else:
+            # python < 3.7, only children started by multiprocessing
+            register_after_fork(
+                stream,
+                lambda s: _after_fork_in_collector_child(s, metric_grouping_interval),
+            )
+        if metric_grouping_interval:
+            register_after_fork(stream, _register_child_metrics_finalizer)
     atexit.register(stream.close)
 
+    LOGGER_FACTORY = LevelLoggerFactory(stream, level=level)
+
     structlog.configure(
         processors=_processors,
         context_class=dict,
-        logger_factory=LevelLoggerFactory(stream, level=level),
-        wrapper_class=BoundLevelLogger,
+        logger_factory=LOGGER_FACTORY,
+        wrapper_class=wrapper_class,
         cache_logger_on_first_use=True,
     )
 
@@ -480,33 +2681,108 @@ def init_logger(
     processors=None,
     metric_grouping_interval=None,
     minimal=False,
+    async_sink=False,
+    async_buffer_size=ASYNC_LOG_BUFFER_SIZE,
+    async_overflow="block",
+    metric_aggregates=None,
+    metric_field_aggregates=None,
+    metric_max_keys=None,
+    json_serializer="json",
+    event_id="uuid",
+    timestamp_cache=False,
+    compiled=False,
+    file_rotation=None,
+    multiprocess=False,
+    log_sampling=None,
+    log_rate_limits=None,
+    metric_exporters=None,
+    log_ship=None,
+    file_format="json",
+    file_index=None,
 ):
     """
-    fmt=pretty/json controls only stderr; file always gets json.
+    fmt=pretty/json controls only stderr; file gets json, or with
+    file_format="binary" the binary log format, see `basescript.binlog`.
+    file_index is a dict of index options for @fpath eg: {"every": 1000},
+    see `FileWrapper` and `basescript.logindex`.
+    async_sink=True moves writes to a background thread, see `AsyncStream`.
+    metric_aggregates="avg,max,p99" picks what grouped metrics report for
+    every numeric field and metric_field_aggregates={"field": "p50,p99"}
+    overrides that per field.
+    metric_max_keys caps distinct grouping keys per metric event name in
+    an interval (0 for no cap), see `MetricShard.admit`.
+    json_serializer is one of `JSON_SERIALIZERS`, see `JSONRenderer`.
+    event_id="counter" generates ids from a per process prefix and counter
+    instead of uuid1, timestamp_cache=True formats timestamps using
+    `TimestampCache`.
+    compiled=True fuses the default processors, see `compile_log_processors`,
+    and makes calls at disabled levels no-ops, see `CompiledBoundLevelLogger`.
+    file_rotation is a dict of rotation options for @fpath, eg:
+    {"rotate_size": 1 << 30, "compress": "gzip", "keep": 10}, see `FileWrapper`.
+    multiprocess=True makes forked child processes send their logs and
+    metrics to this process, see `CollectorStream`.
+    log_sampling={"cache hit": "1/100", "poll": 0.01} and
+    log_rate_limits={"request failed": "10/s"} drop log events of those
+    names before they are processed, see `parse_log_sampling` and
+    `parse_log_rate_limit`; "*" applies to other debug and info events.
+    Suppressed events are counted in the `suppressed_log_events` metric.
+    metric_exporters is a list of exporters also sent the grouped metrics
+    of every interval eg: [StatsdExporter("localhost", 8125)], see
+    `basescript.exporters`.
+    log_ship is a dict of options of a `LogShipper` also sending the json
+    lines to a collector eg: {"url": "tcp://collector:5170",
+    "spool": "/var/spool/app.logs"}.
     """
 
-    global LOG
+    global LOG, METRICS_THREAD
     if LOG is not None:
         return LOG
 
-    if quiet and fpath is None:
+    if quiet and fpath is None and not log_ship:
         # no need for a log - return a dummy
         return Dummy()
 
-    if not fmt and not quiet:
-        fmt = "pretty" if sys.stderr.isatty() else "json"
+    if not fmt:
+        # only stderr is affected, which is not written to when quiet
+        fmt = "pretty" if sys.stderr.isatty() and not quiet else "json"
 
     _configure_logger(
-        fmt, quiet, level, fpath, processors, metric_grouping_interval, minimal
+        fmt,
+        quiet,
+        level,
+        fpath,
+        processors,
+        metric_grouping_interval,
+        minimal,
+        async_sink=async_sink,
+        async_buffer_size=async_buffer_size,
+        async_overflow=async_overflow,
+        metric_aggregates=metric_aggregates,
+        metric_field_aggregates=metric_field_aggregates,
+        metric_max_keys=metric_max_keys,
+        json_serializer=json_serializer,
+        event_id=event_id,
+        timestamp_cache=timestamp_cache,
+        compiled=compiled,
+        file_rotation=file_rotation,
+        multiprocess=multiprocess,
+        log_sampling=log_sampling,
+        log_rate_limits=log_rate_limits,
+        metric_exporters=metric_exporters,
+        log_ship=log_ship,
+        file_format=file_format,
+        file_index=file_index,
     )
 
     log = structlog.get_logger()
     log._force_flush_q = queue.Queue(maxsize=FORCE_FLUSH_Q_SIZE)
 
     if metric_grouping_interval:
-        keep_running = Thread(target=dump_metrics, args=(log, metric_grouping_interval))
-        keep_running.daemon = True
-        keep_running.start()
+        METRICS_THREAD = Thread(
+            target=dump_metrics, args=(log, metric_grouping_interval)
+        )
+        METRICS_THREAD.daemon = True
+        METRICS_THREAD.start()
 
     # TODO functionality to change even the level of global stdlib logger.
 
@@ -514,11 +2790,120 @@ def init_logger(
     return log
 
 
-def pretty_print(colors=True):
-    r = structlog.dev.ConsoleRenderer(colors=colors)
-    for line in sys.stdin:
-        print(r(None, None, json.loads(line)))
-
-
 def get_logger():
     return LOG
+
+
+def add_metric_exporters(exporters):
+    """
+    Also sends the grouped metrics of every interval to @exporters, see
+    `basescript.exporters`. They are closed by `flush_logger`, or on exit.
+    """
+    for exporter in exporters:
+        METRIC_EXPORTERS.append(exporter)
+        if hasattr(exporter, "close"):
+            atexit.register(exporter.close)
+
+
+def pretty_print(*args, **kwargs):
+    """
+    See `basescript.pretty.pretty_print`, imported only when called
+    """
+    from .pretty import pretty_print
+
+    return pretty_print(*args, **kwargs)
+
+
+def update_log_config(
+    level=None, log_sampling=None, log_rate_limits=None, metric_grouping_interval=None
+):
+    """
+    Changes settings of the configured logger while running: the @level of
+    every logger, including those already bound and cached, the log
+    sampling and rate limits (each replaces all the previous ones, see
+    `init_logger`) and the metric grouping interval, which takes effect
+    from the next interval. None leaves a setting unchanged.
+
+    Everything is validated before anything is changed, and concurrent
+    updates and reloads are applied one at a time.
+    """
+    global LOG_SAMPLING, METRIC_GROUPING_INTERVAL
+
+    with RELOAD_LOCK:
+        if LOGGER_FACTORY is None:
+            raise RuntimeError("logger is not configured")
+
+        config = dict(LOG_CONFIG)
+        changes = dict(
+            level=level,
+            log_sampling=log_sampling,
+            log_rate_limits=log_rate_limits,
+            metric_grouping_interval=metric_grouping_interval,
+        )
+        config.update((k, v) for k, v in changes.items() if v is not None)
+
+        levelno = getattr(logging, str(config["level"]).upper(), None)
+        if not isinstance(levelno, int):
+            raise ValueError("unknown log level %r" % config["level"])
+
+        interval = config["metric_grouping_interval"]
+        if interval != LOG_CONFIG["metric_grouping_interval"]:
+            if not LOG_CONFIG["metric_grouping_interval"] or not interval:
+                raise ValueError(
+                    "metric grouping can not be turned on or off while running"
+                )
+
+        samplers = _log_samplers(
+            config["log_sampling"], config["log_rate_limits"], LOG_SAMPLING
+        )
+
+        LOGGER_FACTORY.level = levelno
+        for logger in list(LOGGER_FACTORY.loggers):
+            logger.setLevel(levelno)
+        for logger in list(COMPILED_LOGGERS.values()):
+            logger._disable_levels()
+        logging.getLogger().setLevel(levelno)
+
+        # suppressed counts of removed samplers are still reported
+        kept = set(id(s) for ss in samplers.values() for s in ss)
+        for event, ss in LOG_SAMPLING.items():
+            for sampler in ss:
+                if id(sampler) not in kept:
+                    RETIRED_SAMPLERS.append((event, sampler))
+
+        LOG_SAMPLING = samplers
+        METRIC_GROUPING_INTERVAL = interval
+        LOG_CONFIG.update(config)
+
+
+def flush_logger(timeout=None):
+    """
+    Called on exit: logs and exports the metrics grouped since the last
+    interval, waits for lines queued by an async sink to reach their
+    stream and for lines written to a `LogShipper` to be sent or spooled,
+    then closes the metric exporters. Returns False if that took longer
+    than @timeout seconds.
+    """
+    drained = True
+    if METRICS_THREAD is not None:
+        METRICS_FLUSHED.clear()
+        try:
+            LOG._force_flush_q.put(None, block=True, timeout=timeout)
+            drained = METRICS_FLUSHED.wait(timeout)
+        except queue.Full:
+            drained = False
+
+    if ASYNC_STREAM is not None:
+        drained = ASYNC_STREAM.drain(timeout=timeout) and drained
+
+    if LOG_SHIPPER is not None:
+        drained = LOG_SHIPPER.drain(timeout=timeout) and drained
+
+    exporters = list(METRIC_EXPORTERS)
+    del METRIC_EXPORTERS[:]
+    for exporter in exporters:
+        if hasattr(exporter, "close"):
+            atexit.unregister(exporter.close)
+            exporter.close()
+
+    return drained
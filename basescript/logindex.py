@@ -0,0 +1,323 @@
+"""
+Sparse sidecar indexes of log files, see `FileWrapper(index=...)`.
+
+<log file>.idx is a json line header followed by a json line per block of
+consecutive records of the log file, written once the block is complete:
+    {"offset": 0, "end": 352011, "count": 1000,
+     "since": "2018-03-01T10:00:00.1Z", "until": "2018-03-01T10:00:59.8Z",
+     "bloom": "<hex>"}
+with the byte range of the block, the earliest and latest timestamps in it and
+a bloom filter of its event names. Readers skip blocks which cannot hold
+the events asked for and read the rest, including parts of the log not
+covered by any block, such as the block still being written. A block of a
+binary log starts with no keys defined, so it can be decoded on its own.
+
+The header identifies the log file by a checksum of its first bytes, so
+that an index left behind by a log file since replaced is not used.
+"""
+
+import os
+import json
+import zlib
+from datetime import datetime, timedelta
+
+from .log import LOG_INDEX_EVERY, LOG_INDEX_INTERVAL
+
+LOG_INDEX_SUFFIX = ".idx"
+LOG_INDEX_VERSION = 1
+
+# ~0.3% false positives with 100 distinct event names in a block
+LOG_INDEX_BLOOM_BITS = 2048
+LOG_INDEX_BLOOM_HASHES = 3
+
+# bytes of the log file identifying it
+LOG_INDEX_HEAD_SIZE = 256
+
+_BLOOM_CACHE_SIZE = 10000
+
+
+def index_path(path):
+    return path + LOG_INDEX_SUFFIX
+
+
+def _head_crc(path, size, opener=None):
+    """
+    Checksum of the first @size bytes of log file @path, opened for
+    reading bytes by opener(path), None if it is shorter
+    """
+    try:
+        with opener(path) if opener else open(path, "rb") as f:
+            head = f.read(size)
+    except (IOError, OSError):
+        return None
+
+    return zlib.crc32(head) & 0xFFFFFFFF if len(head) == size else None
+
+
+class _Bloom(object):
+    """
+    Bit masks of values in a bloom filter of @bits bits, as python ints
+    """
+
+    def __init__(self, bits=LOG_INDEX_BLOOM_BITS, hashes=LOG_INDEX_BLOOM_HASHES):
+        self.bits = bits
+        self.hashes = hashes
+        self._masks = {}
+
+        # deferred, hashlib takes a few ms to import
+        from hashlib import blake2b
+
+        self._blake2b = blake2b
+
+    def mask(self, value):
+        m = self._masks.get(value)
+        if m is not None:
+            return m
+
+        digest = self._blake2b(str(value).encode("utf-8"), digest_size=8).digest()
+        h1 = int.from_bytes(digest[:4], "big")
+        h2 = int.from_bytes(digest[4:], "big") | 1
+
+        m = 0
+        for i in range(self.hashes):
+            m |= 1 << ((h1 + i * h2) % self.bits)
+
+        if len(self._masks) >= _BLOOM_CACHE_SIZE:
+            self._masks.clear()
+        self._masks[value] = m
+        return m
+
+
+class LogIndexWriter(object):
+    """
+    Maintains the index of the log file @fpath as `FileWrapper` writes
+    to it. A block is closed after @every records or once it spans
+    @interval seconds of timestamps.
+    """
+
+    def __init__(
+        self,
+        fpath,
+        every=LOG_INDEX_EVERY,
+        interval=LOG_INDEX_INTERVAL,
+        bloom_bits=LOG_INDEX_BLOOM_BITS,
+    ):
+        assert every > 0, "expected positive every but got %r" % every
+
+        self.fpath = fpath
+        self.path = index_path(fpath)
+        self.every = every
+        self.interval = interval
+        self.bloom = _Bloom(bloom_bits)
+
+        self.f = None
+        self.block = None
+
+    def open(self):
+        """
+        Starts indexing the log file as (re)opened for appending,
+        keeping the existing index only if it is of the same file
+        """
+        self.close()
+        self.block = None
+
+        header = None
+        try:
+            with open(self.path) as f:
+                header = json.loads(f.readline())
+        except (IOError, OSError, ValueError):
+            pass
+
+        valid = (
+            isinstance(header, dict)
+            and header.get("version") == LOG_INDEX_VERSION
+            and header.get("bloom_bits") == self.bloom.bits
+            and header.get("bloom_hashes") == self.bloom.hashes
+            and _head_crc(self.fpath, header.get("head_size", 0))
+            == header.get("head_crc")
+        )
+        if not valid and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def due(self, event):
+        """
+        Whether @event, about to be written, should start a new block
+        """
+        block = self.block
+        if block is None:
+            return False
+        if block["count"] >= self.every:
+            return True
+
+        ts = event.get("timestamp") if event is not None else None
+        due = block["due"]
+        return due is not None and isinstance(ts, str) and ts >= due
+
+    def add(self, offset, event):
+        """
+        Records @event written at @offset of the log file
+        """
+        block = self.block
+        if block is None:
+            block = self.block = dict(
+                offset=offset, count=0, due=None, since=None, until=None, bloom=0
+            )
+
+        block["count"] += 1
+        if event is None:
+            return
+
+        ts = event.get("timestamp")
+        if isinstance(ts, str):
+            if block["since"] is None and self.interval:
+                block["due"] = _iso_after(ts, self.interval)
+            # threads may log slightly out of order
+            if block["since"] is None or ts < block["since"]:
+                block["since"] = ts
+            if block["until"] is None or ts > block["until"]:
+                block["until"] = ts
+
+        name = event.get("event")
+        if name is not None:
+            block["bloom"] |= self.bloom.mask(name)
+
+    def close_block(self, end):
+        """
+        Writes the entry of the current block, which ends at @end. The
+        log file must have been flushed up to there.
+        """
+        block, self.block = self.block, None
+        if block is None or end <= block["offset"]:
+            return
+
+        if self.f is None:
+            new = not os.path.exists(self.path)
+            self.f = open(self.path, "a")
+            if new:
+                self._write_header()
+
+        entry = dict(
+            offset=block["offset"],
+            end=end,
+            count=block["count"],
+            since=block["since"],
+            until=block["until"],
+            bloom="%x" % block["bloom"],
+        )
+        self.f.write(json.dumps(entry) + "\n")
+        self.f.flush()
+
+    def _write_header(self):
+        size = min(LOG_INDEX_HEAD_SIZE, os.path.getsize(self.fpath))
+        header = dict(
+            version=LOG_INDEX_VERSION,
+            head_size=size,
+            head_crc=_head_crc(self.fpath, size),
+            bloom_bits=self.bloom.bits,
+            bloom_hashes=self.bloom.hashes,
+        )
+        self.f.write(json.dumps(header) + "\n")
+
+
+def _iso_after(ts, seconds):
+    """
+    The iso timestamp @seconds after iso timestamp @ts, to the second
+    """
+    try:
+        t = datetime.strptime(ts[:19], "%Y-%m-%dT%H:%M:%S")
+    except ValueError:
+        return None
+
+    return (t + timedelta(seconds=seconds)).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+class LogIndex(object):
+    """
+    The index of a log file, see `load`
+    """
+
+    def __init__(self, header, entries):
+        self.header = header
+        self.entries = sorted(entries, key=lambda e: e["offset"])
+        self.bloom = _Bloom(header["bloom_bits"], header["bloom_hashes"])
+
+    @classmethod
+    def load(cls, path, opener=None):
+        """
+        The index of log file @path, opened with @opener (default: open),
+        or None if it has none or it is not of this file
+        """
+        try:
+            with open(index_path(path)) as f:
+                header = json.loads(f.readline())
+                entries = []
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # an entry being written
+                        break
+        except (IOError, OSError, ValueError):
+            return None
+
+        if not isinstance(header, dict) or header.get("version") != LOG_INDEX_VERSION:
+            return None
+
+        crc = _head_crc(path, header.get("head_size", 0), opener)
+        if crc is None or crc != header.get("head_crc"):
+            return None
+
+        return cls(header, entries)
+
+    def _selects(self, entry, since, until, masks):
+        if since and entry.get("until") is not None and entry["until"] < since:
+            return False
+        if until and entry.get("since") is not None and entry["since"] >= until:
+            return False
+
+        if masks:
+            bloom = int(entry.get("bloom") or "0", 16)
+            if not any(bloom & m == m for m in masks):
+                return False
+
+        return True
+
+    def ranges(self, since=None, until=None, events=None, size=None):
+        """
+        Byte ranges (start, end) of the log file of @size bytes which may
+        hold events named one of @events at or after iso timestamp @since
+        and before @until. The last end is None for "to the end" when
+        @size is not known.
+        """
+        masks = [self.bloom.mask(e) for e in events or []]
+
+        ranges = []
+        pos = 0
+        for entry in self.entries:
+            start, end = entry["offset"], entry["end"]
+            if start < pos or (size is not None and end > size):
+                continue
+
+            if start > pos:
+                # not indexed, eg: written before the index was started
+                ranges.append([pos, start])
+            if self._selects(entry, since, until, masks):
+                ranges.append([start, end])
+            pos = end
+
+        if size is None or pos < size:
+            ranges.append([pos, size])
+
+        merged = []
+        for start, end in ranges:
+            if merged and merged[-1][1] == start:
+                merged[-1][1] = end
+            else:
+                merged.append([start, end])
+
+        return [tuple(r) for r in merged]
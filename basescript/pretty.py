@@ -0,0 +1,462 @@
+"""
+Rendering of json and binary log files for the `pretty` sub-command
+"""
+
+import os
+import sys
+import time
+import json
+import collections
+
+import structlog
+
+from .binlog import BinaryLogDecoder, is_binary_log, last_magic_offset, BINLOG_MAGIC
+from .logindex import LogIndex
+
+READ_CHUNK_SIZE = 1 << 20
+FOLLOW_POLL_INTERVAL = 0.25
+
+LEVELS = {
+    "debug": 10,
+    "info": 20,
+    "warning": 30,
+    "warn": 30,
+    "error": 40,
+    "exception": 40,
+    "critical": 50,
+    "fatal": 50,
+}
+
+_RENDERER = None
+_FILTER = None
+
+
+def _json_text(value):
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+def _literal(value):
+    """
+    How @value appears in a json line, if it is certainly written verbatim
+    """
+    if not isinstance(value, str):
+        return None
+
+    encoded = json.dumps(value)
+    if encoded[1:-1] != value:
+        # escaped characters
+        return None
+
+    return encoded.encode("utf-8")
+
+
+class LogFilter(object):
+    """
+    Selects log events by minimum @level, event names (@events), exact
+    key values (@where, a dict of key -> text) and a @since / @until range
+    on the iso timestamp. `prefilter` cheaply rejects raw lines which
+    cannot match, before they are decoded.
+    """
+
+    def __init__(self, level=None, events=None, where=None, since=None, until=None):
+        self.level = LEVELS[level.lower()] if level else None
+        self.events = set(events or [])
+        self.where = dict(where or {})
+        self.since = since
+        self.until = until
+
+        # every group must have one of its literals in a matching line
+        self.required = []
+        if self.level is not None:
+            levels = [k for k, v in LEVELS.items() if v >= self.level]
+            self.required.append([_literal(k) for k in levels])
+        if self.events:
+            self.required.append([_literal(e) for e in self.events])
+        for v in self.where.values():
+            # numbers, booleans and null are written bare
+            self.required.append([_literal(v), v.encode("utf-8")])
+
+        self.required = [r for r in self.required if None not in r]
+
+    def __bool__(self):
+        return bool(
+            self.level is not None
+            or self.events
+            or self.where
+            or self.since
+            or self.until
+        )
+
+    __nonzero__ = __bool__
+
+    def prefilter(self, line):
+        for literals in self.required:
+            if not any(l in line for l in literals):
+                return False
+        return True
+
+    def match(self, event):
+        if self.level is not None:
+            if LEVELS.get(event.get("level"), 0) < self.level:
+                return False
+
+        if self.events and event.get("event") not in self.events:
+            return False
+
+        for k, v in self.where.items():
+            if k not in event or _json_text(event[k]) != v:
+                return False
+
+        if self.since or self.until:
+            ts = event.get("timestamp")
+            if not isinstance(ts, str):
+                return False
+            if self.since and ts < self.since:
+                return False
+            if self.until and ts >= self.until:
+                return False
+
+        return True
+
+
+def open_log(path):
+    """
+    Opens a log file for reading bytes. "-" is stdin, *.gz is decompressed.
+    """
+    if path == "-":
+        return getattr(sys.stdin, "buffer", sys.stdin)
+
+    if path.endswith(".gz"):
+        import gzip
+
+        return gzip.open(path, "rb")
+
+    return open(path, "rb", buffering=READ_CHUNK_SIZE)
+
+
+def _peek(f, n):
+    peek = getattr(f, "peek", None)
+    return peek(n)[:n] if peek is not None else b""
+
+
+def _indexed_ranges(path, log_filter):
+    """
+    Byte ranges of log file @path which may hold events matching
+    @log_filter according to its index, None to read all of it
+    """
+    if path == "-" or not log_filter:
+        return None
+    if not (log_filter.since or log_filter.until or log_filter.events):
+        return None
+
+    index = LogIndex.load(path, opener=open_log)
+    if index is None:
+        return None
+
+    # the uncompressed size of gzipped files is not known upfront
+    size = None if path.endswith(".gz") else os.path.getsize(path)
+    return index.ranges(
+        since=log_filter.since,
+        until=log_filter.until,
+        events=log_filter.events,
+        size=size,
+    )
+
+
+def _read_ranges(f, ranges, binary, chunk_size):
+    for start, end in ranges:
+        f.seek(start)
+        decoder = BinaryLogDecoder() if binary else _LineSplitter()
+        pos = start
+
+        while end is None or pos < end:
+            size = chunk_size if end is None else min(chunk_size, end - pos)
+            data = f.read(size)
+            if not data:
+                break
+            pos += len(data)
+
+            items = decoder.feed(data)
+            if items:
+                yield items
+
+        if not binary and decoder.partial:
+            yield [decoder.partial]
+
+
+def read_chunks(paths, chunk_size=READ_CHUNK_SIZE, log_filter=None):
+    """
+    Yields lists of about @chunk_size bytes from each of @paths: lines of
+    json log files and event dicts of binary ones, see `basescript.binlog`.
+    Where a file has an index, see `basescript.logindex`, only the parts
+    of it which may hold events matching @log_filter are read.
+    """
+    for path in paths or ["-"]:
+        f = open_log(path)
+        try:
+            binary = is_binary_log(_peek(f, len(BINLOG_MAGIC)))
+
+            if path == "-":
+                for items in _read_stream(f, binary, chunk_size):
+                    yield items
+                continue
+
+            ranges = _indexed_ranges(path, log_filter)
+            if ranges is not None:
+                for items in _read_ranges(f, ranges, binary, chunk_size):
+                    yield items
+                continue
+
+            if binary:
+                decoder = BinaryLogDecoder()
+                while True:
+                    data = f.read(chunk_size)
+                    if not data:
+                        break
+                    events = decoder.feed(data)
+                    if events:
+                        yield events
+                continue
+
+            while True:
+                lines = f.readlines(chunk_size)
+                if not lines:
+                    break
+                yield lines
+        finally:
+            if path != "-":
+                f.close()
+
+
+def _read_stream(f, binary, chunk_size):
+    """
+    Yields lines, or events of a binary log, of stream @f as soon as they
+    arrive (eg: piped from a running script), batched with whatever else
+    has arrived up to about @chunk_size bytes
+    """
+    decoder = BinaryLogDecoder() if binary else _LineSplitter()
+    read = getattr(f, "read1", f.read)
+
+    while True:
+        data = read(chunk_size)
+        if not data:
+            break
+        items = decoder.feed(data)
+        if items:
+            yield items
+
+    if not binary and decoder.partial:
+        yield [decoder.partial]
+
+
+class _LineSplitter(object):
+    """
+    Complete lines of data fed to it in chunks, like `BinaryLogDecoder`
+    """
+
+    def __init__(self):
+        self.partial = b""
+
+    def feed(self, data, skip_events=False):
+        lines = (self.partial + data).split(b"\n")
+        self.partial = lines.pop()
+        return [l + b"\n" for l in lines]
+
+
+def silence_broken_pipe(out):
+    """
+    Sends what is still written to @out, which the reader has closed (eg:
+    when piped into head), to /dev/null so that flushing it on interpreter
+    exit does not raise BrokenPipeError again
+    """
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, out.fileno())
+
+
+def _open_follow(path, at_end):
+    """
+    Opens @path to follow it from its end or start, with a
+    decoder of its format unless it is still empty
+    """
+    f = open(path, "rb")
+    head = f.read(len(BINLOG_MAGIC))
+    decoder = None
+    if head:
+        decoder = BinaryLogDecoder() if is_binary_log(head) else _LineSplitter()
+    f.seek(0)
+
+    if at_end and decoder is not None:
+        if isinstance(decoder, BinaryLogDecoder):
+            # events to come may use keys defined since the last magic
+            f.seek(_last_keys_offset(f, path))
+            while True:
+                data = f.read(READ_CHUNK_SIZE)
+                if not data:
+                    break
+                decoder.feed(data, skip_events=True)
+        else:
+            f.seek(0, os.SEEK_END)
+
+    return f, decoder
+
+
+def _last_keys_offset(f, path):
+    """
+    Offset in binary log @f from which the keys used by records appended
+    to it can be learned: the end of the last block of its index, where
+    keys are reset, or else the last `BINLOG_MAGIC` in it
+    """
+    size = os.fstat(f.fileno()).st_size
+
+    index = LogIndex.load(path)
+    if index is not None:
+        ends = [e["end"] for e in index.entries if e["end"] <= size]
+        if ends:
+            return max(ends)
+
+    return last_magic_offset(f, size, READ_CHUNK_SIZE)
+
+
+def follow(path, chunk_size=READ_CHUNK_SIZE, poll_interval=FOLLOW_POLL_INTERVAL):
+    """
+    Yields lists of complete lines, or events of a binary log, appended to
+    @path from now on, reopening it when it is rotated or truncated.
+    Never returns.
+    """
+    f, decoder = _open_follow(path, at_end=True)
+
+    while True:
+        data = f.read(chunk_size)
+        if data:
+            if decoder is None:
+                head = data[: len(BINLOG_MAGIC)]
+                decoder = BinaryLogDecoder() if is_binary_log(head) else _LineSplitter()
+
+            items = decoder.feed(data)
+            if items:
+                yield items
+            continue
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+
+        if st is not None and (
+            st.st_ino != os.fstat(f.fileno()).st_ino or st.st_size < f.tell()
+        ):
+            f.close()
+            f, decoder = _open_follow(path, at_end=False)
+            continue
+
+        time.sleep(poll_interval)
+
+
+def _init_renderer(colors, log_filter=None):
+    global _RENDERER, _FILTER
+    _RENDERER = structlog.dev.ConsoleRenderer(colors=colors)
+    _FILTER = log_filter or None
+
+
+def render_line(line):
+    """
+    Renders one json log line, or event of a binary log, lines that are
+    not json are kept as is unless filtering. Returns None for lines
+    filtered out.
+    """
+    if isinstance(line, dict):
+        if _FILTER is not None and not _FILTER.match(line):
+            return None
+        return _RENDERER(None, None, line)
+
+    if _FILTER is not None and not _FILTER.prefilter(line):
+        return None
+
+    text = line.decode("utf-8", "replace").rstrip("\r\n")
+    try:
+        event = json.loads(text)
+    except ValueError:
+        event = None
+
+    if not isinstance(event, dict):
+        return text if _FILTER is None else None
+
+    if _FILTER is not None and not _FILTER.match(event):
+        return None
+
+    return _RENDERER(None, None, event)
+
+
+def render_chunk(lines):
+    rendered = (render_line(line) for line in lines)
+    return "".join(r + "\n" for r in rendered if r is not None)
+
+
+def _render_chunks(chunks, colors, workers, log_filter=None):
+    if workers <= 1:
+        _init_renderer(colors, log_filter)
+        for lines in chunks:
+            yield render_chunk(lines)
+        return
+
+    import multiprocessing
+
+    pool = multiprocessing.Pool(
+        workers, initializer=_init_renderer, initargs=(colors, log_filter)
+    )
+    inflight = collections.deque()
+
+    try:
+        for lines in chunks:
+            inflight.append(pool.apply_async(render_chunk, (lines,)))
+            # bounded so that huge inputs are not read into memory ahead
+            if len(inflight) >= 2 * workers:
+                yield inflight.popleft().get()
+
+        while inflight:
+            yield inflight.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def pretty_print(
+    colors=True,
+    paths=None,
+    workers=None,
+    chunk_size=READ_CHUNK_SIZE,
+    log_filter=None,
+    follow_path=None,
+):
+    """
+    Renders json or binary logs from @paths (default stdin) to stdout, in order,
+    using a pool of @workers processes (default: number of cpus). Only
+    events matching @log_filter (a `LogFilter`) are rendered, reading only
+    the parts of indexed files which may hold them. Stdin is rendered
+    line by line as it arrives. With @follow_path, renders lines as they
+    are appended to it instead.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # lines are rendered as they arrive rather than in parallel batches
+    streaming = bool(follow_path) or not paths or "-" in paths
+
+    if follow_path:
+        chunks = follow(follow_path, chunk_size)
+    else:
+        chunks = read_chunks(paths, chunk_size, log_filter)
+
+    if streaming:
+        workers = 1
+
+    out = sys.stdout
+
+    try:
+        for text in _render_chunks(chunks, colors, workers, log_filter):
+            out.write(text)
+            if streaming:
+                out.flush()
+        out.flush()
+    except BrokenPipeError:
+        silence_broken_pipe(out)
@@ -0,0 +1,236 @@
+"""
+Profilers for `--profile`, wrapping the run of a sub-command
+"""
+
+import os
+import sys
+import collections
+from threading import Thread, Event, current_thread, main_thread
+from threading import enumerate as threads
+
+from .log import PROFILERS, PROFILE_INTERVAL
+
+PROFILE_MAX_DEPTH = 128
+
+# tracemalloc gets slower with every frame it records per allocation
+PROFILE_ALLOC_FRAMES = 32
+PROFILE_ALLOC_INTERVAL = 0.1
+
+
+def _frame_label(code):
+    # ";" separates frames in collapsed stacks
+    return (
+        "%s (%s:%d)" % (code.co_name, code.co_filename, code.co_firstlineno)
+    ).replace(";", ":")
+
+
+class SamplingProfiler(object):
+    """
+    Low overhead cpu profiler: a thread records the stacks of the main
+    thread and of threads started after `start` every @interval seconds;
+    background threads such as the metrics dumper are left out. Output is
+    in the collapsed stack format read by flamegraph.pl and speedscope,
+    one "frame;frame;... N" line per stack, rooted at the thread's name.
+    """
+
+    kind = "cpu"
+    ext = "folded"
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+
+        self._labels = {}
+        self._skip = set()
+        self._stop = Event()
+        self._thread = Thread(target=self._run, name="basescript-profiler")
+        self._thread.daemon = True
+
+    def start(self):
+        main = main_thread()
+        self._skip = {t.ident for t in threads() if t is not main}
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        self._skip.add(current_thread().ident)
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = _frame_label(code)
+        return label
+
+    def sample(self):
+        names = {t.ident: t.name for t in threads()}
+
+        for ident, frame in sys._current_frames().items():
+            if ident in self._skip:
+                continue
+
+            stack = []
+            while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+
+            stack.append(names.get(ident, "thread-%s" % ident))
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+
+        self.samples += 1
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, n in self.stacks.most_common():
+                f.write("%s %d\n" % (";".join(stack), n))
+
+    def top(self, n):
+        """
+        Functions seen running most often, as metric fields
+        """
+        own = collections.Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+
+        total = float(sum(own.values())) or 1
+        return [
+            dict(function=f, samples=c, percent=100 * c / total)
+            for f, c in own.most_common(n)
+        ]
+
+
+class CProfiler(object):
+    """
+    Deterministic profiler using cProfile, slower but exact. Output is
+    a pstats file, see the `pstats` module or snakeviz.
+    """
+
+    kind = "cprofile"
+    ext = "pstats"
+
+    def __init__(self, interval=None):
+        import cProfile
+
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def write(self, path):
+        self.profile.dump_stats(path)
+
+    def top(self, n):
+        import pstats
+
+        stats = pstats.Stats(self.profile).stats
+        rows = sorted(stats.items(), key=lambda kv: kv[1][2], reverse=True)
+
+        return [
+            dict(
+                function="%s (%s:%d)" % (name, filename, line),
+                calls=nc,
+                tottime=tt,
+                cumtime=ct,
+            )
+            for (filename, line, name), (cc, nc, tt, ct, _) in rows[:n]
+        ]
+
+
+class AllocProfiler(object):
+    """
+    Memory profiler using tracemalloc. Traced memory is checked every
+    @interval seconds and a snapshot taken whenever it reaches a new peak.
+    Output is the memory allocated at the peak, by allocating stack, as
+    collapsed stacks weighted by bytes.
+    """
+
+    kind = "alloc"
+    ext = "folded"
+
+    def __init__(self, interval=PROFILE_INTERVAL, frames=PROFILE_ALLOC_FRAMES):
+        # snapshots are much slower than stack samples
+        self.interval = max(interval, PROFILE_ALLOC_INTERVAL)
+        self.frames = frames
+        self.snapshot = None
+        self.peak = 0
+
+        self._stop = Event()
+        self._thread = Thread(target=self._run, name="basescript-profiler")
+        self._thread.daemon = True
+
+    def start(self):
+        import tracemalloc
+
+        tracemalloc.start(self.frames)
+        self._thread.start()
+
+    def stop(self):
+        import tracemalloc
+
+        self._stop.set()
+        self._thread.join()
+
+        self.sample()
+        tracemalloc.stop()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        import tracemalloc
+
+        current, _ = tracemalloc.get_traced_memory()
+        if self.snapshot is None or current > self.peak:
+            self.snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, tracemalloc.__file__)]
+            )
+            self.peak = current
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stat in self.snapshot.statistics("traceback"):
+                # oldest frame first, as in collapsed stacks; tracebacks
+                # were most recent frame first before python 3.7
+                frames = list(stat.traceback)
+                if sys.version_info < (3, 7):
+                    frames.reverse()
+
+                stack = ";".join(
+                    ("%s:%d" % (fr.filename, fr.lineno)).replace(";", ":")
+                    for fr in frames
+                )
+                f.write("%s %d\n" % (stack, stat.size))
+
+    def top(self, n):
+        return [
+            dict(
+                function="%s:%d" % (s.traceback[0].filename, s.traceback[0].lineno),
+                size=s.size,
+                count=s.count,
+            )
+            for s in self.snapshot.statistics("lineno")[:n]
+        ]
+
+
+def make_profiler(kind, interval=PROFILE_INTERVAL):
+    assert kind in PROFILERS, "unknown profiler %r" % kind
+    profiler_class = {
+        "cpu": SamplingProfiler,
+        "cprofile": CProfiler,
+        "alloc": AllocProfiler,
+    }[kind]
+    return profiler_class(interval=interval)
+
+
+def default_profile_path(name, kind, ext):
+    return "%s-%s-%d.%s" % (name, kind, os.getpid(), ext)
@@ -0,0 +1,209 @@
+"""
+Offline aggregation of grouped metrics in json and binary log files,
+for the `metrics` sub-command
+"""
+
+import sys
+import csv
+import json
+import time
+import calendar
+import importlib
+
+from .pretty import read_chunks, silence_broken_pipe, LogFilter, READ_CHUNK_SIZE
+
+ROLLUP_FORMATS = ("json", "csv")
+
+# keys of metric events which are neither grouping keys nor fields
+ROLLUP_IGNORE_KEYS = ("timestamp", "id", "type", "num", "level")
+
+
+def _json_loads():
+    # orjson decodes several times faster when it is installed
+    try:
+        return importlib.import_module("orjson").loads
+    except ImportError:
+        return json.loads
+
+
+class MetricRollup(object):
+    """
+    Aggregates metric events by the values of the @by keys and, with an
+    @interval in seconds, by time bucket. Averages are weighted by each
+    event's `num`. Fields which `dump_metrics` lists in the `_aggregates`
+    of an event as "sum", "count", "min" or "max" are combined that way
+    instead. Memory grows with the number of groups, not events.
+    """
+
+    def __init__(self, by=("event",), interval=None):
+        self.by = tuple(by)
+        self.interval = interval
+        self.groups = {}
+
+        # "YYYY-mm-ddTHH:MM" -> epoch seconds
+        self._minutes = {}
+
+    def bucket(self, ts):
+        if not self.interval:
+            return None
+
+        if not isinstance(ts, str) or len(ts) < 19:
+            return None
+
+        minute = ts[:16]
+        epoch = self._minutes.get(minute)
+        if epoch is None:
+            try:
+                epoch = calendar.timegm(
+                    (
+                        int(ts[0:4]),
+                        int(ts[5:7]),
+                        int(ts[8:10]),
+                        int(ts[11:13]),
+                        int(ts[14:16]),
+                        0,
+                    )
+                )
+            except ValueError:
+                return None
+
+            if len(self._minutes) > 100000:
+                self._minutes.clear()
+            self._minutes[minute] = epoch
+
+        t = epoch + int(ts[17:19])
+        return t - t % self.interval
+
+    def add(self, event):
+        num = event.get("num", 1)
+        if not isinstance(num, (int, float)) or num <= 0:
+            return
+
+        key = (
+            self.bucket(event.get("timestamp")),
+            tuple(event.get(k) for k in self.by),
+        )
+
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = {"num": 0, "fields": {}}
+        group["num"] += num
+        gfields = group["fields"]
+
+        kinds = event.get("_aggregates")
+        if not isinstance(kinds, dict):
+            kinds = {}
+
+        for k, v in event.items():
+            if k in ROLLUP_IGNORE_KEYS or k in self.by:
+                continue
+            if isinstance(v, bool) or not isinstance(v, (int, float)):
+                continue
+
+            # averages and percentile estimates are weighted by num; for
+            # percentiles this is an approximation
+            kind = kinds.get(k, "avg")
+
+            cur = gfields.get(k)
+            if kind not in ("sum", "count", "min", "max"):
+                # (weighted sum, weight)
+                if cur is None:
+                    gfields[k] = [v * num, num]
+                else:
+                    cur[0] += v * num
+                    cur[1] += num
+            elif cur is None:
+                gfields[k] = v
+            elif kind == "min":
+                gfields[k] = min(cur, v)
+            elif kind == "max":
+                gfields[k] = max(cur, v)
+            else:
+                gfields[k] = cur + v
+
+    def rows(self):
+        """
+        Yields one dict per group, ordered by time bucket and group values
+        """
+
+        def order(item):
+            (bucket, values), _ = item
+            return (bucket or 0, tuple(json.dumps(v) for v in values))
+
+        for (bucket, values), group in sorted(self.groups.items(), key=order):
+            row = {}
+            if self.interval:
+                row["timestamp"] = _iso(bucket)
+            row.update(zip(self.by, values))
+            row["num"] = group["num"]
+
+            for k, v in sorted(group["fields"].items()):
+                row[k] = v[0] / v[1] if isinstance(v, list) else v
+
+            yield row
+
+
+def _iso(epoch):
+    if epoch is None:
+        return None
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(epoch))
+
+
+def rollup_metrics(
+    paths=None,
+    by=("event",),
+    interval=None,
+    fmt="json",
+    log_filter=None,
+    chunk_size=READ_CHUNK_SIZE,
+    out=None,
+):
+    """
+    Aggregates metric events from json log files @paths (default stdin)
+    and writes one summary per group to @out as json lines or csv.
+    @log_filter (a `LogFilter`) should select type=metric events.
+    """
+    assert fmt in ROLLUP_FORMATS, "unknown format %r" % fmt
+
+    out = out or sys.stdout
+    loads = _json_loads()
+    rollup = MetricRollup(by=by, interval=interval)
+    log_filter = log_filter or LogFilter(where={"type": "metric"})
+
+    for lines in read_chunks(paths, chunk_size, log_filter):
+        for line in lines:
+            if isinstance(line, dict):
+                # an event of a binary log
+                event = line
+            elif not log_filter.prefilter(line):
+                continue
+            else:
+                try:
+                    event = loads(line)
+                except ValueError:
+                    continue
+
+            if isinstance(event, dict) and log_filter.match(event):
+                rollup.add(event)
+
+    rows = list(rollup.rows())
+
+    try:
+        _write_rows(rows, rollup.by, interval, fmt, out)
+        out.flush()
+    except BrokenPipeError:
+        silence_broken_pipe(out)
+
+
+def _write_rows(rows, by, interval, fmt, out):
+    if fmt == "json":
+        for row in rows:
+            out.write(json.dumps(row) + "\n")
+        return
+
+    columns = (["timestamp"] if interval else []) + list(by) + ["num"]
+    columns += sorted({k for row in rows for k in row} - set(columns))
+
+    writer = csv.DictWriter(out, fieldnames=columns)
+    writer.writeheader()
+    writer.writerows(rows)
@@ -0,0 +1,470 @@
+"""
+Ships rendered log lines to a collector over the network, see
+`init_logger(log_ship=...)`. Lines are batched and sent from a background
+thread, and batches which could not be sent are spooled to disk and
+replayed once the collector is reachable again.
+"""
+
+import os
+import time
+import zlib
+import errno
+import select
+import socket
+import struct
+import collections
+from threading import Thread, Condition, Lock
+
+from .log import LOG_SHIP_COMPRESSION, LOG_SHIP_BATCH_SIZE, LOG_SHIP_BATCH_INTERVAL
+from .log import LOG_SHIP_SPOOL_SIZE, to_bytes
+
+LOG_SHIP_SCHEMES = ("tcp", "udp", "http", "https")
+LOG_SHIP_BUFFER_SIZE = 100000
+LOG_SHIP_TIMEOUT = 5.0
+
+# wait between attempts to reach the collector, doubling up to the max
+LOG_SHIP_RETRY_INTERVAL = 1.0
+LOG_SHIP_RETRY_MAX_INTERVAL = 30.0
+
+# uncompressed bytes per udp datagram, below the 65507 bytes limit
+LOG_SHIP_MAX_DATAGRAM = 60000
+
+
+def _gzip(data):
+    # each batch is a complete gzip member; members concatenated
+    # on a tcp connection are themselves a valid gzip stream
+    z = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return z.compress(data) + z.flush()
+
+
+def _split_lines(data, size):
+    """
+    Splits newline terminated @data into chunks of at most @size
+    bytes, except for single lines longer than that
+    """
+    start = 0
+    while start < len(data):
+        end = data.rfind(b"\n", start, start + size) + 1
+        if end <= start:
+            end = data.find(b"\n", start + size) + 1 or len(data)
+        yield data[start:end]
+        start = end
+
+
+class TCPConnection(object):
+    def __init__(self, host, port, timeout):
+        self.sock = socket.create_connection((host, port), timeout)
+
+    def send(self, payloads):
+        # a collector that went away is only noticed by sending after its
+        # close; check for that first instead of losing the batch
+        readable, _, _ = select.select([self.sock], [], [], 0)
+        if readable and not self.sock.recv(4096, socket.MSG_PEEK):
+            raise ConnectionResetError("collector closed the connection")
+
+        for payload in payloads:
+            self.sock.sendall(payload)
+
+    def close(self):
+        self.sock.close()
+
+
+class UDPConnection(object):
+    def __init__(self, host, port, timeout):
+        family, kind, proto, _, addr = socket.getaddrinfo(
+            host, port, 0, socket.SOCK_DGRAM
+        )[0]
+        self.sock = socket.socket(family, kind, proto)
+        self.sock.settimeout(timeout)
+        # connected, so that an unreachable port fails later sends
+        self.sock.connect(addr)
+
+    def send(self, payloads):
+        for payload in payloads:
+            try:
+                self.sock.send(payload)
+            except OSError as e:
+                if e.errno != errno.EMSGSIZE:
+                    raise
+
+    def close(self):
+        self.sock.close()
+
+
+class HTTPConnection(object):
+    def __init__(self, host, port, timeout, path="/", https=False, gzip=True):
+        import http.client
+
+        conn_class = (
+            http.client.HTTPSConnection if https else http.client.HTTPConnection
+        )
+        self.conn = conn_class(host, port, timeout=timeout)
+        self.conn.connect()
+        self.path = path or "/"
+
+        self.headers = {"Content-Type": "application/x-ndjson"}
+        if gzip:
+            self.headers["Content-Encoding"] = "gzip"
+
+    def send(self, payloads):
+        for payload in payloads:
+            self.conn.request("POST", self.path, payload, self.headers)
+            resp = self.conn.getresponse()
+            resp.read()
+            if resp.status >= 300:
+                raise IOError("collector responded %d %s" % (resp.status, resp.reason))
+
+    def close(self):
+        self.conn.close()
+
+
+class LogSpool(object):
+    """
+    Append-only file of batches which could not be shipped, each stored as
+    a 4 byte length and the batch. How far it was replayed is kept in
+    <path>.offset, so that a restarted process resumes from there. Once
+    fully replayed both files are removed. A spool must not be shared by
+    processes.
+    """
+
+    HEADER = struct.Struct(">I")
+
+    def __init__(self, path, max_size=LOG_SHIP_SPOOL_SIZE):
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.max_size = max_size
+
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+        self.offset = 0
+        if os.path.exists(self.offset_path):
+            with open(self.offset_path) as f:
+                self.offset = int(f.read().strip() or 0)
+
+        self._recover()
+
+    def _recover(self):
+        # drop a batch torn by a crash while appending, and
+        # an offset which does not point into the spool
+        end = 0
+        with open(self.path, "ab+") as f:
+            while end < self.size:
+                f.seek(end)
+                header = f.read(self.HEADER.size)
+                if len(header) < self.HEADER.size:
+                    break
+
+                (n,) = self.HEADER.unpack(header)
+                if end + self.HEADER.size + n > self.size:
+                    break
+                end += self.HEADER.size + n
+
+            f.truncate(end)
+
+        self.size = end
+        if self.offset > self.size:
+            self.offset = 0
+        self.commit(self.offset)
+
+    def pending(self):
+        return self.offset < self.size
+
+    def append(self, data):
+        """
+        Appends batch @data, or returns False if the spool is full
+        """
+        n = self.HEADER.size + len(data)
+        if self.size + n > self.max_size:
+            return False
+
+        with open(self.path, "ab") as f:
+            f.write(self.HEADER.pack(len(data)) + data)
+
+        self.size += n
+        return True
+
+    def batches(self):
+        """
+        Yields (batch, offset after it) for batches not yet replayed
+        """
+        with open(self.path, "rb") as f:
+            offset = self.offset
+            f.seek(offset)
+            while offset < self.size:
+                (n,) = self.HEADER.unpack(f.read(self.HEADER.size))
+                offset += self.HEADER.size + n
+                yield f.read(n), offset
+
+    def commit(self, offset):
+        """
+        Marks everything before @offset as replayed
+        """
+        if offset >= self.size:
+            for path in (self.path, self.offset_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.offset = self.size = 0
+            return
+
+        tmp = self.offset_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(offset))
+        os.replace(tmp, self.offset_path)
+        self.offset = offset
+
+
+class LogShipper(object):
+    """
+    Stream sending log lines to a collector at @url from a background
+    thread, in batches of up to @batch_size lines at least every
+    @batch_interval seconds over a persistent connection.
+
+    tcp://host:port sends the lines, gzip members when compressed.
+    udp://host:port sends datagrams of whole lines, gzipped when compressed.
+    http(s)://host:port/path POSTs every batch, "Content-Encoding: gzip"
+    when compressed; a response other than 2xx is a failure.
+
+    While the collector can not be reached, batches are appended to the
+    @spool file (see `LogSpool`) and replayed in order on reconnecting;
+    without a spool, or once it holds @spool_size bytes, they are dropped.
+    At most @buffer_size lines wait in memory, more are dropped rather
+    than blocking the logging thread. Delivery is at least once, except
+    that tcp and udp have no acknowledgements so a batch sent just as the
+    collector goes away may be lost.
+    """
+
+    def __init__(
+        self,
+        url,
+        batch_size=LOG_SHIP_BATCH_SIZE,
+        batch_interval=LOG_SHIP_BATCH_INTERVAL,
+        compress="gzip",
+        spool=None,
+        spool_size=LOG_SHIP_SPOOL_SIZE,
+        buffer_size=LOG_SHIP_BUFFER_SIZE,
+        timeout=LOG_SHIP_TIMEOUT,
+    ):
+        from urllib.parse import urlsplit
+
+        parts = urlsplit(url)
+        assert parts.scheme in LOG_SHIP_SCHEMES, "unknown log ship url %r" % url
+        assert compress in LOG_SHIP_COMPRESSION, "unknown compression %r" % compress
+        assert batch_size > 0, "expected positive batch_size but got %r" % batch_size
+
+        self.url = url
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port or {"http": 80, "https": 443}.get(parts.scheme)
+        self.path = parts.path + ("?" + parts.query if parts.query else "")
+        assert self.host and self.port, "expected host:port in %r" % url
+
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.compress = compress != "none"
+        self.buffer_size = buffer_size
+        self.timeout = timeout
+        self.spool = LogSpool(spool, spool_size) if spool else None
+
+        # lines sent (including replayed), spooled, replayed from the
+        # spool and dropped; see `take_counts`
+        self.counts = collections.Counter()
+        self._counts_lock = Lock()
+
+        self._conn = None
+        self._retry_at = 0
+        self._retry_interval = 0
+
+        self._buf = collections.deque()
+        self._cond = Condition(Lock())
+        self._busy = False
+        self._closed = False
+        self._draining = 0
+
+        self._thread = Thread(target=self._ship_forever, name="basescript-log-ship")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, data):
+        with self._cond:
+            if self._closed:
+                return
+
+            if len(self._buf) >= self.buffer_size:
+                self._count(dropped=1)
+                return
+
+            self._buf.append(data)
+            if len(self._buf) >= self.batch_size:
+                self._cond.notify_all()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        # batches are sent every @batch_interval; use `drain` to wait
+        pass
+
+    def drain(self, timeout=None):
+        """
+        Blocks until everything written so far was sent, spooled or
+        dropped. Returns False if @timeout expired first.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+
+        with self._cond:
+            # ship what is buffered without waiting for the batch interval
+            self._draining += 1
+            self._cond.notify_all()
+            try:
+                while self._buf or self._busy:
+                    if not self._thread.is_alive():
+                        return False
+
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        return False
+
+                    self._cond.wait(remaining)
+            finally:
+                self._draining -= 1
+
+        return True
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+
+        self._thread.join()
+        self._disconnect()
+
+    def take_counts(self):
+        """
+        Returns and resets `counts`
+        """
+        with self._counts_lock:
+            counts, self.counts = self.counts, collections.Counter()
+        return counts
+
+    def _count(self, **counts):
+        with self._counts_lock:
+            self.counts.update(counts)
+
+    def _ship_forever(self):
+        while True:
+            with self._cond:
+                deadline = time.time() + self.batch_interval
+                while len(self._buf) < self.batch_size and not self._closed:
+                    remaining = deadline - time.time()
+                    if remaining <= 0 or (self._buf and self._draining):
+                        break
+                    self._cond.wait(remaining)
+
+                if self._closed and not self._buf:
+                    return
+
+                n = min(len(self._buf), self.batch_size)
+                batch = [self._buf.popleft() for _ in range(n)]
+                self._busy = True
+
+            try:
+                if batch:
+                    self._ship(b"".join(to_bytes(l) for l in batch))
+
+                # left for the next run rather than delaying exit
+                if not self._closed:
+                    self._replay()
+            except Exception:
+                # the logger cannot log its own failures; keep shipping
+                pass
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def _ship(self, data):
+        lines = data.count(b"\n")
+
+        # while older batches wait in the spool, queue behind them
+        if self.spool is not None and self.spool.pending():
+            return self._spool(data, lines)
+
+        if self._send(data):
+            self._count(sent=lines)
+        else:
+            self._spool(data, lines)
+
+    def _spool(self, data, lines):
+        if self.spool is not None and self.spool.append(data):
+            self._count(spooled=lines)
+        else:
+            self._count(dropped=lines)
+
+    def _replay(self):
+        if self.spool is None or not self.spool.pending():
+            return
+
+        for data, offset in self.spool.batches():
+            if not self._send(data):
+                return
+
+            lines = data.count(b"\n")
+            self._count(sent=lines, replayed=lines)
+            self.spool.commit(offset)
+
+    def _payloads(self, data):
+        if self.scheme == "udp":
+            chunks = _split_lines(data, LOG_SHIP_MAX_DATAGRAM)
+        else:
+            chunks = [data]
+
+        return [_gzip(c) if self.compress else c for c in chunks]
+
+    def _connect(self):
+        if self.scheme == "tcp":
+            return TCPConnection(self.host, self.port, self.timeout)
+        if self.scheme == "udp":
+            return UDPConnection(self.host, self.port, self.timeout)
+
+        return HTTPConnection(
+            self.host,
+            self.port,
+            self.timeout,
+            path=self.path,
+            https=self.scheme == "https",
+            gzip=self.compress,
+        )
+
+    def _disconnect(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def _send(self, data):
+        """
+        Sends batch @data, returns False if the collector can not be
+        reached now or was given up on until `_retry_at`
+        """
+        try:
+            if self._conn is None:
+                if time.time() < self._retry_at:
+                    return False
+                self._conn = self._connect()
+
+            self._conn.send(self._payloads(data))
+        except Exception:
+            self._disconnect()
+            self._retry_interval = min(
+                max(self._retry_interval * 2, LOG_SHIP_RETRY_INTERVAL),
+                LOG_SHIP_RETRY_MAX_INTERVAL,
+            )
+            self._retry_at = time.time() + self._retry_interval
+            return False
+
+        self._retry_interval = 0
+        return True
@@ -0,0 +1,50 @@
+"""
+Measures the per event cost of adding the timestamp and id keys,
+comparing TimeStamper + uuid1 ids with the timestamp cache + counter ids.
+
+python bench_event_keys.py --quiet run
+"""
+
+import time
+
+import structlog
+
+from basescript import BaseScript
+from basescript.log import (
+    _cached_timestamper,
+    _uuid_event_id_generator,
+    _counter_event_id,
+)
+
+
+class BenchEventKeys(BaseScript):
+    DESC = "Benchmark event timestamps and ids"
+
+    def define_args(self, parser):
+        parser.add_argument(
+            "--events", type=int, default=200000, help="Events per measurement"
+        )
+
+    def measure(self, timestamper, event_id):
+        n = self.args.events
+
+        t = time.time()
+        for _ in range(n):
+            event = timestamper(None, "info", {"event": "x"})
+            event["id"] = event_id()
+
+        return (time.time() - t) / n * 1e9
+
+    def run(self):
+        default = self.measure(
+            structlog.processors.TimeStamper(fmt="iso"), _uuid_event_id_generator()
+        )
+        fast = self.measure(_cached_timestamper, _counter_event_id)
+
+        print("TimeStamper + uuid       %8.0f ns/event" % default)
+        print("TimestampCache + counter %8.0f ns/event" % fast)
+        print("saved                    %8.0f ns/event" % (default - fast))
+
+
+if __name__ == "__main__":
+    BenchEventKeys().start()
@@ -0,0 +1,101 @@
+"""
+Measures how long `import basescript` takes in a fresh interpreter,
+using `python -X importtime`, and fails when the median exceeds a budget
+or when a module of an optional feature is imported along the way.
+Lists the slowest modules imported.
+
+python bench_import.py --quiet run --budget 150
+"""
+
+import sys
+import subprocess
+
+from basescript import BaseScript
+
+# imported only by the features which use them
+DEFERRED_MODULES = (
+    "basescript.pretty",
+    "basescript.rollup",
+    "basescript.profiling",
+    "basescript.exporters",
+    "basescript.shipping",
+    "basescript.binlog",
+    "basescript.logindex",
+    "asyncio",
+    "gzip",
+    "yaml",
+    "multiprocessing",
+)
+
+
+def import_times(module):
+    """
+    Returns {module: (self us, cumulative us)} for one import of @module
+    """
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import %s" % module],
+        stderr=subprocess.PIPE,
+        check=True,
+    ).stderr.decode()
+
+    times = {}
+    for line in out.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+
+        own, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = (int(own), int(cumulative))
+
+    return times
+
+
+class BenchImport(BaseScript):
+    DESC = "Benchmark and budget the import time of basescript"
+
+    def define_args(self, parser):
+        parser.add_argument("--module", default="basescript", help="Module to import")
+        parser.add_argument(
+            "--runs", type=int, default=5, help="Fresh interpreters to measure"
+        )
+        parser.add_argument(
+            "--budget", type=float, default=150, help="Maximum median time in ms"
+        )
+        parser.add_argument(
+            "--deferred",
+            default=[],
+            action="append",
+            help="Module which must not be imported, can be repeated, "
+            "default: the modules of optional features",
+        )
+        parser.add_argument(
+            "--top", type=int, default=10, help="Slowest modules to list"
+        )
+
+    def run(self):
+        module = self.args.module
+        runs = [import_times(module) for _ in range(max(self.args.runs, 1))]
+
+        totals = sorted(r[module][1] / 1000.0 for r in runs)
+        median = totals[len(totals) // 2]
+
+        last = runs[-1]
+        slowest = sorted(last.items(), key=lambda kv: kv[1][0], reverse=True)
+        for name, (own, cumulative) in slowest[: self.args.top]:
+            print("%-40s %8.1f ms %8.1f ms" % (name, own / 1000.0, cumulative / 1000.0))
+
+        print(
+            "import %s: %.1f ms median, budget %.1f ms"
+            % (module, median, self.args.budget)
+        )
+
+        deferred = self.args.deferred or DEFERRED_MODULES
+        imported = sorted(set(m for r in runs for m in r) & set(deferred))
+        for name in imported:
+            print("%s imported, expected only when used" % name)
+
+        if median > self.args.budget or imported:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    BenchImport().start()
@@ -0,0 +1,80 @@
+"""
+Compares events/sec of the json serializers `JSONRenderer` can use
+on representative log events. Serializers that are not installed
+are skipped.
+
+python bench_json.py --quiet run --events 100000
+"""
+
+import time
+import uuid
+from datetime import datetime
+
+from basescript import BaseScript
+from basescript.log import JSONRenderer, JSON_SERIALIZERS
+
+EVENTS = {
+    "log": {
+        "event": "request handled",
+        "level": "info",
+        "timestamp": "2018-03-01T10:11:12.123456Z",
+        "id": "20180301T101112_9f0c1e3a1d5b11e8b4670ed5f89f718b",
+        "type": "log",
+        "host": "web-01",
+        "name": "api",
+        "path": "/v1/search",
+        "status": 200,
+    },
+    "metric": {
+        "event": "request_done",
+        "level": "info",
+        "timestamp": "2018-03-01T10:11:12.123456Z",
+        "id": "20180301T101112_9f0c1e3a1d5b11e8b4670ed5f89f718c",
+        "type": "metric",
+        "host": "web-01",
+        "num": 1042,
+        "duration": 0.0123,
+        "duration_p99": 0.2,
+        "bytes": 10234.5,
+    },
+    "objects": {
+        "event": "job scheduled",
+        "level": "info",
+        "host": "web-01",
+        "job": uuid.uuid4(),
+        "at": datetime(2018, 3, 1, 10, 11, 12),
+        "tags": ["a", "b", "c"],
+    },
+}
+
+
+class BenchJSON(BaseScript):
+    DESC = "Benchmark json serializers"
+
+    def define_args(self, parser):
+        parser.add_argument(
+            "--events", type=int, default=100000, help="Events rendered per run"
+        )
+
+    def run(self):
+        for serializer in JSON_SERIALIZERS:
+            if serializer == "auto":
+                continue
+
+            try:
+                renderer = JSONRenderer(serializer)
+            except ImportError:
+                print("%-8s not installed" % serializer)
+                continue
+
+            for name, event in EVENTS.items():
+                t = time.time()
+                for _ in range(self.args.events):
+                    renderer(None, "info", event)
+                rate = self.args.events / (time.time() - t)
+
+                print("%-8s %-8s %12.0f events/sec" % (serializer, name, rate))
+
+
+if __name__ == "__main__":
+    BenchJSON().start()
@@ -0,0 +1,108 @@
+"""
+Compares the json and binary --log-file formats: bytes per event and
+events per second written by a fresh script logging typical events to a
+file, and events per second read back.
+
+python bench_log_format.py --quiet run --events 200000
+"""
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+from basescript import BaseScript
+from basescript.pretty import read_chunks
+
+
+class LogEvents(BaseScript):
+    DESC = "Logs --events typical events to --log-file"
+
+    def define_args(self, parser):
+        parser.add_argument("--events", type=int, default=100000)
+
+    def run(self):
+        log = self.log.bind(worker="fetcher-3")
+        t = time.time()
+        for i in range(self.args.events):
+            log.info(
+                "fetched page",
+                url="https://example.com/items/%d" % i,
+                status=200,
+                size=18243 + i % 1000,
+                duration=0.0123,
+                cached=i % 3 == 0,
+            )
+        print(time.time() - t)
+
+
+class BenchLogFormat(BaseScript):
+    DESC = "Benchmark the json and binary log file formats"
+
+    def define_args(self, parser):
+        parser.add_argument(
+            "--events", type=int, default=100000, help="Events logged per format"
+        )
+        parser.add_argument(
+            "--json-serializer",
+            default="json",
+            help="--log-json-serializer of the json format",
+        )
+
+    def write(self, path, fmt):
+        cmd = [
+            sys.executable,
+            __file__,
+            "--quiet",
+            "--log-file",
+            path,
+            "--log-file-format",
+            fmt,
+            "--log-json-serializer",
+            self.args.json_serializer,
+            "run",
+            "--events",
+            str(self.args.events),
+        ]
+        env = dict(os.environ, BENCH_LOG_FORMAT="1")
+        out = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, check=True)
+        return float(out.stdout.split()[-1])
+
+    def read(self, path):
+        import json
+
+        t = time.time()
+        n = 0
+        for items in read_chunks([path]):
+            for item in items:
+                if not isinstance(item, dict):
+                    item = json.loads(item)
+                n += 1
+        return n, time.time() - t
+
+    def run(self):
+        tmp = tempfile.mkdtemp()
+        n = self.args.events
+
+        print("%-7s %12s %14s %14s" % ("format", "bytes/event", "written/s", "read/s"))
+        for fmt in ("json", "binary"):
+            path = os.path.join(tmp, "bench.%s" % fmt)
+            write_time = self.write(path, fmt)
+            events, read_time = self.read(path)
+            size = os.path.getsize(path)
+            os.remove(path)
+
+            print(
+                "%-7s %12.1f %14.0f %14.0f"
+                % (fmt, size / float(events), n / write_time, events / read_time)
+            )
+
+        os.rmdir(tmp)
+
+
+if __name__ == "__main__":
+    if os.environ.get("BENCH_LOG_FORMAT"):
+        LogEvents().start()
+    else:
+        BenchLogFormat().start()
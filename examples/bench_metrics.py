@@ -0,0 +1,112 @@
+"""
+Measures metric recording throughput of `metrics_grouping_processor`
+against the previous implementation that aggregated every metric under
+one process wide lock.
+
+python bench_metrics.py --quiet run --threads 1 8 32
+"""
+
+import time
+import numbers
+from threading import Thread, Lock
+
+import structlog
+
+from basescript import BaseScript
+from basescript.log import metrics_grouping_processor, collect_metrics
+
+GLOBAL_STATE = {}
+GLOBAL_STATE_LOCK = Lock()
+
+
+def global_lock_processor(logger_class, log_method, event):
+    # metrics_grouping_processor as it was before sharding
+    for k in ("timestamp", "type", "id"):
+        if k not in event:
+            continue
+        event.pop(k)
+
+    event = {k: v for k, v in event.items() if not k.startswith("_")}
+
+    key = []
+    fields = []
+
+    for k, v in sorted(event.items()):
+        (fields if isinstance(v, (numbers.Number, bool)) else key).append((k, v))
+
+    key = (tuple(key), tuple(sorted(k for k, _ in fields)))
+    with GLOBAL_STATE_LOCK:
+        state = GLOBAL_STATE.get(key, {"num": 0, "fields": {}})
+        sfields = state["fields"]
+        num = state["num"]
+
+        for fk, fv in fields:
+            favg = sfields.get(fk, 0.0)
+            favg = (favg * num + fv) / (num + 1)
+            sfields[fk] = favg
+
+        state["num"] += 1
+        GLOBAL_STATE[key] = state
+
+    raise structlog.DropEvent
+
+
+def record(processor, n):
+    for i in range(n):
+        event = {
+            "event": "request_done",
+            "level": "info",
+            "type": "metric",
+            "handler": "search",
+            "duration": 0.25,
+            "bytes": i,
+        }
+        try:
+            processor(None, "info", event)
+        except structlog.DropEvent:
+            pass
+
+
+class BenchMetrics(BaseScript):
+    DESC = "Benchmark metric aggregation"
+
+    def define_args(self, parser):
+        parser.add_argument(
+            "--threads", type=int, nargs="+", default=[1, 8, 32], help="Thread counts"
+        )
+        parser.add_argument(
+            "--events", type=int, default=200000, help="Metric events per run"
+        )
+
+    def measure(self, processor, nthreads):
+        per_thread = self.args.events // nthreads
+        threads = [
+            Thread(target=record, args=(processor, per_thread)) for _ in range(nthreads)
+        ]
+
+        t = time.time()
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        elapsed = time.time() - t
+
+        return per_thread * nthreads / elapsed
+
+    def run(self):
+        impls = (
+            ("global_lock", global_lock_processor),
+            ("current", metrics_grouping_processor),
+        )
+
+        for nthreads in self.args.threads:
+            for name, processor in impls:
+                rate = self.measure(processor, nthreads)
+                print("%-12s threads=%-3d %12.0f events/sec" % (name, nthreads, rate))
+
+            GLOBAL_STATE.clear()
+            collect_metrics()
+
+
+if __name__ == "__main__":
+    BenchMetrics().start()
@@ -0,0 +1,81 @@
+"""
+Measures the time from starting a script with 100 sub-commands, each
+defining 20 arguments, until its `run` is called; with the sub-commands
+registered eagerly (`add_parser`) and lazily (`add_lazy_parser`).
+
+python bench_subcommands.py --quiet --log-format json run
+"""
+
+import os
+import sys
+import time
+import subprocess
+
+from basescript import BaseScript
+
+SUBCOMMANDS = 100
+SUBCOMMAND_ARGS = 20
+
+
+def define_synthetic_args(parser):
+    for i in range(SUBCOMMAND_ARGS):
+        parser.add_argument(
+            "--option-%d" % i,
+            type=int,
+            default=i,
+            choices=range(100),
+            help="Synthetic option %d, default: %%(default)s" % i,
+        )
+
+
+class ManyCommands(BaseScript):
+    DESC = "Script with many sub-commands"
+
+    def define_subcommands(self, subcommands):
+        super(ManyCommands, self).define_subcommands(subcommands)
+
+        lazy = os.environ["BENCH_SUBCOMMANDS"] == "lazy"
+        for i in range(SUBCOMMANDS):
+            name = "command-%d" % i
+            if lazy:
+                subcommands.add_lazy_parser(
+                    name, define_synthetic_args, help="Synthetic sub-command"
+                )
+            else:
+                cmd = subcommands.add_parser(name, help="Synthetic sub-command")
+                define_synthetic_args(cmd)
+
+    def run(self):
+        print(time.time())
+
+
+class BenchSubcommands(BaseScript):
+    DESC = "Benchmark building the parser of a script with many sub-commands"
+
+    def define_args(self, parser):
+        parser.add_argument(
+            "--runs", type=int, default=10, help="Fresh processes per measurement"
+        )
+
+    def time_to_run(self, mode):
+        env = dict(os.environ, BENCH_SUBCOMMANDS=mode)
+        cmd = [sys.executable, __file__, "--quiet", "--log-format", "json", "run"]
+
+        times = []
+        for _ in range(self.args.runs):
+            t = time.time()
+            out = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, check=True)
+            times.append(float(out.stdout.split()[-1]) - t)
+
+        return sorted(times)[len(times) // 2] * 1000
+
+    def run(self):
+        for mode in ("eager", "lazy"):
+            print("%-5s %8.1f ms to run" % (mode, self.time_to_run(mode)))
+
+
+if __name__ == "__main__":
+    if os.environ.get("BENCH_SUBCOMMANDS"):
+        ManyCommands().start()
+    else:
+        BenchSubcommands().start()
@@ -0,0 +1,176 @@
+import io
+import unittest
+
+from basescript.binlog import (
+    BinaryLogEncoder,
+    BinaryLogDecoder,
+    BINLOG_MAGIC,
+    last_magic_offset,
+    _pure_packb,
+    _pure_unpackb,
+)
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+VALUES = [
+    0,
+    127,
+    128,
+    255,
+    256,
+    65535,
+    65536,
+    (1 << 32) - 1,
+    1 << 32,
+    (1 << 64) - 1,
+    -1,
+    -32,
+    -33,
+    -128,
+    -129,
+    -32768,
+    -32769,
+    -(1 << 31),
+    -(1 << 31) - 1,
+    -(1 << 63),
+    0.0,
+    1.5,
+    -2.25e300,
+    "",
+    "a" * 31,
+    "b" * 32,
+    "c" * 255,
+    "d" * 256,
+    "e" * 65536,
+    "héllo ☃",
+    b"",
+    b"\x00\xff" * 200,
+    b"x" * 65536,
+    None,
+    True,
+    False,
+    list(range(15)),
+    list(range(16)),
+    list(range(65536)),
+    {"k%d" % i: i for i in range(15)},
+    {"k%d" % i: i for i in range(16)},
+    {"nested": {"list": [1, "two", 3.0, None, {"deep": [True]}]}},
+]
+
+
+class TestPureMsgpack(unittest.TestCase):
+    def test_roundtrip(self):
+        packb = _pure_packb(None)
+        for v in VALUES:
+            self.assertEqual(_pure_unpackb(packb(v)), v)
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_same_as_msgpack(self):
+        packb = _pure_packb(None)
+        for v in VALUES:
+            packed = msgpack.packb(v, use_bin_type=True)
+            self.assertEqual(packb(v), packed, v if len(packed) < 100 else type(v))
+            self.assertEqual(_pure_unpackb(packed), v)
+
+    def test_other_types(self):
+        packb = _pure_packb(lambda v: sorted(v))
+        self.assertEqual(_pure_unpackb(packb({1, 3, 2})), [1, 2, 3])
+        self.assertEqual(_pure_unpackb(packb(1 << 70)), str(1 << 70))
+        self.assertEqual(_pure_unpackb(packb((1, 2))), [1, 2])
+
+
+def _events():
+    return [
+        {"event": "start", "level": "info", "n": 1},
+        {"event": "request", "level": "info", "path": "/", "status": 200},
+        {"event": "request", "level": "info", "path": "/x", "status": 404},
+        {"level": "error", "event": "failed", "big": 1 << 70, "data": {"a": [1]}},
+    ]
+
+
+def _encode(events, pure=False):
+    encoder = BinaryLogEncoder(default=repr)
+    if pure:
+        encoder._packb = encoder._pure_packb
+
+    data = encoder.reset()
+    for event in events:
+        data += encoder.encode(event)
+    return data
+
+
+class TestBinaryLogDecoder(unittest.TestCase):
+    def expected(self):
+        events = _events()
+        events[3] = dict(events[3], big=str(1 << 70))
+        return events
+
+    def decode_bytewise(self, data, pure=False):
+        decoder = BinaryLogDecoder()
+        if pure:
+            decoder._unpackb = _pure_unpackb
+
+        events = []
+        for i in range(len(data)):
+            events.extend(decoder.feed(data[i : i + 1]))
+        self.assertEqual(decoder.buf, b"")
+        return events
+
+    def test_fed_byte_by_byte(self):
+        for pure_encoder in (False, True):
+            for pure_decoder in (False, True):
+                data = _encode(_events(), pure=pure_encoder)
+                events = self.decode_bytewise(data, pure=pure_decoder)
+                self.assertEqual(events, self.expected())
+
+    def test_concatenated_files(self):
+        # each starts with the magic, which resets the keys
+        data = _encode(_events()[:2]) + _encode(_events()[2:])
+        self.assertEqual(self.decode_bytewise(data), self.expected())
+
+    def test_skip_events_learns_keys(self):
+        encoder = BinaryLogEncoder()
+        head = encoder.reset() + encoder.encode({"event": "a", "k": 1})
+        tail = encoder.encode({"event": "b", "k": 2})
+
+        decoder = BinaryLogDecoder()
+        self.assertEqual(decoder.feed(head, skip_events=True), [])
+        self.assertEqual(decoder.feed(tail), [{"event": "b", "k": 2}])
+
+    def test_not_a_binary_log(self):
+        with self.assertRaises(ValueError):
+            BinaryLogDecoder().feed(b"\x00not a binary log")
+
+
+class TestLastMagicOffset(unittest.TestCase):
+    def test_last_magic(self):
+        first = _encode(_events())
+        data = first + _encode(_events())
+        self.assertEqual(last_magic_offset(io.BytesIO(data), len(data)), len(first))
+        self.assertEqual(last_magic_offset(io.BytesIO(first), len(first)), 0)
+
+    def test_small_chunks(self):
+        first = _encode(_events())
+        data = first + _encode(_events())
+        f = io.BytesIO(data)
+        self.assertEqual(last_magic_offset(f, len(data), chunk_size=7), len(first))
+
+    def test_magic_bytes_in_an_event(self):
+        # packs to the same bytes as the magic
+        fake = list(BINLOG_MAGIC)
+        events = [{"event": "x", "v": 1}, {"event": "y", "v": fake}]
+        for after in ([], [{"event": "z", "w": 2}], [{"event": "z", "v": 3}]):
+            data = _encode(events + after)
+            self.assertIn(BINLOG_MAGIC, data[1:])
+            self.assertEqual(last_magic_offset(io.BytesIO(data), len(data)), 0)
+
+        first = _encode(events)
+        data = first + _encode(events)
+        self.assertEqual(last_magic_offset(io.BytesIO(data), len(data)), len(first))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+import os
+import sys
+import subprocess
+import unittest
+
+# imported only by the features which use them, see examples/bench_import.py
+DEFERRED_MODULES = (
+    "basescript.pretty",
+    "basescript.rollup",
+    "basescript.binlog",
+    "basescript.logindex",
+    "basescript.shipping",
+    "basescript.exporters",
+    "basescript.profiling",
+)
+
+
+class TestImports(unittest.TestCase):
+    def test_features_are_imported_when_used(self):
+        code = "import sys, basescript; print(' '.join(sorted(sys.modules)))"
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        out = subprocess.check_output([sys.executable, "-c", code], cwd=root)
+        imported = set(out.decode().split()) & set(DEFERRED_MODULES)
+        self.assertEqual(imported, set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+import os
+import sys
+import json
+import time
+import gzip
+import random
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from basescript.log import LogHistogram, FileWrapper
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _exact(values, q):
+    values = sorted(values)
+    return values[int(q * (len(values) - 1))]
+
+
+class TestLogHistogram(unittest.TestCase):
+    QUANTILES = (0, 0.01, 0.25, 0.5, 0.9, 0.99, 0.999, 1)
+
+    def assertAccurate(self, hist, values):
+        for q in self.QUANTILES:
+            expected = _exact(values, q)
+            got = hist.quantile(q)
+            self.assertLessEqual(
+                abs(got - expected),
+                LogHistogram.RELATIVE_ACCURACY * abs(expected) + 1e-12,
+                "q=%s got %r expected %r" % (q, got, expected),
+            )
+
+    def test_quantiles(self):
+        rnd = random.Random(1)
+        for values in (
+            [rnd.lognormvariate(0, 2) for _ in range(20000)],
+            [rnd.uniform(-100, 100) for _ in range(20000)],
+            [rnd.expovariate(10) for _ in range(20000)] + [0.0] * 100,
+        ):
+            hist = LogHistogram()
+            for v in values:
+                hist.add(v)
+            self.assertEqual(hist.count, len(values))
+            self.assertAccurate(hist, values)
+
+    def test_merge(self):
+        rnd = random.Random(2)
+        values = [rnd.paretovariate(1.5) for _ in range(10000)]
+
+        merged = LogHistogram()
+        for i in range(0, len(values), 1000):
+            part = LogHistogram()
+            for v in values[i : i + 1000]:
+                part.add(v)
+            merged.merge(part)
+
+        self.assertAccurate(merged, values)
+
+    def test_inf_and_nan_are_ignored(self):
+        hist = LogHistogram()
+        for v in (1.0, float("inf"), float("-inf"), float("nan")):
+            hist.add(v)
+        self.assertEqual(hist.count, 1)
+
+    def test_empty(self):
+        self.assertIsNone(LogHistogram().quantile(0.5))
+
+
+def _wait(condition, timeout=5):
+    # for the background thread compressing and expiring segments
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+class TestFileWrapperRotation(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "test.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def segments(self, wrapper):
+        return wrapper.compressor.segments()
+
+    def read(self, path):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rb") as f:
+            return f.read().decode("utf-8")
+
+    def write(self, wrapper, n):
+        lines = ['{"event": "e", "i": %d}\n' % i for i in range(n)]
+        for line in lines:
+            wrapper.write(line)
+        wrapper.f.flush()
+        return "".join(lines)
+
+    def test_rotate_size_and_compress(self):
+        w = FileWrapper(self.path, rotate_size=100, compress="gzip")
+        written = self.write(w, 20)
+
+        _wait(
+            lambda: self.segments(w)
+            and all(p.endswith(".gz") for p in self.segments(w))
+        )
+        segments = self.segments(w)
+
+        self.assertGreater(len(segments), 1)
+        for path in segments:
+            self.assertLessEqual(len(self.read(path)), 100)
+
+        # nothing lost nor reordered, oldest segment first
+        self.assertEqual(
+            "".join(self.read(p) for p in segments) + self.read(self.path), written
+        )
+        w.close()
+
+    def test_keep(self):
+        w = FileWrapper(self.path, rotate_size=100, compress="gzip", keep=2)
+        written = self.write(w, 20)
+
+        _wait(
+            lambda: len(self.segments(w)) == 2
+            and all(p.endswith(".gz") for p in self.segments(w))
+        )
+        kept = "".join(self.read(p) for p in self.segments(w)) + self.read(self.path)
+        self.assertTrue(written.endswith(kept))
+        w.close()
+
+    def test_max_age(self):
+        old = self.path + ".20000101T000000"
+        new = self.path + ".20000101T000001"
+        for path in (old, new):
+            with open(path, "w") as f:
+                f.write("{}\n")
+        os.utime(old, (time.time() - 3600, time.time() - 3600))
+
+        w = FileWrapper(self.path, rotate_size=100, max_age=60)
+        _wait(lambda: not os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+        w.close()
+
+
+# stderr replaced by a text only stream, as in Jupyter
+TEXT_STDERR = """
+import io, sys
+sys.stderr = out = io.StringIO()
+from basescript.log import init_logger, flush_logger
+init_logger(fmt="json", json_serializer="orjson").info("hello", n=1)
+flush_logger()
+sys.__stdout__.write(out.getvalue())
+"""
+
+
+class TestTextOnlyStderr(unittest.TestCase):
+    @unittest.skipIf(orjson is None, "orjson is not installed")
+    def test_orjson(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        out = subprocess.check_output([sys.executable, "-c", TEXT_STDERR], cwd=root)
+        event = json.loads(out.decode())
+        self.assertEqual((event["event"], event["n"]), ("hello", 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import io
+import os
+import json
+import tempfile
+import unittest
+import contextlib
+
+from basescript.pretty import LogFilter, pretty_print
+
+
+def _line(**event):
+    return (json.dumps(event) + "\n").encode("utf-8")
+
+
+class TestLogFilter(unittest.TestCase):
+    def selects(self, log_filter, line):
+        return log_filter.prefilter(line) and log_filter.match(json.loads(line))
+
+    def test_where_text(self):
+        f = LogFilter(where={"type": "metric"})
+        self.assertTrue(self.selects(f, _line(event="x", type="metric")))
+        self.assertFalse(self.selects(f, _line(event="x", type="log")))
+
+    def test_where_number(self):
+        f = LogFilter(where={"i": "1"})
+        self.assertTrue(self.selects(f, _line(event="x", i=1)))
+        self.assertFalse(self.selects(f, _line(event="x", i=2)))
+
+    def test_where_boolean_and_null(self):
+        f = LogFilter(where={"cached": "true"})
+        self.assertTrue(self.selects(f, _line(event="x", cached=True)))
+        self.assertFalse(self.selects(f, _line(event="x", cached=False)))
+
+        f = LogFilter(where={"user": "null"})
+        self.assertTrue(self.selects(f, _line(event="x", user=None)))
+
+
+class TestPrettyPrint(unittest.TestCase):
+    def test_colors_first(self):
+        # colors is still the first positional argument, as in pretty_print(False)
+        with tempfile.NamedTemporaryFile("wb", suffix=".log", delete=False) as f:
+            f.write(_line(event="hello", level="info", timestamp="t"))
+        self.addCleanup(os.remove, f.name)
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            pretty_print(False, [f.name], workers=1)
+
+        self.assertIn("hello", out.getvalue())
+        self.assertNotIn("\x1b[", out.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
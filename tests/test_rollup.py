@@ -0,0 +1,40 @@
+import unittest
+
+from basescript.rollup import MetricRollup
+
+
+class TestMetricRollup(unittest.TestCase):
+    def rollup(self, *events):
+        rollup = MetricRollup(by=("event",))
+        for event in events:
+            rollup.add(dict(event, event="req", type="metric"))
+        return list(rollup.rows())
+
+    def test_generated_aggregates(self):
+        kinds = {"dur_sum": "sum", "dur_max": "max", "dur_count": "count"}
+        (row,) = self.rollup(
+            dict(
+                num=1, dur=1.0, dur_sum=1.0, dur_max=1.0, dur_count=1, _aggregates=kinds
+            ),
+            dict(
+                num=3, dur=3.0, dur_sum=9.0, dur_max=4.0, dur_count=3, _aggregates=kinds
+            ),
+        )
+        self.assertEqual(row["num"], 4)
+        self.assertEqual(row["dur"], 2.5)
+        self.assertEqual(row["dur_sum"], 10.0)
+        self.assertEqual(row["dur_max"], 4.0)
+        self.assertEqual(row["dur_count"], 4)
+
+    def test_suffixed_fields_are_averaged(self):
+        # fields of the script's own named like aggregates
+        (row,) = self.rollup(
+            dict(num=1, retry_count=2, bytes_max=10),
+            dict(num=1, retry_count=4, bytes_max=20),
+        )
+        self.assertEqual(row["retry_count"], 3)
+        self.assertEqual(row["bytes_max"], 15)
+
+
+if __name__ == "__main__":
+    unittest.main()
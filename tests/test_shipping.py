@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from basescript.shipping import LogSpool
+
+
+class TestLogSpool(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "spool")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def spooled(self, *batches):
+        spool = LogSpool(self.path)
+        for batch in batches:
+            self.assertTrue(spool.append(batch))
+        return spool
+
+    def test_resumes_after_restart(self):
+        spool = self.spooled(b"a\n", b"b\n", b"c\n")
+        batches = spool.batches()
+        batch, offset = next(batches)
+        self.assertEqual(batch, b"a\n")
+        spool.commit(offset)
+        batches.close()
+
+        # a restarted process replays from the last commit
+        spool = LogSpool(self.path)
+        self.assertEqual([b for b, _ in spool.batches()], [b"b\n", b"c\n"])
+
+    def test_torn_batch_is_dropped(self):
+        self.spooled(b"a\n", b"b\n")
+        # crashed while appending a batch
+        with open(self.path, "ab") as f:
+            f.write(LogSpool.HEADER.pack(100) + b"partial")
+
+        spool = LogSpool(self.path)
+        self.assertEqual([b for b, _ in spool.batches()], [b"a\n", b"b\n"])
+        self.assertEqual(os.path.getsize(self.path), spool.size)
+
+        # and appending after it is not corrupted by it
+        spool.append(b"c\n")
+        self.assertEqual(
+            [b for b, _ in LogSpool(self.path).batches()], [b"a\n", b"b\n", b"c\n"]
+        )
+
+    def test_offset_past_the_end_is_reset(self):
+        self.spooled(b"a\n")
+        with open(self.path + ".offset", "w") as f:
+            f.write("1000")
+
+        spool = LogSpool(self.path)
+        self.assertEqual([b for b, _ in spool.batches()], [b"a\n"])
+
+    def test_removed_once_replayed(self):
+        spool = self.spooled(b"a\n", b"b\n")
+        for _, offset in list(spool.batches()):
+            spool.commit(offset)
+
+        self.assertFalse(spool.pending())
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path + ".offset"))
+
+    def test_full(self):
+        spool = LogSpool(self.path, max_size=20)
+        self.assertTrue(spool.append(b"x" * 10))
+        self.assertFalse(spool.append(b"y" * 10))
+        self.assertEqual([b for b, _ in spool.batches()], [b"x" * 10])
+
+
+if __name__ == "__main__":
+    unittest.main()